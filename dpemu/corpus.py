@@ -0,0 +1,136 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+
+class Corpus:
+    """A list of strings stored as one contiguous array of Unicode code points.
+
+    The code points of all documents are stored back to back in a single array
+    without any padding, and the boundaries of the documents are given by an array
+    of offsets: the i-th document consists of the code points
+    codepoints[offsets[i]:offsets[i + 1]]. Text filters can modify the code points
+    of the whole corpus at once and the documents are converted back to Python
+    strings only when to_strings is called.
+    """
+
+    def __init__(self, codepoints, offsets):
+        """
+        Args:
+            codepoints (numpy.ndarray): A one-dimensional array of Unicode code points.
+            offsets (numpy.ndarray): A one-dimensional array of document boundaries,
+                one longer than the number of documents.
+        """
+        self.codepoints = codepoints
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Creates a corpus from a list of strings.
+
+        Args:
+            strings (list): A list of strings.
+
+        Returns:
+            Corpus: The corpus.
+        """
+        corpus = cls(None, None)
+        corpus.set_strings(strings)
+        return corpus
+
+    def set_strings(self, strings):
+        """Replaces the documents of the corpus.
+
+        Args:
+            strings (list): A list of strings.
+        """
+        lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+        self.offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        encoded = "".join(strings).encode("utf-32-le", "surrogatepass")
+        self.codepoints = np.frombuffer(encoded, dtype="<u4").astype(np.uint32)
+
+    def to_strings(self):
+        """Returns the documents of the corpus as a list of strings.
+
+        Returns:
+            list: A list of strings.
+        """
+        text = self.codepoints.astype("<u4").tobytes().decode("utf-32-le", "surrogatepass")
+        offsets = self.offsets.tolist()
+        return [text[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def replace(self, positions, table, indices):
+        """Replaces code points with strings, which may be of any length, in one pass.
+
+        Args:
+            positions (numpy.ndarray): Sorted unique positions of the code points to be replaced.
+            table (Corpus): The replacement strings.
+            indices (numpy.ndarray): The index of the replacement string in table for every position.
+        """
+        replacement_starts = table.offsets[indices]
+        replacement_lengths = table.offsets[indices + 1] - replacement_starts
+        if np.all(replacement_lengths == 1):
+            self.codepoints[positions] = table.codepoints[replacement_starts]
+            return
+
+        n_codepoints = len(self.codepoints)
+        slot_lengths = np.ones(n_codepoints, dtype=np.int64)
+        slot_lengths[positions] = replacement_lengths
+        slot_starts = np.zeros(n_codepoints + 1, dtype=np.int64)
+        np.cumsum(slot_lengths, out=slot_starts[1:])
+
+        sources = np.repeat(np.arange(n_codepoints), slot_lengths)
+        codepoints = self.codepoints[sources]
+        source_replacement_starts = np.full(n_codepoints, -1, dtype=np.int64)
+        source_replacement_starts[positions] = replacement_starts
+        replaced = source_replacement_starts[sources] >= 0
+        replaced_sources = sources[replaced]
+        positions_in_replacements = np.flatnonzero(replaced) - slot_starts[replaced_sources]
+        codepoints[replaced] = table.codepoints[source_replacement_starts[replaced_sources]
+                                                + positions_in_replacements]
+        self.codepoints = codepoints
+        self.offsets = slot_starts[self.offsets]
+
+    def lengths(self):
+        """Returns the lengths of the documents.
+
+        Returns:
+            numpy.ndarray: The number of code points in every document.
+        """
+        return np.diff(self.offsets)
+
+    def document_indices(self):
+        """Returns the index of the document of every code point.
+
+        Returns:
+            numpy.ndarray: An array as long as the code point array.
+        """
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.codepoints[start:end].astype("<u4").tobytes().decode("utf-32-le", "surrogatepass")
@@ -0,0 +1,209 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import copy
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+
+from dpemu.nodes import Series, TupleSeries
+from dpemu.pg_utils import first_dimension_length
+from dpemu.rng import RandomStreams
+
+
+class ErrorifiedDataset:
+    """A lazily errorified view of a dataset.
+
+    The errors of an element are generated only when the element is accessed, so the
+    errorified dataset never has to be stored in memory as a whole. Every element is
+    errorified with its own random streams, which are determined by the seed and the index
+    of the element, so the same element is always errorified in the same way regardless of
+    the order in which the elements are accessed. The most recently accessed elements are
+    kept in a bounded LRU cache. Every access returns a copy of the cached element, so
+    modifying a returned element does not change the elements returned later.
+
+    If the root of the error generation tree is a Series or a TupleSeries node, its child
+    nodes are applied to the elements of the data, and every element is equal to the
+    corresponding element of root_node.generate_error(data, err_params, seed). Otherwise
+    the whole tree is applied to every element of the data.
+    """
+
+    def __init__(self, data, root_node, err_params, seed=42, cache_size=128):
+        """
+        Args:
+            data (list or numpy.ndarray): The clean data. If the root node is a TupleSeries,
+                a tuple of lists or arrays.
+            root_node (Node): The root node of the error generation tree.
+            err_params (dict): A dictionary containing the parameters for error generation.
+            seed (int, optional): The seed from which the random streams of the elements are derived.
+                Defaults to 42.
+            cache_size (int, optional): The maximum number of errorified elements kept in the cache.
+                Defaults to 128.
+        """
+        self.data = data
+        self.root_node = root_node.get_parametrized_tree(err_params)
+        self.seed = seed
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        if isinstance(self.root_node, TupleSeries):
+            return first_dimension_length(self.data[0])
+        return first_dimension_length(self.data)
+
+    def __getitem__(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(f"Index {index} is out of range for a dataset of length {length}.")
+
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return copy.deepcopy(self._cache[index])
+
+        item = self._generate_item(index)
+
+        with self._lock:
+            self._cache[index] = item
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return copy.deepcopy(item)
+
+    def _generate_item(self, index):
+        random_streams = RandomStreams(self.seed)
+        root_node = self.root_node.copy_structure()
+        named_dims = {}
+        if isinstance(root_node, (Series, TupleSeries)) and root_node.dim_name:
+            named_dims[root_node.dim_name] = index
+
+        if isinstance(root_node, TupleSeries):
+            containers = [[copy.deepcopy(data[index])] for data in self.data]
+            for i, (child, container) in enumerate(zip(root_node.children, containers)):
+                child.process(container, random_streams.spawn(i).spawn_index(index), (0,), named_dims)
+            return tuple(container[0] for container in containers)
+
+        container = [copy.deepcopy(self.data[index])]
+        if isinstance(root_node, Series):
+            root_node.children[0].process(container, random_streams.spawn_index(index), (0,), named_dims)
+        else:
+            root_node.process(container, random_streams.spawn_index(index), (0,), named_dims)
+        return container[0]
+
+
+def errorify_batch(root_node, err_params, batch, random_state):
+    """Errorifies a single batch. Used by the workers of ErrorifiedBatchLoader.
+
+    Args:
+        root_node (Node): The root node of the error generation tree.
+        err_params (dict): A dictionary containing the parameters for error generation.
+        batch (list or numpy.ndarray): The clean batch.
+        random_state (RandomStreams): The random streams of the batch.
+
+    Returns:
+        list or numpy.ndarray: The errorified batch.
+    """
+    return root_node.generate_error(batch, err_params, random_state)
+
+
+class ErrorifiedBatchLoader:
+    """An iterable which yields errorified minibatches of a dataset.
+
+    The error generation tree is applied to every batch as if the batch was the whole dataset,
+    so the root of the tree is usually a Series node. While the consumer handles the current batch,
+    the upcoming batches are errorified in the background by a pool of worker threads or processes.
+    At most prefetch batches are waiting to be consumed at any time.
+
+    Every iteration over the loader is an epoch. If shuffle is True, the order of the elements is
+    permuted at the start of every epoch. The permutation and the random streams of the batches are
+    derived from the seed, the epoch and the index of the batch, so the batches of an epoch do not
+    depend on the number of workers.
+    """
+
+    def __init__(self, data, root_node, err_params, batch_size, labels=None, shuffle=False, seed=42, n_workers=1,
+                 prefetch=2, use_processes=False):
+        """
+        Args:
+            data (list or numpy.ndarray): The clean data.
+            root_node (Node): The root node of the error generation tree.
+            err_params (dict): A dictionary containing the parameters for error generation.
+            batch_size (int): The number of elements in a batch. The last batch of an epoch may be smaller.
+            labels (list or numpy.ndarray, optional): Labels yielded together with the batches. Defaults to None.
+            shuffle (bool, optional): If True, the elements are shuffled at the start of every epoch.
+                Defaults to False.
+            seed (int, optional): The seed from which all random states are derived. Defaults to 42.
+            n_workers (int, optional): The number of workers. Defaults to 1.
+            prefetch (int, optional): The maximum number of batches errorified in advance. Defaults to 2.
+            use_processes (bool, optional): If True, worker processes are used instead of threads.
+                Defaults to False.
+        """
+        self.data = data
+        self.root_node = root_node
+        self.err_params = err_params
+        self.batch_size = batch_size
+        self.labels = labels
+        self.shuffle = shuffle
+        self.seed = seed
+        self.n_workers = n_workers
+        self.prefetch = prefetch
+        self.use_processes = use_processes
+        self.epoch = 0
+
+    def __len__(self):
+        return -(-first_dimension_length(self.data) // self.batch_size)
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        indices = np.arange(first_dimension_length(self.data))
+        if self.shuffle:
+            np.random.RandomState([self.seed, epoch]).shuffle(indices)
+        batches_indices = [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+
+        executor_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        with executor_class(self.n_workers) as executor:
+            pending = deque()
+            for batch_index, batch_indices in enumerate(batches_indices):
+                random_streams = RandomStreams(self.seed).spawn("epoch", epoch, "batch", batch_index)
+                future = executor.submit(errorify_batch, self.root_node, self.err_params,
+                                         self._take(self.data, batch_indices), random_streams)
+                pending.append((future, batch_indices))
+                if len(pending) > self.prefetch:
+                    yield self._get_result(*pending.popleft())
+            while pending:
+                yield self._get_result(*pending.popleft())
+
+    def _get_result(self, future, batch_indices):
+        err_batch = future.result()
+        if self.labels is None:
+            return err_batch
+        return err_batch, self._take(self.labels, batch_indices)
+
+    @staticmethod
+    def _take(data, indices):
+        if isinstance(data, np.ndarray):
+            return data[indices]
+        return [data[i] for i in indices]
@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from numbers import Real
 import numpy as np
 from dpemu.filters import Filter
 
@@ -30,9 +31,14 @@ class Missing(Filter):
     For each element in the array, makes that element go missing with the provided probability.
     Values that go missing are replaced with the provided value, which should usually be NaN.
 
+    For sparse matrices only the stored values can go missing. If the missing value is zero,
+    the missing values are removed from the sparsity structure.
+
     Inherits Filter class.
     """
 
+    param_types = {"probability": Real}
+
     def __init__(self, probability_id, missing_value_id):
         """
         Args:
@@ -43,16 +49,35 @@ class Missing(Filter):
         self.missing_value_id = missing_value_id
         super().__init__()
 
+    def is_identity(self):
+        return self.probability == 0
+
     def apply(self, node_data, random_state, named_dims):
         mask = random_state.rand(*(node_data.shape)) <= self.probability
         node_data[mask] = self.missing_value
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        self.apply(batch_data, random_state, named_dims)
+
+    def apply_sparse(self, matrix, random_state, named_dims):
+        self.apply(matrix.data, random_state, named_dims)
+        if self.missing_value == 0:
+            matrix.eliminate_zeros()
+
+    def apply_sweep(self, sweep_data, random_state, named_dims, error_params_list):
+        probabilities = self.get_swept_values("probability", error_params_list, sweep_data.ndim)
+        masks = random_state.rand(*(sweep_data.shape[1:])) <= probabilities
+        for level_data, mask, error_params in zip(sweep_data, masks, error_params_list):
+            level_data[mask] = error_params[self.missing_value_id]
+
 
 class Clip(Filter):
     """Clips values between minimum and maximum values provided by the user.
 
     Sets values less than the minimum value to min, and values greater than the maximum value to max.
 
+    For sparse matrices only the stored values are clipped.
+
     Inherits Filter class.
     """
 
@@ -69,6 +94,12 @@ class Clip(Filter):
     def apply(self, node_data, random_state, named_dims):
         np.clip(node_data, self.min, self.max, out=node_data)
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        self.apply(batch_data, random_state, named_dims)
+
+    def apply_sparse(self, matrix, random_state, named_dims):
+        self.apply(matrix.data, random_state, named_dims)
+
 
 class GaussianNoise(Filter):
     """Adds normally distributed noise to data.
@@ -76,6 +107,8 @@ class GaussianNoise(Filter):
     Adds random noise drawn from a Gaussian distribution with the provided mean and standard deviation
     to each element in the array.
 
+    For sparse matrices the noise is only added to the stored values.
+
     Inherits Filter class.
     """
 
@@ -89,9 +122,24 @@ class GaussianNoise(Filter):
         self.std_id = std_id
         super().__init__()
 
+    def is_identity(self):
+        return self.mean == 0 and self.std == 0
+
     def apply(self, node_data, random_state, named_dims):
         node_data += random_state.normal(loc=self.mean, scale=self.std, size=node_data.shape).astype(node_data.dtype)
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        self.apply(batch_data, random_state, named_dims)
+
+    def apply_sparse(self, matrix, random_state, named_dims):
+        self.apply(matrix.data, random_state, named_dims)
+
+    def apply_sweep(self, sweep_data, random_state, named_dims, error_params_list):
+        means = self.get_swept_values("mean", error_params_list, sweep_data.ndim)
+        stds = self.get_swept_values("std", error_params_list, sweep_data.ndim)
+        noise = random_state.normal(size=sweep_data.shape[1:])
+        sweep_data += (means + stds * noise).astype(sweep_data.dtype)
+
 
 class GaussianNoiseTimeDependent(Filter):
     """Adds normally distributed noise increasing in intensity with time to the data.
@@ -100,10 +148,16 @@ class GaussianNoiseTimeDependent(Filter):
     calculated from the initial mean and standard deviation, the elapsed time, and the
     increase to mean and standard deviation per unit of time.
 
+    If the filter is under a Series node with the named dimension "time", the elapsed time
+    is read from the named dimensions. Otherwise the index along time_axis of the data is
+    the elapsed time, and the noise of all time steps is drawn at once. With the same
+    numpy.random.RandomState, an Array node with this filter then gives the same result as
+    a Series(Array(), dim_name="time") node with this filter, when time_axis is 0.
+
     Inherits Filter class.
     """
 
-    def __init__(self, mean_id, std_id, mean_increase_id, std_increase_id):
+    def __init__(self, mean_id, std_id, mean_increase_id, std_increase_id, time_axis=0):
         """
         Args:
             mean_id (str): The key mapping to the initial mean of the random noise.
@@ -111,15 +165,25 @@ class GaussianNoiseTimeDependent(Filter):
             mean_increase_id (str): The key mapping to the increase of the mean of the random noise per unit of time.
             std_increase_id (str): The key mapping to the increase of the standard
         deviation of the random noise per unit of time.
+            time_axis (int, optional): The axis of time when the time is not a named dimension. Defaults to 0.
         """
         self.mean_id = mean_id
         self.std_id = std_id
         self.mean_increase_id = mean_increase_id
         self.std_increase_id = std_increase_id
+        self.time_axis = time_axis
         super().__init__()
 
+    def is_identity(self):
+        return self.mean == 0 and self.std == 0 and self.mean_increase == 0 and self.std_increase == 0
+
     def apply(self, node_data, random_state, named_dims):
-        time = named_dims["time"]
+        if "time" in named_dims:
+            time = named_dims["time"]
+        else:
+            time_shape = [1] * node_data.ndim
+            time_shape[self.time_axis] = node_data.shape[self.time_axis]
+            time = np.arange(node_data.shape[self.time_axis]).reshape(time_shape)
         node_data += random_state.normal(loc=self.mean + self.mean_increase * time,
                                          scale=self.std + self.std_increase * time,
                                          size=node_data.shape)
@@ -129,20 +193,29 @@ class StrangeBehaviour(Filter):
     """Emulates strange sensor values due to anomalous conditions around the sensor.
 
     The function do_strange_behaviour given as a parameter is used to output
-    strange sensor values into the data.
+    strange sensor values into the data. By default the function is called for
+    every element as do_strange_behaviour(value, random_state) and returns the
+    new value. If vectorized is True, the function is called once for the whole
+    data as do_strange_behaviour(node_data, random_state) and returns an array of
+    new values with the same shape, which avoids a Python call per element.
 
     Inherits Filter class.
     """
 
-    def __init__(self, do_strange_behaviour_id):
+    def __init__(self, do_strange_behaviour_id, vectorized=False):
         """
         Args:
             do_strange_behaviour_id (str): The key mapping to the strange behaviour -function.
+            vectorized (bool, optional): True if the function operates on whole arrays. Defaults to False.
         """
         super().__init__()
         self.do_strange_behaviour_id = do_strange_behaviour_id
+        self.vectorized = vectorized
 
     def apply(self, node_data, random_state, named_dims):
+        if self.vectorized:
+            node_data[...] = self.do_strange_behaviour(node_data, random_state)
+            return
         for index, _ in np.ndenumerate(node_data):
             node_data[index] = self.do_strange_behaviour(node_data[index], random_state)
 
@@ -167,6 +240,9 @@ class ApplyToTuple(Filter):
         self.ftr = ftr
         self.tuple_index = tuple_index
 
+    def is_identity(self):
+        return self.ftr.is_identity()
+
     def apply(self, node_data, random_state, named_dims):
         self.ftr.apply(node_data[self.tuple_index], random_state, named_dims)
 
@@ -178,6 +254,8 @@ class ApplyWithProbability(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"probability": Real}
+
     def __init__(self, ftr, probability_id):
         """
         Args:
@@ -188,6 +266,9 @@ class ApplyWithProbability(Filter):
         self.ftr = ftr
         self.probability_id = probability_id
 
+    def is_identity(self):
+        return self.probability == 0 or self.ftr.is_identity()
+
     def apply(self, node_data, random_state, named_dims):
         if random_state.rand() < self.probability:
             self.ftr.apply(node_data, random_state, named_dims)
@@ -198,7 +279,8 @@ class ModifyAsDataType(Filter):
     """Applies the input filter to the data casted to the specified type.
 
     First casts the data into the specified type, then applies the filter,
-    then returns the data to its original type.
+    then returns the data to its original type. The casted data is kept in
+    a temporary buffer which is reused between calls.
 
     Inherits Filter class.
     """
@@ -215,8 +297,7 @@ class ModifyAsDataType(Filter):
         self.ftr = ftr
 
     def apply(self, node_data, random_state, named_dims):
-        copy = node_data.copy().astype(self.dtype)
-        self.ftr.apply(copy, random_state, named_dims)
-        copy = copy.astype(node_data.dtype)
-        for index, _ in np.ndenumerate(node_data):
-            node_data[index] = copy[index]
+        casted_data = self.get_scratch_buffer("casted_data", node_data.shape, self.dtype)
+        np.copyto(casted_data, node_data, casting="unsafe")
+        self.ftr.apply(casted_data, random_state, named_dims)
+        np.copyto(node_data, casted_data, casting="unsafe")
@@ -20,9 +20,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import random
+import copy
+import threading
+import weakref
 import numpy as np
 from abc import ABC, abstractmethod
+from numbers import Integral, Real
+
+from ..rng import BatchRandomState
+
+_scratch_buffers = threading.local()
+# Larger scratch buffers are allocated anew on every call, so one large input does not keep memory in use
+max_cached_scratch_buffer_bytes = 1 << 24
 
 
 class Filter(ABC):
@@ -33,17 +42,26 @@ class Filter(ABC):
     a NumPy array, the required conversions are performed by the Array node
     to which the Filter is attached.)
 
+    The param_types class attribute may map names of parameter slots to the types (or
+    tuples of types) the values of the parameters must have. It is used to validate
+    error parameters before errors are generated (see Node.get_param_type_errors).
+    A float with an integral value (e.g. from numpy.linspace) given to a slot of an
+    Integral type is bound as an int.
+
     Args:
         ABC (object): Helper class that provides a standard way to create
     an abstract class using inheritance.
     """
 
-    # TODO: should this really be done here??
-    def __init__(self):
-        """Set the seeds for the RNG's of NumPy and Python.
-        """
-        np.random.seed(42)
-        random.seed(42)
+    param_types = {}
+
+    def __setattr__(self, name, value):
+        # The cached slots and nested filters are collected again if an attribute declaring them changes.
+        if name[-3:] == "_id":
+            self.__dict__.pop("_param_slots", None)
+        if isinstance(value, Filter) or isinstance(self.__dict__.get(name), Filter):
+            self.__dict__.pop("_child_filter_names", None)
+        super().__setattr__(name, value)
 
     def set_params(self, params_dict):
         """Set parameters for error generation.
@@ -51,23 +69,107 @@ class Filter(ABC):
         Args:
             params_dict (dict): A dictionary containing key-value pairs of error parameters.
         """
-        original = self.__dict__.copy()
-        for key in original:
-            if key[-3:] == "_id":
-                value = self.__dict__[key]
-                if value is not None:
-                    try:
-                        self.__dict__[key[:-3]] = params_dict[value]
-                    except KeyError as e:
-                        message = "The error parameter dictionary does not contain a parameter "\
-                                  f"with the identifier '{value}', which is expected by "\
-                                  f"the Filter {self}."
-                        raise Exception(message) from e
-
-        for key in self.__dict__:
-            value = self.__dict__[key]
-            if isinstance(value, Filter):
-                value.set_params(params_dict)
+        bind_params(self.get_param_bindings(), params_dict)
+
+    def get_scratch_buffer(self, name, shape, dtype):
+        """Returns a temporary array owned by the filter and the current thread.
+
+        The array is allocated on the first call and returned again by later calls with the same
+        name, shape and data type, e.g. when the filter is applied to every element of a Series.
+        Only buffers of at most max_cached_scratch_buffer_bytes bytes are kept for later calls.
+        The contents of the array are undefined and it must not be used after apply returns.
+
+        Args:
+            name (str): The name of the buffer.
+            shape (tuple): The shape of the buffer.
+            dtype (numpy.dtype): The data type of the buffer.
+
+        Returns:
+            numpy.ndarray: The buffer.
+        """
+        if not hasattr(_scratch_buffers, "buffers"):
+            _scratch_buffers.buffers = weakref.WeakKeyDictionary()
+        filter_buffers = _scratch_buffers.buffers.setdefault(self, {})
+        buffer = filter_buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            if buffer.nbytes <= max_cached_scratch_buffer_bytes:
+                filter_buffers[name] = buffer
+            else:
+                filter_buffers.pop(name, None)
+        return buffer
+
+    def get_param_slots(self):
+        """Returns the parameter slots of the filter.
+
+        Every attribute whose name ends with _id and whose value is not None declares a slot:
+        the value of the attribute is the key of the error parameter and the name of the attribute
+        without the _id suffix is the name of the slot. The slots are collected on the first call
+        and reused until an attribute whose name ends with _id is set.
+
+        Returns:
+            list: A list of (slot, key) pairs.
+        """
+        slots = self.__dict__.get("_param_slots")
+        if slots is None:
+            slots = [(name[:-3], value) for name, value in self.__dict__.items()
+                     if name[-3:] == "_id" and value is not None]
+            self.__dict__["_param_slots"] = slots
+        return slots
+
+    def get_child_filter_names(self):
+        """Returns the names of the attributes containing nested filters.
+
+        Filters given as values of error parameters are not nested filters of the filter: they
+        are bound with the other parameters (see bind_params). The names are collected on the
+        first call and reused until an attribute containing a filter is set.
+
+        Returns:
+            list: A list of attribute names.
+        """
+        names = self.__dict__.get("_child_filter_names")
+        if names is None:
+            slots = {slot for slot, _ in self.get_param_slots()}
+            names = [name for name, value in self.__dict__.items() if isinstance(value, Filter) and name not in slots]
+            self.__dict__["_child_filter_names"] = names
+        return names
+
+    def get_param_bindings(self):
+        """Returns the parameter bindings of the filter and its nested filters.
+
+        Returns:
+            list: A list of (filter, slot, key) triples.
+        """
+        bindings = [(self, slot, key) for slot, key in self.get_param_slots()]
+        for name in self.get_child_filter_names():
+            bindings.extend(self.__dict__[name].get_param_bindings())
+        return bindings
+
+    def get_param_key(self):
+        """Returns a hashable key of the current parameter values of the filter and its nested filters.
+
+        Two copies of a filter with equal keys modify equal data identically when given random
+        states in equal states. Unhashable parameter values (e.g. arrays) are represented by
+        their identity, so only the very same object gives an equal key.
+
+        Returns:
+            tuple: The parameter values in the order of get_param_bindings.
+        """
+        return tuple(get_hashable_value(getattr(filter_, slot)) for filter_, slot, _ in self.get_param_bindings())
+
+    def copy_structure(self):
+        """Returns a copy of the filter in which the nested filters are copied as well.
+
+        Other attributes are shared with the original filter, so large attributes such as
+        lookup tables are not copied.
+
+        Returns:
+            Filter: The copy of the filter.
+        """
+        copy_filter = copy.copy(self)
+        for name in self.get_child_filter_names():
+            copy_filter.__dict__[name] = self.__dict__[name].copy_structure()
+        return copy_filter
 
     @abstractmethod
     def apply(self, node_data, random_state, named_dims):
@@ -80,11 +182,160 @@ class Filter(ABC):
         """
         pass
 
+    def is_identity(self):
+        """Tells whether the filter leaves the data unchanged with its current parameter values.
+
+        Nodes skip the filters which are identities, and the runner reuses the clean data
+        when no filter of the error generation tree modifies the data. Filters which know
+        that some parameter values (e.g. a zero probability) cannot change the data override
+        this method. It is only called after the parameters have been set.
+
+        Returns:
+            bool: True if applying the filter would not change the data.
+        """
+        return False
+
+    def apply_sweep(self, sweep_data, random_state, named_dims, error_params_list):
+        """Applies the filter with several error parameter combinations using common random numbers.
+
+        The i-th element along the first axis of sweep_data is modified using the parameters
+        error_params_list[i]. Every parameter combination must see the same random numbers,
+        so that the errors of different combinations differ only because of the parameters.
+        By default the filter is applied to the combinations one at a time, starting every
+        combination from the same state of the random state and with a fresh copy of the filter,
+        so that the state of a stateful filter is not carried from one combination to another.
+        Filters whose random numbers can be drawn once for all combinations override this method
+        to process all combinations in a single vectorized pass.
+
+        Args:
+            sweep_data (numpy.ndarray): The stacked copies of the data to be modified.
+            random_state (mtrand.RandomState): An instance of numpy.random.RandomState() random number generator.
+            named_dims (dict): Named dimensions.
+            error_params_list (list): A list of dictionaries containing the error parameters.
+        """
+        state = random_state.get_state()
+        for level_data, error_params in zip(sweep_data, error_params_list):
+            random_state.set_state(state)
+            level_filter = self.copy_structure()
+            level_filter.set_params(error_params)
+            if not level_filter.is_identity():
+                level_filter.apply(level_data, random_state, named_dims)
+
+    def get_swept_values(self, slot, error_params_list, ndim):
+        """Returns the values of a parameter slot for several error parameter combinations.
+
+        Args:
+            slot (str): The name of the parameter slot.
+            error_params_list (list): A list of dictionaries containing the error parameters.
+            ndim (int): The number of dimensions of the returned array.
+
+        Returns:
+            numpy.ndarray: The values as an array of shape (len(error_params_list), 1, ..., 1)
+                which can be broadcast against stacked data.
+        """
+        key = dict(self.get_param_slots())[slot]
+        values = np.array([error_params[key] for error_params in error_params_list])
+        return values.reshape((-1,) + (1,) * (ndim - 1))
+
+    def apply_batch(self, batch_data, random_state, named_dims):
+        """Applies the filter to a batch of equally shaped data items stacked along the first axis.
+
+        By default the filter is applied to the items one at a time. Filters which can
+        process a whole batch at once override this method. With random streams, the random
+        state is a dpemu.rng.BatchRandomState which draws the random numbers of every item from
+        the stream of the item, so an overriding method must draw for the whole batch exactly
+        what apply would draw for every item, with the items along the first dimension.
+
+        Args:
+            batch_data (numpy.ndarray): The stacked data items to be modified.
+            random_state (mtrand.RandomState or dpemu.rng.BatchRandomState): An instance of
+                numpy.random.RandomState() random number generator, or the random streams of the items.
+            named_dims (dict): Named dimensions.
+        """
+        if isinstance(random_state, BatchRandomState):
+            random_state.apply_to_items(self.apply, batch_data, named_dims)
+            return
+        for item in batch_data:
+            self.apply(item, random_state, named_dims)
+
+    def apply_corpus(self, corpus, random_state, named_dims):
+        """Applies the filter to a corpus of documents.
+
+        Array nodes call this method instead of apply when their data is a list of strings.
+        By default the documents are converted to a Numpy array of strings for apply.
+        Text filters which can operate directly on the code points of the corpus
+        override this method.
+
+        Args:
+            corpus (dpemu.corpus.Corpus): The documents to be modified.
+            random_state (mtrand.RandomState): An instance of numpy.random.RandomState() random number generator.
+            named_dims (dict): Named dimensions.
+        """
+        node_data = np.array(corpus.to_strings())
+        self.apply(node_data, random_state, named_dims)
+        corpus.set_strings(node_data.tolist())
+
+    def apply_sparse(self, matrix, random_state, named_dims):
+        """Applies the filter to a sparse matrix in the CSR or CSC format without densifying it.
+
+        Array nodes call this method instead of apply when their data is a sparse matrix.
+        Filters which support sparse matrices override this method, usually by applying
+        the filter to the stored values, i.e. matrix.data.
+
+        Args:
+            matrix (scipy.sparse.spmatrix): The sparse matrix to be modified.
+            random_state (mtrand.RandomState): An instance of numpy.random.RandomState() random number generator.
+            named_dims (dict): Named dimensions.
+        """
+        raise TypeError(f"The Filter {self} does not support sparse matrices.")
+
+
+def get_hashable_value(value):
+    """Returns the value itself if it is hashable and otherwise a key based on its identity.
+
+    A filter is represented by its identity together with the key of its own parameter values.
+    """
+    if isinstance(value, Filter):
+        return "filter", id(value), value.get_param_key()
+    try:
+        hash(value)
+    except TypeError:
+        return ("id", id(value))
+    return value
+
+
+def bind_params(bindings, params_dict):
+    """Assigns the error parameter values to the parameter slots of filters.
+
+    A filter given as the value of a parameter gets its own parameters from the same dictionary, and an
+    integral-valued float given to a slot of an Integral type is converted to an int.
+
+    Args:
+        bindings (list): A list of (filter, slot, key) triples, as returned by get_param_bindings.
+        params_dict (dict): A dictionary containing key-value pairs of error parameters.
+    """
+    for filter_, slot, key in bindings:
+        try:
+            value = params_dict[key]
+        except KeyError as e:
+            message = "The error parameter dictionary does not contain a parameter "\
+                      f"with the identifier '{key}', which is expected by "\
+                      f"the Filter {filter_}."
+            raise Exception(message) from e
+        if isinstance(value, Filter):
+            value.set_params(params_dict)
+        elif filter_.param_types.get(slot) is Integral and isinstance(value, Real) and not isinstance(value, Integral):
+            if float(value).is_integer():
+                value = int(value)
+        filter_.__dict__[slot] = value
+
 
 # TODO: "Inherits Filter class" -> "Inherits the Filter-class" ?
 class Constant(Filter):
     """Overwrites all values in the data with the given value.
 
+    For sparse matrices only the stored values are overwritten.
+
     Inherits Filter class.
     """
 
@@ -99,6 +350,14 @@ class Constant(Filter):
     def apply(self, node_data, random_state, named_dims):
         node_data.fill(self.value)
 
+    def apply_sparse(self, matrix, random_state, named_dims):
+        self.apply(matrix.data, random_state, named_dims)
+        if self.value == 0:
+            matrix.eliminate_zeros()
+
+    def apply_batch(self, batch_data, random_state, named_dims):
+        self.apply(batch_data, random_state, named_dims)
+
 
 # TODO: Isn't this just the base Filter class?
 class Identity(Filter):
@@ -110,18 +369,33 @@ class Identity(Filter):
     def __init__(self):
         super().__init__()
 
+    def is_identity(self):
+        return True
+
     def apply(self, node_data, random_state, named_dims):
         pass
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        pass
+
+    def apply_sparse(self, matrix, random_state, named_dims):
+        pass
+
 
 class BinaryFilter(Filter):
     """Abstract Filter applying two given filters to the data, combining the results with a pairwise binary operation.
 
     The pairwise binary operation is specified by the inheriting class by overriding the operation-function.
+    If the class attribute ufunc is set to a NumPy ufunc computing the same operation, the results are
+    combined with the ufunc over whole arrays instead of calling operation for every pair of elements.
+    A subclass which overrides operation without setting ufunc again is combined with its operation.
+    The result is cast to the data type of the data as if it was assigned element by element.
 
     Inherits Filter class.
     """
 
+    ufunc = None
+
     def __init__(self, filter_a, filter_b):
         """
         Args:
@@ -133,12 +407,45 @@ class BinaryFilter(Filter):
         self.filter_b = filter_b
 
     def apply(self, node_data, random_state, named_dims):
-        data_a = node_data.copy()
-        data_b = node_data.copy()
+        data_a = self.get_scratch_buffer("data_a", node_data.shape, node_data.dtype)
+        np.copyto(data_a, node_data)
         self.filter_a.apply(data_a, random_state, named_dims)
-        self.filter_b.apply(data_b, random_state, named_dims)
-        for index, _ in np.ndenumerate(node_data):
-            node_data[index] = self.operation(data_a[index], data_b[index])
+        self.filter_b.apply(node_data, random_state, named_dims)
+        self.combine(data_a, node_data)
+
+    def apply_batch(self, batch_data, random_state, named_dims):
+        data_a = self.get_scratch_buffer("data_a", batch_data.shape, batch_data.dtype)
+        np.copyto(data_a, batch_data)
+        self.filter_a.apply_batch(data_a, random_state, named_dims)
+        self.filter_b.apply_batch(batch_data, random_state, named_dims)
+        self.combine(data_a, batch_data)
+
+    def combine(self, data_a, data_b):
+        """Combines the results of the child filters, writing the result over the results of the second filter.
+
+        Args:
+            data_a (numpy.ndarray): The data filter_a operated on.
+            data_b (numpy.ndarray): The data filter_b operated on, which is overwritten with the result.
+        """
+        ufunc = self.get_ufunc()
+        if ufunc is not None:
+            ufunc(data_a, data_b, out=data_b, casting="unsafe")
+            return
+        for index, _ in np.ndenumerate(data_b):
+            data_b[index] = self.operation(data_a[index], data_b[index])
+
+    @classmethod
+    def get_ufunc(cls):
+        """Returns the ufunc computing the operation of the class, if any.
+
+        The ufunc is only used if the operation of the class is the operation of the class declaring the ufunc.
+
+        Returns:
+            numpy.ufunc: The ufunc or None.
+        """
+        for declaring_class in cls.__mro__:
+            if "ufunc" in declaring_class.__dict__:
+                return declaring_class.ufunc if cls.operation is declaring_class.operation else None
 
     @abstractmethod
     def operation(self, element_a, element_b):
@@ -157,6 +464,8 @@ class Addition(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.add
+
     def operation(self, element_a, element_b):
         return element_a + element_b
 
@@ -167,6 +476,8 @@ class Subtraction(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.subtract
+
     def operation(self, element_a, element_b):
         return element_a - element_b
 
@@ -177,6 +488,8 @@ class Multiplication(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.multiply
+
     def operation(self, element_a, element_b):
         return element_a * element_b
 
@@ -187,6 +500,8 @@ class Division(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.true_divide
+
     def operation(self, element_a, element_b):
         return element_a / element_b
 
@@ -200,6 +515,8 @@ class IntegerDivision(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.floor_divide
+
     def operation(self, element_a, element_b):
         return element_a // element_b
 
@@ -210,6 +527,8 @@ class Modulo(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.mod
+
     def operation(self, element_a, element_b):
         return element_a % element_b
 
@@ -220,6 +539,8 @@ class And(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.bitwise_and
+
     def operation(self, element_a, element_b):
         return element_a & element_b
 
@@ -230,6 +551,8 @@ class Or(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.bitwise_or
+
     def operation(self, element_a, element_b):
         return element_a | element_b
 
@@ -240,6 +563,8 @@ class Xor(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.bitwise_xor
+
     def operation(self, element_a, element_b):
         return element_a ^ element_b
 
@@ -248,17 +573,25 @@ class Difference(Filter):
     """Returns change to data from filter
 
     Given a filter, applies the filter to the data, then subtracting the original.
-    Functions identically to Subtraction(filter, Identity()).
+    Functions identically to Subtraction(filter, Identity()), but only the original
+    data is stored in a temporary buffer.
 
-    Inherits BinaryFilter class.
+    Inherits Filter class.
     """
 
     def __init__(self, ftr):
+        """
+        Args:
+            ftr (dpemu.filters.Filter): The filter whose change to the data is computed.
+        """
         super().__init__()
-        self.ftr = Subtraction(ftr, Identity())
+        self.ftr = ftr
 
     def apply(self, node_data, random_state, named_dims):
+        original = self.get_scratch_buffer("original", node_data.shape, node_data.dtype)
+        np.copyto(original, node_data)
         self.ftr.apply(node_data, random_state, named_dims)
+        np.subtract(node_data, original, out=node_data, casting="unsafe")
 
 
 class Max(BinaryFilter):
@@ -267,6 +600,8 @@ class Max(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.maximum
+
     def operation(self, element_a, element_b):
         return max(element_a, element_b)
 
@@ -277,5 +612,7 @@ class Min(BinaryFilter):
     Inherits BinaryFilter class.
     """
 
+    ufunc = np.minimum
+
     def operation(self, element_a, element_b):
         return min(element_a, element_b)
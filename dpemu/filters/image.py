@@ -20,14 +20,98 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 from math import sqrt, sin, cos, pi
+from numbers import Integral, Real
 import cv2
 import numpy as np
 import imutils
 from PIL import Image
 from scipy.ndimage import gaussian_filter
 from dpemu.filters import Filter
+from dpemu.pg_utils import sample_positions
+
+
+def apply_to_rows_of_batch(ftr, batch_data, random_state, named_dims):
+    """Applies a pixelwise filter to a batch of images at once by treating the batch as one tall image.
+
+    Args:
+        ftr (Filter): A filter which modifies every pixel independently of the other pixels.
+        batch_data (numpy.ndarray): The stacked images to be modified.
+        random_state (mtrand.RandomState): An instance of numpy.random.RandomState() random number generator.
+        named_dims (dict): Named dimensions.
+    """
+    tall_image = batch_data.reshape((-1,) + batch_data.shape[2:])
+    ftr.apply(tall_image, random_state, named_dims)
+    if not np.shares_memory(tall_image, batch_data):
+        batch_data[...] = tall_image.reshape(batch_data.shape)
+
+
+def count_rectangles(height, width, y0, y1, x0, x1):
+    """Counts how many of the given rectangles cover every pixel of an image.
+
+    The corners of the rectangles are accumulated into a difference array with np.add.at,
+    and the counts are obtained as its cumulative sums along both axes.
+
+    Args:
+        height (int): The height of the image.
+        width (int): The width of the image.
+        y0 (numpy.ndarray): The first rows of the rectangles.
+        y1 (numpy.ndarray): The rows after the last rows of the rectangles.
+        x0 (numpy.ndarray): The first columns of the rectangles.
+        x1 (numpy.ndarray): The columns after the last columns of the rectangles.
+
+    Returns:
+        numpy.ndarray: An array of shape (height, width) with the number of rectangles covering every pixel.
+    """
+    counts = np.zeros(shape=(height + 1, width + 1))
+    np.add.at(counts, (y0, x0), 1)
+    np.add.at(counts, (y0, x1), -1)
+    np.add.at(counts, (y1, x0), -1)
+    np.add.at(counts, (y1, x1), 1)
+    counts = np.cumsum(counts, axis=0)
+    counts = np.cumsum(counts, axis=1)
+    return counts[:height, :width]
+
+
+@lru_cache(maxsize=64)
+def get_snowflake_kernel(radius):
+    """Returns the shape of a snowflake, i.e. the opacity 1 - d / radius at the distance d from its center.
+
+    Args:
+        radius (int): The radius of the snowflake.
+
+    Returns:
+        numpy.ndarray: A read-only array of shape (2 * radius + 1, 2 * radius + 1).
+    """
+    dy, dx = np.ogrid[-radius:radius + 1, -radius:radius + 1]
+    kernel = np.maximum(0, 1 - np.sqrt(dx * dx + dy * dy) / radius)
+    kernel.setflags(write=False)
+    return kernel
+
+
+@lru_cache(maxsize=8)
+def get_perlin_grid(height, width):
+    """Returns the coordinates of the pixels scaled to [0, 1) and their fade curve values for perlin noise.
+
+    Args:
+        height (int): The height of the image.
+        width (int): The width of the image.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: Read-only arrays of shape (height, width, 2).
+    """
+    grid = np.mgrid[0:height, 0:width].astype(float)
+    grid[0] /= height
+    grid[1] /= width
+    grid = grid.transpose(1, 2, 0) % 1
+    fade = 6 * grid ** 5 - 15 * grid ** 4 + 10 * grid ** 3
+    grid.setflags(write=False)
+    fade.setflags(write=False)
+    return grid, fade
 
 
 class Blur(Filter):
@@ -36,6 +120,9 @@ class Blur(Filter):
 
     Inherits Filter class.
     """
+
+    param_types = {"repeats": Integral, "radius": Integral}
+
     def __init__(self, repeats_id, radius_id=None):
         """
         Args:
@@ -48,6 +135,9 @@ class Blur(Filter):
         self.radius_id = radius_id
         self.radius = 1
 
+    def is_identity(self):
+        return self.repeats == 0
+
     def apply(self, node_data, random_state, named_dims):
         def avg(radius, data):
             height = data.shape[0]
@@ -84,6 +174,8 @@ class Resolution(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"k": Integral}
+
     def __init__(self, k_id):
         """
         Args:
@@ -92,12 +184,21 @@ class Resolution(Filter):
         super().__init__()
         self.k_id = k_id
 
+    def is_identity(self):
+        return self.k == 1
+
     def apply(self, node_data, random_state, named_dims):
         w = node_data.shape[1]
         h = node_data.shape[0]
         row, col = (np.indices((h, w)) // self.k) * self.k
         node_data[...] = node_data[row, col]
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        w = batch_data.shape[2]
+        h = batch_data.shape[1]
+        row, col = (np.indices((h, w)) // self.k) * self.k
+        batch_data[...] = batch_data[:, row, col]
+
 
 class Rotation(Filter):
     """Rotates the image.
@@ -112,6 +213,8 @@ class Rotation(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"min_angle": Real, "max_angle": Real}
+
     def __init__(self, min_angle_id, max_angle_id=None):
         """
         Args:
@@ -194,6 +297,9 @@ class Brightness(Filter):
 
         node_data[...] = nd
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        apply_to_rows_of_batch(self, batch_data, random_state, named_dims)
+
 
 class BlurGaussian(Filter):
     """Blur image according to a zero-centered normal distribution.
@@ -204,6 +310,8 @@ class BlurGaussian(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"std": Real}
+
     def __init__(self, standard_dev_id):
         """
         Args:
@@ -212,6 +320,9 @@ class BlurGaussian(Filter):
         super().__init__()
         self.std_id = standard_dev_id
 
+    def is_identity(self):
+        return self.std == 0
+
     def apply(self, node_data, random_state, named_dims):
         if len(node_data.shape) == 2:
             node_data[...] = gaussian_filter(node_data, self.std)
@@ -219,6 +330,10 @@ class BlurGaussian(Filter):
             for i in range(node_data.shape[-1]):
                 node_data[:, :, i] = gaussian_filter(node_data[:, :, i], self.std)
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        sigma = (0, self.std, self.std) + (0,) * (len(batch_data.shape) - 3)
+        batch_data[...] = gaussian_filter(batch_data, sigma)
+
 
 class JPEG_Compression(Filter):
     """Applies JPEG compression to the image.
@@ -229,6 +344,8 @@ class JPEG_Compression(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"quality": Integral}
+
     def __init__(self, quality_id):
         """
         Args:
@@ -256,10 +373,14 @@ class Rain(Filter):
 
     RGB values should be either reals in the range [0, 1] or integers in [0, 255].
     The range-parameter should be set to 1 in the first case and 255 in the second.
+    The values are clipped to this range even if no raindrops are created, so the
+    filter is never an identity.
 
     Inherits Filter class.
     """
 
+    param_types = {"probability": Real}
+
     def __init__(self, probability_id, range_id):
         """
         Args:
@@ -275,41 +396,27 @@ class Rain(Filter):
         width = node_data.shape[1]
 
         # 1. Generate error
-        errs = np.zeros(shape=(height + 1, width + 1))
-        ind = -1
-        while True:
-            ind += random_state.geometric(self.probability)
-
-            if ind >= width * height:
-                break
-            y = ind // width
-            x = ind - y * width
-            x_r = 1
-            y_r = max(0, round(random_state.normal(20, 10)))
-            x0 = max(x - x_r, 0)
-            x1 = min(x + x_r + 1, width)
-            y0 = max(y - y_r, 0)
-            y1 = min(y + y_r + 1, height)
-            errs[y0, x0] += 1
-            errs[y0, x1] -= 1
-            errs[y1, x0] -= 1
-            errs[y1, x1] += 1
-
-        # 2. Calculate cumulative sums
-        errs = np.cumsum(errs, axis=0)
-        errs = np.cumsum(errs, axis=1)
+        positions = sample_positions(self.probability, height * width, random_state)
+        y_r = np.maximum(0, np.round(random_state.normal(20, 10, size=len(positions)))).astype(np.int64)
+        y, x = positions // width, positions % width
+        x_r = 1
+        errs = count_rectangles(height, width, np.maximum(y - y_r, 0), np.minimum(y + y_r + 1, height),
+                                np.maximum(x - x_r, 0), np.minimum(x + x_r + 1, width))
+
+        # 2. Draw noise where there are raindrops
+        rainy = np.nonzero(errs)
+        counts = errs[rainy]
+        add = np.zeros((3, height, width))
+        add[:, rainy[0], rainy[1]] = random_state.normal(5 * counts, 10 * np.sqrt(counts / 12) + 4 * counts,
+                                                         size=(3, len(counts)))
+        add[2] += 30 * errs
 
         # 3. Modify data
-        locs = 5 * errs
-        scales = 10 * np.sqrt(errs / 12) + 4 * errs
         for j in range(3):
-            add = random_state.normal(locs, scales)
-            if j == 2:
-                add += 30 * errs
             if self.range == 1:
-                node_data[:, :, j] = np.clip(node_data[:, :, j] + add[0:height, 0:width] / 255, 0, 1)
+                node_data[:, :, j] = np.clip(node_data[:, :, j] + add[j] / 255, 0, 1)
             else:
-                node_data[:, :, j] = np.clip(node_data[:, :, j] + add[0:height, 0:width].astype(int), 0, 255)
+                node_data[:, :, j] = np.clip(node_data[:, :, j] + add[j].astype(int), 0, 255)
 
 
 class Snow(Filter):
@@ -348,6 +455,8 @@ class Snow(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"snowflake_probability": Real, "snowflake_alpha": Real, "snowstorm_alpha": Real}
+
     def __init__(self, snowflake_probability_id, snowflake_alpha_id, snowstorm_alpha_id):
         """
         Args:
@@ -360,6 +469,9 @@ class Snow(Filter):
         self.snowflake_alpha_id = snowflake_alpha_id
         self.snowstorm_alpha_id = snowstorm_alpha_id
 
+    def is_identity(self):
+        return self.snowflake_probability == 0 and self.snowstorm_alpha == 0
+
     def apply(self, node_data, random_state, named_dims):
         def generate_perlin_noise(height, width, random_state):
             """[summary]
@@ -392,81 +504,46 @@ class Snow(Filter):
             SOFTWARE.
             """
 
-            def f(t):
-                return 6 * t ** 5 - 15 * t ** 4 + 10 * t ** 3
-
-            d = (height, width)
-            grid = np.mgrid[0:d[0], 0:d[1]].astype(float)
-            grid[0] /= height
-            grid[1] /= width
-
-            grid = grid.transpose(1, 2, 0) % 1
+            grid, t = get_perlin_grid(height, width)
             # Gradients
             angles = 2 * np.pi * random_state.rand(2, 2)
             gradients = np.dstack((np.cos(angles), np.sin(angles)))
-            g00 = gradients[0:-1, 0:-1].repeat(d[0], 0).repeat(d[1], 1)
-            g10 = gradients[1:, 0:-1].repeat(d[0], 0).repeat(d[1], 1)
-            g01 = gradients[0:-1, 1:].repeat(d[0], 0).repeat(d[1], 1)
-            g11 = gradients[1:, 1:].repeat(d[0], 0).repeat(d[1], 1)
             # Ramps
-            n00 = np.sum(grid * g00, 2)
-            n10 = np.sum(np.dstack((grid[:, :, 0] - 1, grid[:, :, 1])) * g10, 2)
-            n01 = np.sum(np.dstack((grid[:, :, 0], grid[:, :, 1] - 1)) * g01, 2)
-            n11 = np.sum(np.dstack((grid[:, :, 0] - 1, grid[:, :, 1] - 1)) * g11, 2)
+            n00 = grid[:, :, 0] * gradients[0, 0, 0] + grid[:, :, 1] * gradients[0, 0, 1]
+            n10 = (grid[:, :, 0] - 1) * gradients[1, 0, 0] + grid[:, :, 1] * gradients[1, 0, 1]
+            n01 = grid[:, :, 0] * gradients[0, 1, 0] + (grid[:, :, 1] - 1) * gradients[0, 1, 1]
+            n11 = (grid[:, :, 0] - 1) * gradients[1, 1, 0] + (grid[:, :, 1] - 1) * gradients[1, 1, 1]
             # Interpolation
-            t = f(grid)
             n0 = n00 * (1 - t[:, :, 0]) + t[:, :, 0] * n10
             n1 = n01 * (1 - t[:, :, 0]) + t[:, :, 0] * n11
             return np.sqrt(2) * ((1 - t[:, :, 1]) * n0 + t[:, :, 1] * n1)
 
-        def build_snowflake(r):
-            res = np.zeros(shape=(2 * r + 1, 2 * r + 1))
-            for y in range(0, 2 * r + 1):
-                for x in range(0, 2 * r + 1):
-                    dy = y - r
-                    dx = x - r
-                    d = sqrt(dx * dx + dy * dy)
-                    if r == 0:
-                        res[y, x] = 1
-                    else:
-                        res[y, x] = max(0, 1 - d / r)
-            return res * self.snowflake_alpha
-
         width = node_data.shape[1]
         height = node_data.shape[0]
 
         # generate snowflakes
-        flakes = []
-        ind = -1
-        while True:
-            ind += random_state.geometric(self.snowflake_probability)
-            if ind >= height * width:
-                break
-            y = ind // width
-            x = ind % width
-            r = round(random_state.normal(5, 2))
-            if r <= 0:
-                continue
-            while len(flakes) <= r:
-                flakes.append(build_snowflake(len(flakes)))
-            y0 = max(0, y - r)
-            x0 = max(0, x - r)
-            y1 = min(height - 1, y + r) + 1
-            x1 = min(width - 1, x + r) + 1
-            fy0 = y0 - (y - r)
-            fx0 = x0 - (x - r)
-            fy1 = y1 - (y - r)
-            fx1 = x1 - (x - r)
-            for j in range(3):
-                node_data[y0:y1, x0:x1, j] += ((255 - node_data[y0:y1, x0:x1, j]) * flakes[r][fy0:fy1, fx0:fx1]).astype(
-                    node_data.dtype)
+        positions = sample_positions(self.snowflake_probability, height * width, random_state)
+        radii = np.round(random_state.normal(5, 2, size=len(positions))).astype(np.int64)
+        positions, radii = positions[radii > 0], radii[radii > 0]
+
+        # the fraction of the distance to white left by the snowflakes, in a buffer padded by the maximum radius
+        pad = radii.max() if len(radii) > 0 else 0
+        transmittance = np.ones((height + 2 * pad, width + 2 * pad))
+        for r in np.unique(radii):
+            centers = positions[radii == r]
+            offsets = np.arange(-r, r + 1)
+            rows = (centers // width + pad)[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+            cols = (centers % width + pad)[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+            flake = 1 - self.snowflake_alpha * get_snowflake_kernel(r)
+            np.multiply.at(transmittance, (rows, cols), np.broadcast_to(flake, rows.shape[:1] + flake.shape))
+        transmittance = transmittance[pad:pad + height, pad:pad + width]
 
         # add noise
         noise = generate_perlin_noise(height, width, random_state)
         noise = (noise + 1) / 2  # transform the noise to be in range [0, 1]
-        for j in range(3):
-            node_data[:, :, j] += (self.snowstorm_alpha * (255 - node_data[:, :, j]) * noise[:, :]).astype(
-                node_data.dtype)
+        transmittance *= 1 - self.snowstorm_alpha * noise
+        rgb = node_data[:, :, :3]
+        rgb += ((255 - rgb) * (1 - transmittance)[:, :, np.newaxis]).astype(node_data.dtype)
 
 
 # TODO: transparency_percentage does not get values in range [0, 100] ??
@@ -479,6 +556,8 @@ class StainArea(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"probability": Real, "transparency_percentage": Real}
+
     def __init__(self, probability_id, radius_generator_id, transparency_percentage_id):
         """
         Args:
@@ -491,36 +570,24 @@ class StainArea(Filter):
         self.transparency_percentage_id = transparency_percentage_id
         super().__init__()
 
+    def is_identity(self):
+        return self.probability == 0 or self.transparency_percentage == 1
+
     def apply(self, node_data, random_state, named_dims):
         height = node_data.shape[0]
         width = node_data.shape[1]
 
         # 1. Generate error
-        errs = np.zeros(shape=(height + 1, width + 1))
-        ind = -1
-        while True:
-            ind += random_state.geometric(self.probability)
-
-            if ind >= width * height:
-                break
-            y = ind // width
-            x = ind - y * width
-            r = self.radius_generator.generate(random_state)
-            x0 = max(x - r, 0)
-            x1 = min(x + r + 1, width)
-            y0 = max(y - r, 0)
-            y1 = min(y + r + 1, height)
-            errs[y0, x0] += 1
-            errs[y0, x1] -= 1
-            errs[y1, x0] -= 1
-            errs[y1, x1] += 1
+        positions = sample_positions(self.probability, height * width, random_state)
+        r = self.radius_generator.generate_many(len(positions), random_state)
+        y, x = positions // width, positions % width
+        errs = count_rectangles(height, width, np.maximum(y - r, 0), np.minimum(y + r + 1, height),
+                                np.maximum(x - r, 0), np.minimum(x + r + 1, width))
 
         # 2. Modify the array
-        errs = np.cumsum(errs, axis=0)
-        errs = np.cumsum(errs, axis=1)
         errs = np.power(self.transparency_percentage, errs)
         for j in range(3):
-            node_data[:, :, j] = np.multiply(node_data[:, :, j], errs[0:height, 0:width])
+            node_data[:, :, j] = np.multiply(node_data[:, :, j], errs)
 
 
 class Saturation(Filter):
@@ -571,6 +638,9 @@ class Saturation(Filter):
 
         node_data[...] = nd
 
+    def apply_batch(self, batch_data, random_state, named_dims):
+        apply_to_rows_of_batch(self, batch_data, random_state, named_dims)
+
 
 class LensFlare(Filter):
     """Adds a lens flare to the image.
@@ -583,48 +653,35 @@ class LensFlare(Filter):
 
     def apply(self, node_data, random_state, named_dims):
         def flare(x0, y0, radius):
-            gt = random_state.randint(130, 180)
-            rt = random_state.randint(220, 255)
-            bt = random_state.randint(0, 50)
+            g = random_state.randint(130, 180)
+            r = random_state.randint(220, 255)
+            b = random_state.randint(0, 50)
+            color = np.array([r, g, b], dtype=np.float64)
             x_offset = random_state.normal(0, 5)
             y_offset = random_state.normal(0, 5)
-            for x in range(x0 - radius, x0 + radius + 1):
-                for y in range(y0 - radius, y0 + radius + 1):
-                    if y < 0 or x < 0 or y >= height or x >= width:
-                        continue
-                    dist = sqrt((x - x0) * (x - x0) + (y - y0) * (y - y0))
-                    if dist > radius:
-                        continue
-                    offset_dist = sqrt((x - x0 + x_offset) ** 2 + (y - y0 + y_offset) ** 2)
-                    r = node_data[y][x][0]
-                    g = node_data[y][x][1]
-                    b = node_data[y][x][2]
-                    a = 3
-                    t = max(0, min(1, (1 - (radius - offset_dist) / radius)))
-                    visibility = max(0, a * t * t + (1 - a) * t) * 0.8
-                    r = round(r + (rt - r) * visibility)
-                    g = round(g + (gt - g) * visibility)
-                    b = round(b + (bt - b) * visibility)
-                    node_data[y][x] = (r, g, b)
+            y_start, y_end = max(0, y0 - radius), min(height, y0 + radius + 1)
+            x_start, x_end = max(0, x0 - radius), min(width, x0 + radius + 1)
+            if y_start >= y_end or x_start >= x_end:
+                return
+            dy, dx = np.ogrid[y_start - y0:y_end - y0, x_start - x0:x_end - x0]
+            inside = dx * dx + dy * dy <= radius * radius
+            offset_dist = np.sqrt((dx + x_offset) ** 2 + (dy + y_offset) ** 2)
+            t = np.clip(offset_dist / radius, 0, 1)
+            visibility = np.maximum(0, 3 * t * t - 2 * t)[inside] * 0.8
+            box = node_data[y_start:y_end, x_start:x_end, :3]
+            pixels = box[inside].astype(np.float64)
+            box[inside] = np.round(pixels + (color - pixels) * visibility[:, np.newaxis])
 
         width = node_data.shape[1]
         height = node_data.shape[0]
 
-        # estimate the brightest spot in the image
-        pixel_sum_x = [0, 0, 0]
-        pixel_sum_y = [0, 0, 0]
-        expected_x = [0, 0, 0]
-        expected_y = [0, 0, 0]
-        for y0 in range(height):
-            for x0 in range(width):
-                pixel_sum_x += node_data[y0][x0]
-                pixel_sum_y += node_data[y0][x0]
-        for y0 in range(height):
-            for x0 in range(width):
-                expected_x += x0 * node_data[y0][x0] / pixel_sum_x
-                expected_y += y0 * node_data[y0][x0] / pixel_sum_y
-        best_y = int((expected_y[0] + expected_y[1] + expected_y[2]) / 3)
-        best_x = int((expected_x[0] + expected_x[1] + expected_x[2]) / 3)
+        # estimate the brightest spot in the image as the average of the intensity weighted centroids of the channels
+        channels = node_data[..., :3].astype(np.float64)
+        channel_sums = channels.sum(axis=(0, 1))
+        expected_x = np.arange(width).dot(channels.sum(axis=0)) / channel_sums
+        expected_y = np.arange(height).dot(channels.sum(axis=1)) / channel_sums
+        best_y = int(np.mean(expected_y))
+        best_x = int(np.mean(expected_x))
 
         origo_vector = np.array([width / 2 - best_x, height / 2 - best_y])
         origo_vector = origo_vector / sqrt(origo_vector[0] * origo_vector[0] + origo_vector[1] * origo_vector[1])
@@ -644,3 +701,88 @@ class LensFlare(Filter):
             y += origo_vector[1]
             x += origo_vector[0]
             steps -= 1
+
+
+class Tiled(Filter):
+    """Applies the given filter to an image one tile at a time.
+
+    The image is split into square tiles of the given size. Every tile is extended by a
+    halo of the given width on every side (as far as the image extends), the filter is
+    applied to a copy of the extended tile, and only the tile without the halo is written
+    back. For filters whose output at a pixel depends only on the pixels within some
+    radius, such as Blur and BlurGaussian, the result is equal to applying the filter to
+    the whole image when the halo is at least that radius, and there are no seams.
+
+    Tiles always read the original pixels: the tiles of a row of tiles are collected into
+    a band buffer, which is written back to the image only when no later tile's halo can
+    reach it anymore. Therefore the additional memory used is bounded by the size of a
+    few bands instead of the size of the whole image. The tiles of a band can be processed
+    in parallel by several threads. Every tile gets its own random state seeded from the
+    random state given to the filter, so the result does not depend on the number of threads.
+
+    Inherits Filter class.
+    """
+
+    def __init__(self, ftr, tile_size, halo=0, n_workers=1):
+        """
+        Args:
+            ftr (dpemu.filters.Filter): The filter to apply to the tiles.
+            tile_size (int): The height and width of the tiles.
+            halo (int, optional): The width of the halo around every tile. Defaults to 0.
+            n_workers (int, optional): The number of threads processing tiles. Defaults to 1.
+        """
+        super().__init__()
+        self.ftr = ftr
+        self.tile_size = tile_size
+        self.halo = halo
+        self.n_workers = n_workers
+
+    def is_identity(self):
+        return self.ftr.is_identity()
+
+    def apply(self, node_data, random_state, named_dims):
+        height = node_data.shape[0]
+        width = node_data.shape[1]
+        band_starts = range(0, height, self.tile_size)
+        tile_starts = range(0, width, self.tile_size)
+        seeds = random_state.randint(2 ** 31, size=(len(band_starts), len(tile_starts)))
+
+        # The halos of the tiles of a band reach this many bands upwards
+        n_pending_bands = -(-self.halo // self.tile_size)
+        pending = deque()
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            for i, y0 in enumerate(band_starts):
+                y1 = min(y0 + self.tile_size, height)
+                band = np.empty((y1 - y0,) + node_data.shape[1:], dtype=node_data.dtype)
+                jobs = [executor.submit(self.process_tile, node_data, band, y0, y1, x0,
+                                        min(x0 + self.tile_size, width), seeds[i, j], named_dims)
+                        for j, x0 in enumerate(tile_starts)]
+                for job in jobs:
+                    job.result()
+                pending.append((y0, y1, band))
+                while len(pending) > n_pending_bands:
+                    band_y0, band_y1, finished_band = pending.popleft()
+                    node_data[band_y0:band_y1] = finished_band
+            for band_y0, band_y1, finished_band in pending:
+                node_data[band_y0:band_y1] = finished_band
+
+    def process_tile(self, node_data, band, y0, y1, x0, x1, seed, named_dims):
+        """Applies the filter to a single tile extended by its halo and writes the tile to the band buffer.
+
+        Args:
+            node_data (numpy.ndarray): The whole image.
+            band (numpy.ndarray): The buffer of the band the tile belongs to.
+            y0 (int): The first row of the tile.
+            y1 (int): The row after the last row of the tile.
+            x0 (int): The first column of the tile.
+            x1 (int): The column after the last column of the tile.
+            seed (int): The seed of the random state of the tile.
+            named_dims (dict): Named dimensions.
+        """
+        region_y0 = max(y0 - self.halo, 0)
+        region_y1 = min(y1 + self.halo, node_data.shape[0])
+        region_x0 = max(x0 - self.halo, 0)
+        region_x1 = min(x1 + self.halo, node_data.shape[1])
+        region = node_data[region_y0:region_y1, region_x0:region_x1].copy()
+        self.ftr.apply(region, np.random.RandomState(seed), named_dims)
+        band[:, x0:x1] = region[y0 - region_y0:y1 - region_y0, x0 - region_x0:x1 - region_x0]
@@ -20,8 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from numbers import Real
 import numpy as np
+from dpemu.corpus import Corpus
 from dpemu.filters import Filter
+from dpemu.pg_utils import OCRErrorModel, sample_positions
 
 
 class MissingArea(Filter):
@@ -34,6 +37,8 @@ class MissingArea(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"probability": Real}
+
     def __init__(self, probability_id, radius_generator_id, missing_value_id):
         """
         Args:
@@ -46,61 +51,55 @@ class MissingArea(Filter):
         self.missing_value_id = missing_value_id
         super().__init__()
 
+    def is_identity(self):
+        return self.probability == 0
+
     def apply(self, node_data, random_state, named_dims):
+        apply_to_string_array(self, node_data, random_state, named_dims)
+
+    def apply_corpus(self, corpus, random_state, named_dims):
         if self.probability == 0:
             return
 
-        for index, _ in np.ndenumerate(node_data):
-            # 1. Get indexes of newline characters. We will not touch those
-            string = node_data[index]
-
-            row_starts = [0]
-            for i, c in enumerate(string):
-                if c == '\n':
-                    row_starts.append(i + 1)
-            if not row_starts or row_starts[-1] != len(string):
-                row_starts.append(len(string))
-            height = len(row_starts) - 1
-
-            widths = np.array([row_starts[i + 1] - row_starts[i] - 1 for i in range(height)])
-            if len(widths) > 0:
-                width = np.max(widths)
-            else:
-                width = 0
-
-            # 2. Generate error
-            errs = np.zeros(shape=(height + 1, width + 1))
-            ind = -1
-            while True:
-                ind += random_state.geometric(self.probability)
-
-                if ind >= width * height:
-                    break
-                y = ind // width
-                x = ind - y * width
-                r = self.radius_generator.generate(random_state)
-                x0 = max(x - r, 0)
-                x1 = min(x + r + 1, width)
-                y0 = max(y - r, 0)
-                y1 = min(y + r + 1, height)
-                errs[y0, x0] += 1
-                errs[y0, x1] -= 1
-                errs[y1, x0] -= 1
-                errs[y1, x1] += 1
-
-            # 3. Perform prefix sums, create mask
-            errs = np.cumsum(errs, axis=0)
-            errs = np.cumsum(errs, axis=1)
-            errs = (errs > 0)
-
-            mask = np.zeros(len(string))
-            for y in range(height):
-                ind = row_starts[y]
-                mask[ind:ind + widths[y]] = errs[y, 0:widths[y]]
-
-            # 4. Apply error to string
-            res_str = "".join([' ' if mask[i] else string[i] for i in range(len(mask))])
-            node_data[index] = res_str
+        # 1. Find the rows of every document. Newline characters are never covered, and every document is a grid
+        # of its rows padded to the width of the widest row.
+        newline_positions = np.flatnonzero(corpus.codepoints == ord("\n"))
+        row_bounds = np.unique(np.concatenate([corpus.offsets, newline_positions + 1]))
+        row_starts = row_bounds[:-1]
+        row_widths = np.diff(row_bounds) - 1
+        row_docs = np.searchsorted(corpus.offsets, row_starts, side="right") - 1
+        n_docs = len(corpus.offsets) - 1
+        heights = np.bincount(row_docs, minlength=n_docs)
+        first_rows = np.cumsum(heights) - heights
+        widths = np.zeros(n_docs, dtype=np.int64)
+        np.maximum.at(widths, row_docs, row_widths)
+
+        # 2. Sample the stains of all documents at once
+        cell_offsets = np.concatenate([[0], np.cumsum(heights * widths)])
+        positions = sample_positions(self.probability, cell_offsets[-1], random_state)
+        docs = np.searchsorted(cell_offsets, positions, side="right") - 1
+        y, x = np.divmod(positions - cell_offsets[docs], widths[docs])
+        r = self.radius_generator.generate_many(len(positions), random_state)
+        x0 = np.maximum(x - r, 0)
+        x1 = np.minimum(x + r + 1, widths[docs])
+        y0 = np.maximum(y - r, 0)
+        y1 = np.minimum(y + r + 1, heights[docs])
+
+        # 3. Split every stain into the intervals it covers on its rows and mark the covered characters
+        counts = y1 - y0
+        stains = np.repeat(np.arange(len(positions)), counts)
+        rows_in_stains = np.arange(len(stains)) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = first_rows[docs[stains]] + y0[stains] + rows_in_stains
+        starts = row_starts[rows] + x0[stains]
+        ends = row_starts[rows] + np.minimum(x1[stains], row_widths[rows])
+        is_nonempty = ends > starts
+        flips = (np.bincount(starts[is_nonempty], minlength=len(corpus.codepoints) + 1)
+                 - np.bincount(ends[is_nonempty], minlength=len(corpus.codepoints) + 1))
+        missing = np.cumsum(flips[:-1]) > 0
+
+        # 4. Apply error to the corpus
+        positions = np.flatnonzero(missing)
+        corpus.replace(positions, Corpus.from_strings([self.missing_value]), np.zeros(len(positions), dtype=np.int64))
 
 
 # TODO: why p_id? Why not just the distribution?
@@ -114,34 +113,54 @@ class OCRError(Filter):
     example_ocr_error_config.json
 
     These weights can be loaded and normalized into a probability distribution
-    using functions from dpemu/pg_utils.py.
+    using functions from dpemu/pg_utils.py. Instead of the dict of probabilities,
+    the distribution can be given as an OCRErrorModel compiled once with
+    dpemu.pg_utils.load_ocr_error_model, which avoids compiling it for every
+    parametrized copy of the filter.
 
     Inherits Filter class.
     """
 
+    param_types = {"p": Real}
+
     def __init__(self, normalized_params_id, p_id):
         """
         Args:
-            normalized_params_id (str): The key mapping to the character replacement probability distribution.
+            normalized_params_id (str): The key mapping to the character replacement probability distribution,
+                either a dict or a dpemu.pg_utils.OCRErrorModel.
             p_id (str): The key mapping to the probability distribution of a character replacement being applied.
         """
         self.normalized_params_id = normalized_params_id
         self.p_id = p_id
         super().__init__()
 
+    def is_identity(self):
+        return self.p == 0
+
     def apply(self, node_data, random_state, named_dims):
-        for index, string_ in np.ndenumerate(node_data):
-            node_data[index] = (self.generate_ocr_errors(string_, random_state))
+        apply_to_string_array(self, node_data, random_state, named_dims)
+
+    def apply_corpus(self, corpus, random_state, named_dims):
+        model = self.get_model()
+        candidates, key_indices = model.find_characters(corpus.codepoints)
+        replaced = random_state.random_sample(len(candidates)) < self.p
+        corpus.replace(candidates[replaced], model.options, model.sample(key_indices[replaced], random_state))
 
-    def generate_ocr_errors(self, string_, random_state):
-        return "".join([self.replace_char(c, random_state) for c in string_])
+    def get_model(self):
+        """Returns the character replacement distribution as an OCRErrorModel.
 
-    def replace_char(self, c, random_state):
-        if c in self.normalized_params and random_state.random_sample() < self.p:
-            chars, probs = self.normalized_params[c]
-            return random_state.choice(chars, 1, p=probs)[0]
+        A distribution given as a dict is compiled on the first call and reused while it stays the same.
 
-        return c
+        Returns:
+            dpemu.pg_utils.OCRErrorModel: The model.
+        """
+        if isinstance(self.normalized_params, OCRErrorModel):
+            return self.normalized_params
+        cached = self.__dict__.get("_model")
+        if cached is None or cached[0] is not self.normalized_params:
+            cached = (self.normalized_params, OCRErrorModel(self.normalized_params))
+            self._model = cached
+        return cached[1]
 
 
 class Uppercase(Filter):
@@ -152,6 +171,8 @@ class Uppercase(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"prob": Real}
+
     def __init__(self, probability_id):
         """
         Args:
@@ -160,15 +181,29 @@ class Uppercase(Filter):
         self.prob_id = probability_id
         super().__init__()
 
+    def is_identity(self):
+        return self.prob == 0
+
     def apply(self, node_data, random_state, named_dims):
+        apply_to_string_array(self, node_data, random_state, named_dims)
 
-        def stochastic_upper(char, probability):
-            if random_state.rand() <= probability:
-                return char.upper()
-            return char
+    def apply_corpus(self, corpus, random_state, named_dims):
+        positions = np.flatnonzero(random_state.rand(len(corpus.codepoints)) <= self.prob)
+        unique_codepoints, indices = np.unique(corpus.codepoints[positions], return_inverse=True)
+        uppercase = Corpus.from_strings([chr(codepoint).upper() for codepoint in unique_codepoints])
+        corpus.replace(positions, uppercase, indices)
 
-        for index, element in np.ndenumerate(node_data):
-            original_string = element
-            modified_string = "".join(
-                [stochastic_upper(c, self.prob) for c in original_string])
-            node_data[index] = modified_string
+
+def apply_to_string_array(ftr, node_data, random_state, named_dims):
+    """Applies a text filter to a Numpy array of strings through its apply_corpus method.
+
+    Args:
+        ftr (dpemu.filters.Filter): The text filter.
+        node_data (numpy.ndarray): An array of strings.
+        random_state (mtrand.RandomState): An instance of numpy.random.RandomState.
+        named_dims (dict): Named dimensions.
+    """
+    corpus = Corpus.from_strings([str(string) for string in node_data.flat])
+    ftr.apply_corpus(corpus, random_state, named_dims)
+    for index, string in zip(np.ndindex(node_data.shape), corpus.to_strings()):
+        node_data[index] = string
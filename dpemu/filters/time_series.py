@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from numbers import Real
 import numpy as np
 from dpemu.filters import Filter
 
@@ -35,36 +36,128 @@ class Gap(Filter):
     While the sensor is broken, values produced by it will be replaced with the
     provided missing value. Otherwise the original data remains unchanged.
 
+    Instead of stepping the chain one unit of time at a time, the lengths of the
+    alternating working and broken periods are sampled in bulk from geometric
+    distributions, in rounds of a fixed number of periods. The periods drawn but not
+    yet reached, including the rest of the current one, are kept after each call, so
+    consecutive chunks of a time series processed with separate calls get exactly
+    the same gaps as the whole series processed at once. This state is runtime state
+    rather than configuration, so it is kept in private attributes which are left out
+    of the serialized tree (see dpemu.serialization), and a filter built from a
+    serialized tree starts with a working sensor.
+
+    By default the elements of the data form a single time series in row-major order.
+    If channel_axis is given, every index along that axis is an independent sensor
+    whose time series consists of the remaining elements, and all sensors are
+    processed at once.
+
     Inherits Filter class.
     """
 
-    def __init__(self, prob_break_id, prob_recover_id, missing_value_id):
+    param_types = {"prob_break": Real, "prob_recover": Real}
+    pairs_per_round = 256
+    never = 2 ** 40
+    # The state of the first period of _runs, or of the current period if there are no _runs yet.
+    _working = True
+    # The lengths of the remaining periods for every sensor, the elapsed ones replaced by zeros.
+    _runs = None
+
+    def __init__(self, prob_break_id, prob_recover_id, missing_value_id, channel_axis=None):
         """
         Args:
             prob_break_id (str): The key mapping to the probability the working sensor breaks in one unit of time.
             prob_recover_id (str): The key mapping to the probability of the sensor recovering in one unit of time.
             missing_value_id (str): The key mapping to the value that the broken sensor produces.
+            channel_axis (int, optional): The axis of independent sensors. Defaults to None.
         """
         super().__init__()
         self.prob_break_id = prob_break_id
         self.prob_recover_id = prob_recover_id
         self.missing_value_id = missing_value_id
-        self.working = True
+        self.channel_axis = channel_axis
+
+    @property
+    def working(self):
+        """bool or numpy.ndarray: Whether the sensor, or every sensor along channel_axis, is currently working."""
+        if self._runs is None:
+            return self._working
+        current = np.argmax(self._runs > 0, axis=1)
+        working = (current % 2 == 0) == self._working
+        return bool(working[0]) if self.channel_axis is None else working
+
+    def is_identity(self):
+        return self.prob_break == 0 and np.all(self.working)
 
     def apply(self, node_data, random_state, named_dims):
-        def update_working_state():
-            if self.working:
-                if random_state.rand() < self.prob_break:
-                    self.working = False
-            else:
-                if random_state.rand() < self.prob_recover:
-                    self.working = True
+        if self.channel_axis is None:
+            broken = self.get_broken_mask(1, node_data.size, random_state)
+            node_data[broken.reshape(node_data.shape)] = self.missing_value
+        else:
+            channel_data = np.moveaxis(node_data, self.channel_axis, 0)
+            n_channels = channel_data.shape[0]
+            length = channel_data.size // n_channels if n_channels else 0
+            broken = self.get_broken_mask(n_channels, length, random_state)
+            channel_data[broken.reshape(channel_data.shape)] = self.missing_value
+
+    def get_broken_mask(self, n_channels, length, random_state):
+        """Samples the states of the sensors during the next units of time and updates the state of the sensors.
 
-        # random_state.rand(node_data.shape[0], node_data.shape[1])
-        for index, _ in np.ndenumerate(node_data):
-            update_working_state()
-            if not self.working:
-                node_data[index] = self.missing_value
+        Args:
+            n_channels (int): The number of independent sensors.
+            length (int): The number of units of time.
+            random_state (mtrand.RandomState): An instance of numpy.random.RandomState.
+
+        Returns:
+            numpy.ndarray: A boolean array of shape (n_channels, length) which is True where the sensor is broken.
+        """
+        if length == 0 or n_channels == 0:
+            return np.zeros((n_channels, length), dtype=bool)
+        runs = self._runs
+        is_new = runs is None or runs.shape[0] != n_channels
+        if is_new:
+            self._working = np.array(np.broadcast_to(self.working, (n_channels,)))
+            runs = np.zeros((n_channels, 0), dtype=np.int64)
+
+        def sample_run_lengths(probability):
+            size = (n_channels, self.pairs_per_round)
+            if probability == 0:
+                return np.full(size, self.never, dtype=np.int64)
+            return random_state.geometric(probability, size=size).astype(np.int64)
+
+        # Periods of the first state and of the other state alternate in every row of runs. The first
+        # period ever ends after G - 1 more units of time, every later period lasts G units of time.
+        # The number of rounds drawn only depends on the total length processed so far.
+        rounds = [runs]
+        totals = runs.sum(axis=1)
+        while totals.min() <= length:
+            working_runs = sample_run_lengths(self.prob_break)
+            broken_runs = sample_run_lengths(self.prob_recover)
+            new_runs = np.empty((n_channels, 2 * self.pairs_per_round), dtype=np.int64)
+            new_runs[:, 0::2] = np.where(self._working[:, np.newaxis], working_runs, broken_runs)
+            new_runs[:, 1::2] = np.where(self._working[:, np.newaxis], broken_runs, working_runs)
+            if is_new and len(rounds) == 1:
+                new_runs[:, 0] -= 1
+            rounds.append(new_runs)
+            totals += new_runs.sum(axis=1)
+        runs = np.concatenate(rounds, axis=1)
+
+        cumulative_ends = np.cumsum(runs, axis=1)
+        ends = np.minimum(cumulative_ends, length)
+        starts = np.concatenate([np.zeros((n_channels, 1), dtype=np.int64), ends[:, :-1]], axis=1)
+        is_broken_run = (np.arange(runs.shape[1]) % 2 == 0)[np.newaxis, :] != self._working[:, np.newaxis]
+        row_offsets = (np.arange(n_channels) * (length + 1))[:, np.newaxis]
+        n_bins = n_channels * (length + 1)
+        flips = (np.bincount((starts + row_offsets)[is_broken_run], minlength=n_bins)
+                 - np.bincount((ends + row_offsets)[is_broken_run], minlength=n_bins))
+        broken = np.cumsum(flips.reshape((n_channels, length + 1))[:, :length], axis=1) > 0
+
+        # Keep the rest of the current period and the later ones, dropping an even number of elapsed
+        # periods common to all sensors so that the first period keeps its state.
+        current = np.argmax(cumulative_ends > length, axis=1)
+        remaining = np.where(np.arange(runs.shape[1]) < current[:, np.newaxis], 0, runs)
+        remaining[np.arange(n_channels), current] = cumulative_ends[np.arange(n_channels), current] - length
+        self._runs = remaining[:, current.min() // 2 * 2:]
+        return broken
 
 
 class SensorDrift(Filter):
@@ -75,6 +168,8 @@ class SensorDrift(Filter):
     Inherits Filter class.
     """
 
+    param_types = {"magnitude": Real}
+
     def __init__(self, magnitude_id):
         """
         Args:
@@ -83,6 +178,9 @@ class SensorDrift(Filter):
         super().__init__()
         self.magnitude_id = magnitude_id
 
+    def is_identity(self):
+        return self.magnitude == 0
+
     def apply(self, node_data, random_state, named_dims):
         increases = np.arange(1, node_data.shape[0] + 1) * self.magnitude
         node_data += increases.reshape(node_data.shape)
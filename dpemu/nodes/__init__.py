@@ -24,10 +24,12 @@ from .node import Node, LeafNode
 from .array import Array
 from .series import Series, TupleSeries
 from .tuple import Tuple
+from .table import Table
 
 __all__ = ['Node',
            'LeafNode',
            'Array',
            'Series',
            'TupleSeries',
-           'Tuple']
+           'Tuple',
+           'Table']
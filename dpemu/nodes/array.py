@@ -20,6 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import numpy as np
+from scipy import sparse
+
+from ..corpus import Corpus
+from ..rng import RandomStreams, get_batch_random_state, get_random_state, to_random_state
 from .node import LeafNode, get_node_data, assign
 
 
@@ -30,6 +35,13 @@ class Array(LeafNode):
     One or more filters (error sources) can be added to the node.
     The filters are applied in the order in which they are added.
 
+    If the data is a SciPy sparse matrix in the CSR or CSC format, the filters modify it
+    in place without densifying it (see Filter.apply_sparse). Under a Series node every
+    row of the matrix is a copy, which is written back to the matrix.
+
+    If the data is a list of strings, the filters operate on a Corpus, which stores
+    the documents as one contiguous array of code points (see Filter.apply_corpus).
+
     You can optionally provide the constructor with a reshape parameter.
     In that case the filters attached to the node operate on data
     reshaped to the desired shape. The final shape of the data is
@@ -50,28 +62,186 @@ class Array(LeafNode):
 
         Args:
             node_data (numpy.ndarray): Data to be modified as a Numpy array.
-            random_state (mtrand.RandomState): An instance of numpy.random.RandomState.
+            random_state (RandomStreams or mtrand.RandomState): Random streams or an instance of
+                numpy.random.RandomState.
             named_dims (dict): Named dimensions.
         """
-        for f in self.filters:
+        for f, filter_random_state in self.get_active_filters_and_random_states(random_state):
             if self.reshape:
                 original_shape = node_data.shape
                 temp_data = node_data.reshape(self.reshape)
-                f.apply(temp_data, random_state, named_dims)
+                f.apply(temp_data, filter_random_state, named_dims)
                 node_data[...] = temp_data.reshape(original_shape)
             else:
-                f.apply(node_data, random_state, named_dims)
+                f.apply(node_data, filter_random_state, named_dims)
+
+    def generate_errors(self, data, error_params_list, random_state=None):
+        """Returns the data with the errors of several error parameter combinations introduced.
+
+        See Node.generate_errors. If the data is a Numpy array, the parametrized filter chains are
+        arranged into a prefix tree: a filter whose parameter values (see Filter.get_param_key) and
+        preceding filters are equal in several combinations is applied only once, and its output
+        is copied for the combinations whose chains diverge after it.
+        """
+        random_state = to_random_state(random_state)
+        if not isinstance(data, np.ndarray):
+            return super().generate_errors(data, error_params_list, random_state)
+
+        filter_lists = [self.get_parametrized_tree(error_params).filters for error_params in error_params_list]
+        node_data = data.copy()
+        if self.reshape:
+            node_data = node_data.reshape(self.reshape)
+        err_data = [None] * len(error_params_list)
+        self.apply_filter_prefixes(node_data, random_state, filter_lists, list(range(len(filter_lists))), 0, err_data,
+                                   {})
+        return [item_data.reshape(data.shape) for item_data in err_data]
+
+    def apply_filter_prefixes(self, node_data, random_state, filter_lists, indices, depth, err_data, named_dims):
+        """Applies the filter chains of several parameter combinations sharing their first depth filters.
+
+        The combinations are grouped by the parameter values of their filters at the given depth.
+        Every group continues from a copy of node_data (the last group uses node_data itself) and
+        from the same state of the random state, or from the stream of the filter.
+
+        Args:
+            node_data (numpy.ndarray): The output of the shared filters.
+            random_state (RandomStreams or mtrand.RandomState): Random streams or an instance of
+                numpy.random.RandomState.
+            filter_lists (list): The filters of every parametrized tree.
+            indices (list): The indices of the combinations sharing the first depth filters.
+            depth (int): The number of shared filters.
+            err_data (list): The list to which the outputs are written by index.
+            named_dims (dict): Named dimensions.
+        """
+        if depth == len(self.filters):
+            for i in indices[:-1]:
+                err_data[i] = node_data.copy()
+            err_data[indices[-1]] = node_data
+            return
+
+        groups = {}
+        for i in indices:
+            groups.setdefault(filter_lists[i][depth].get_param_key(), []).append(i)
+        is_streams = isinstance(random_state, RandomStreams)
+        state = None if is_streams else random_state.get_state()
+        for n_group, group in enumerate(groups.values()):
+            if not is_streams:
+                random_state.set_state(state)
+            group_data = node_data if n_group == len(groups) - 1 else node_data.copy()
+            f = filter_lists[group[0]][depth]
+            if not f.is_identity():
+                f.apply(group_data, get_random_state(random_state, depth), named_dims)
+            self.apply_filter_prefixes(group_data, random_state, filter_lists, group, depth + 1, err_data, named_dims)
+
+    def generate_error_sweep(self, data, error_params_list, random_state=None):
+        """Returns the data with the errors of several error parameter combinations introduced.
+
+        See Node.generate_error_sweep. If the data is a Numpy array, the data is copied once for
+        every combination and each filter is applied to all copies at once with its apply_sweep
+        method. Every filter draws its random numbers from its own stream, or from its own random
+        state seeded from random_state, so the random numbers of a filter do not depend on the
+        parameters of the other filters.
+        """
+        random_state = to_random_state(random_state)
+        if not isinstance(data, np.ndarray):
+            return super().generate_error_sweep(data, error_params_list, random_state)
+
+        sweep_data = np.repeat(data[np.newaxis], len(error_params_list), axis=0)
+        if self.reshape:
+            sweep_data = sweep_data.reshape((len(error_params_list),) + tuple(self.reshape))
+        if isinstance(random_state, RandomStreams):
+            filter_random_states = [random_state.get_random_state(i) for i in range(len(self.filters))]
+        else:
+            seeds = random_state.randint(2 ** 31, size=len(self.filters))
+            filter_random_states = [np.random.RandomState(seed) for seed in seeds]
+        copy_tree = self.copy_structure()
+        for f, filter_random_state in zip(copy_tree.filters, filter_random_states):
+            f.apply_sweep(sweep_data, filter_random_state, {}, error_params_list)
+        return sweep_data.reshape((len(error_params_list),) + data.shape)
+
+    def apply_filters_sparse(self, matrix, random_state, named_dims):
+        """Apply filters to a sparse matrix contained in this array.
+
+        Args:
+            matrix (scipy.sparse.spmatrix): A sparse matrix in the CSR or CSC format.
+            random_state (RandomStreams or mtrand.RandomState): Random streams or an instance of
+                numpy.random.RandomState.
+            named_dims (dict): Named dimensions.
+        """
+        if matrix.format not in ("csr", "csc"):
+            raise TypeError(f"Sparse matrices must be in the CSR or CSC format, not {matrix.format.upper()}.")
+        if self.reshape:
+            raise TypeError("Sparse matrices cannot be reshaped.")
+        matrix.sum_duplicates()
+        for f, filter_random_state in self.get_active_filters_and_random_states(random_state):
+            f.apply_sparse(matrix, filter_random_state, named_dims)
+
+    def can_process_in_buckets(self, items):
+        """Tells whether process_in_buckets can be used for the given list of data items.
+
+        Args:
+            items (list): A list of data items.
+
+        Returns:
+            bool: True if the node has no reshape and every item is a Numpy array.
+        """
+        return self.reshape is None and len(items) > 1 and all(type(item) is np.ndarray for item in items)
+
+    def process_in_buckets(self, items, random_state, named_dims):
+        """Apply all filters in this node to every data item in a list.
+
+        The items, which may have different shapes (e.g. images of different sizes), are
+        grouped into buckets by shape and data type. The items of every bucket are stacked
+        into one array and the apply_batch methods of the filters are called on the stack,
+        after which the results are written back to the original items.
+
+        With random streams, every item of a bucket draws its random numbers from the streams
+        of its index in the list (see dpemu.rng.BatchRandomState), so the results are the same
+        as when the items are processed one at a time.
+
+        Args:
+            items (list): A list of Numpy arrays to be modified.
+            random_state (RandomStreams or mtrand.RandomState): The random streams of the node containing
+                the list or an instance of numpy.random.RandomState.
+            named_dims (dict): Named dimensions.
+        """
+        buckets = {}
+        for i, item in enumerate(items):
+            buckets.setdefault((item.shape, item.dtype.str), []).append(i)
+        for indices in buckets.values():
+            batch_data = np.stack([items[i] for i in indices])
+            for k, f in enumerate(self.filters):
+                if not f.is_identity():
+                    f.apply_batch(batch_data, get_batch_random_state(random_state, indices, k), named_dims)
+            for i, item_data in zip(indices, batch_data):
+                items[i][...] = item_data
 
-    def process(self, data, random_state, index_tuple=(), named_dims={}):
+    def process(self, data, random_state, index_tuple=(), named_dims=None):
         """Apply all filters in this node.
 
         Args:
             data (numpy.ndarray): Data to be modified as a Numpy array.
-            random_state (mtrand.RandomState): An instance of numpy.random.RandomState
+            random_state (RandomStreams or mtrand.RandomState): Random streams or an instance of
+                numpy.random.RandomState.
             index_tuple (tuple, optional): The index of the node. Defaults to ().
-            named_dims (dict, optional): Named dimensions. Defaults to {}.
+            named_dims (dict, optional): Named dimensions. Defaults to None.
         """
-        node_data, is_list, is_scalar, is_tuple = get_node_data(data, index_tuple)
+        if named_dims is None:
+            named_dims = {}
+        node_data, is_list, is_scalar, is_tuple = get_node_data(data, index_tuple, make_array=False)
+        if sparse.issparse(node_data):
+            self.apply_filters_sparse(node_data, random_state, named_dims)
+            if index_tuple:
+                assign(data, index_tuple, node_data)
+            return
+        if is_list and not self.reshape and node_data and all(type(item) is str for item in node_data):
+            corpus = Corpus.from_strings(node_data)
+            for f, filter_random_state in self.get_active_filters_and_random_states(random_state):
+                f.apply_corpus(corpus, filter_random_state, named_dims)
+            assign(data, index_tuple, corpus.to_strings())
+            return
+        if type(node_data) is not np.ndarray:
+            node_data = np.array(node_data)
         if is_list:
             self.apply_filters(node_data, random_state, named_dims)
             assign(data, index_tuple, list(node_data))
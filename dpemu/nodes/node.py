@@ -24,6 +24,9 @@ import numpy as np
 import copy
 from abc import ABC, abstractmethod
 
+from ..filters.filter import bind_params
+from ..rng import RandomStreams, get_random_state, to_random_state
+
 
 class Node(ABC):
     """Node is the superclass for all node classes of the error generation tree.
@@ -51,55 +54,246 @@ class Node(ABC):
         Args:
             params_dict (dict): A Python dictionary.
         """
+        bind_params(self.get_param_bindings(), params_dict)
+
+    def get_param_bindings(self):
+        """Returns the parameter bindings of all filters in the tree.
+
+        Returns:
+            list: A list of (filter, slot, key) triples.
+        """
+        bindings = []
         for filter_ in self.filters:
-            filter_.set_params(params_dict)
+            bindings.extend(filter_.get_param_bindings())
         for child in self.children:
-            child.set_error_params(params_dict)
+            bindings.extend(child.get_param_bindings())
+        return bindings
+
+    def get_param_type_errors(self):
+        """Checks the bound parameter values of the filters against their param_types declarations.
+
+        Returns:
+            list: A list of error messages, one for every parameter value of a wrong type.
+        """
+        errors = []
+        for filter_, slot, key in self.get_param_bindings():
+            expected_type = filter_.param_types.get(slot)
+            value = getattr(filter_, slot)
+            if expected_type is not None and not isinstance(value, expected_type):
+                errors.append(f"{type(filter_).__name__}: the value of {key} should be of type "
+                              f"{get_type_names(expected_type)}, not {type(value).__name__}")
+        return errors
+
+    def get_active_filters(self):
+        """Returns the filters of the node which modify the data with their current parameter values.
+
+        Returns:
+            list: The filters whose is_identity method returns False.
+        """
+        return [filter_ for filter_ in self.filters if not filter_.is_identity()]
+
+    def is_identity(self):
+        """Tells whether the tree leaves the data unchanged with the current parameter values.
+
+        Returns:
+            bool: True if no filter in the tree modifies the data.
+        """
+        return not self.get_active_filters() and all(child.is_identity() for child in self.children)
+
+    def copy_structure(self):
+        """Returns a copy of the tree in which the nodes and filters are copied.
+
+        Other attributes of the filters, such as large lookup tables, are shared
+        with the original tree.
+
+        Returns:
+            Node: The root node of the copied tree.
+        """
+        copy_node = copy.copy(self)
+        copy_node.filters = [filter_.copy_structure() for filter_ in self.filters]
+        copy_node.children = [child.copy_structure() for child in self.children]
+        return copy_node
 
     @abstractmethod
-    def process(self, data, random_state, index_tuple=(), named_dims={}):
+    def process(self, data, random_state, index_tuple=(), named_dims=None):
         """Processes the given data by passing it recursively in the error generation tree and applying filters to it.
 
         Args:
             data (numpy.ndarray): Data to be modified as a Numpy array.
             random_state (mtrand.RandomState): An instance of mtrand.RandomState to ensure repeatability.
             index_tuple (tuple, optional): The index of the node. Defaults to ().
-            named_dims (dict, optional): Named dimensions. Defaults to {}.
+            named_dims (dict, optional): Named dimensions. Defaults to None.
         """
         pass
 
-    def generate_error(self, data, error_params, random_state=np.random.RandomState(42)):
+    def generate_error(self, data, error_params, random_state=None):
         """Returns the data with the desired errors introduced.
 
         The original data object is not modified. The error parameters must be provided as
         a dictionary whose keys are the parameter identifiers (given as parameters to the
         filters) and whose values are the desired parameter values.
 
+        By default, every element and every filter draws its random numbers from its own
+        stream (see dpemu.rng.RandomStreams), so the result depends only on the seed, the data
+        and the error parameters. If an instance of numpy.random.RandomState is given instead,
+        all filters draw their random numbers from it one after another.
+
         Args:
             data (numpy.ndarray): Data to be modified as a Numpy array.
             error_params (dict): A dictionary containing the parameters for error generation.
-            random_state (mtrand.RandomState, optional): An instance of numpy.random.RandomState.
-                Defaults to np.random.RandomState(42).
+            random_state (int, RandomStreams or mtrand.RandomState, optional): A seed, an instance of
+                RandomStreams or an instance of numpy.random.RandomState. Defaults to None, which means
+                RandomStreams with the seed 42.
 
         Returns:
             numpy.ndarray: Errorified data.
         """
         copy_data = copy.deepcopy(data)
-        copy_tree = copy.deepcopy(self)
-        copy_tree.set_error_params(error_params)
-        copy_tree.process(copy_data, random_state)
+        copy_tree = self.get_parametrized_tree(error_params)
+        copy_tree.process(copy_data, to_random_state(random_state))
         return copy_data
 
+    def generate_errors(self, data, error_params_list, random_state=None):
+        """Returns the data with the errors of several error parameter combinations introduced.
+
+        Every combination is generated starting from the current state of random_state, so the
+        i-th element of the result is equal to generate_error(data, error_params_list[i], random_state)
+        called with random_state in that state. Array nodes compute the part of the filter chain
+        which is shared by several combinations only once (see Array.generate_errors).
+
+        Args:
+            data (numpy.ndarray): Data to be modified as a Numpy array.
+            error_params_list (list): A list of dictionaries containing the parameters for error generation.
+            random_state (int, RandomStreams or mtrand.RandomState, optional): See generate_error.
+                Defaults to None.
+
+        Returns:
+            list: The errorified data of every combination.
+        """
+        random_state = to_random_state(random_state)
+        if isinstance(random_state, RandomStreams):
+            return [self.generate_error(data, error_params, random_state) for error_params in error_params_list]
+        state = random_state.get_state()
+        err_data = []
+        for error_params in error_params_list:
+            random_state.set_state(state)
+            err_data.append(self.generate_error(data, error_params, random_state))
+        return err_data
+
+    def generate_error_sweep(self, data, error_params_list, random_state=None):
+        """Returns the data with the errors of several error parameter combinations introduced.
+
+        Every parameter combination is generated with the same random numbers (common random
+        numbers), so e.g. the values missing with a smaller probability are also missing with
+        a larger one. This makes the differences between the combinations, and thus score curves
+        plotted against an error parameter, much less noisy than with independent random numbers.
+
+        Array nodes whose data is a Numpy array errorify all combinations in a single pass
+        (see Filter.apply_sweep). Other trees are applied to the combinations one at a time,
+        every time with the same random streams or with a random state seeded identically.
+
+        Args:
+            data (numpy.ndarray): Data to be modified as a Numpy array.
+            error_params_list (list): A list of dictionaries containing the parameters for error generation.
+            random_state (int, RandomStreams or mtrand.RandomState, optional): See generate_error.
+                Defaults to None.
+
+        Returns:
+            numpy.ndarray or list: The errorified data of every combination, stacked along a new first
+                axis if the data is a Numpy array.
+        """
+        random_state = to_random_state(random_state)
+        if isinstance(random_state, RandomStreams):
+            err_data = [self.generate_error(data, error_params, random_state) for error_params in error_params_list]
+        else:
+            seed = random_state.randint(2 ** 31)
+            err_data = [self.generate_error(data, error_params, np.random.RandomState(seed))
+                        for error_params in error_params_list]
+        if isinstance(data, np.ndarray):
+            return np.stack(err_data)
+        return err_data
+
+    def generate_error_in_chunks(self, chunks, error_params, random_state=None):
+        """Yields the chunks of a dataset one by one with the desired errors introduced.
+
+        The chunks must be consecutive slices of the dataset along the first dimension.
+        The same parametrized copy of the error generation tree is used for every chunk, so
+        stateful filters (e.g. Gap) carry their state from one chunk to the next.
+
+        With random streams, the elements of every chunk get the streams they would get in
+        the whole dataset (see RandomStreams.offset), so if the root of the tree is a Series or
+        a TupleSeries node, the concatenated output is equal to the output of generate_error on
+        the whole dataset. The filters of other root nodes are applied to each chunk as a whole
+        and continue their streams from one chunk to the next (see RandomStreams.continued_states),
+        so the output is equal to that of generate_error when the filters draw their random numbers
+        in the order of the elements, as e.g. Missing and GaussianNoise do. An instance of
+        numpy.random.RandomState is used for every chunk in turn. The chunks themselves are
+        not modified.
+
+        Args:
+            chunks (iterable): An iterable of data chunks, e.g. slices of a numpy.memmap.
+            error_params (dict): A dictionary containing the parameters for error generation.
+            random_state (int, RandomStreams or mtrand.RandomState, optional): See generate_error.
+                Defaults to None.
+
+        Yields:
+            numpy.ndarray: An errorified chunk.
+        """
+        random_state = to_random_state(random_state)
+        copy_tree = self.get_parametrized_tree(error_params)
+        offset = 0
+        continued_states = {}
+        for chunk in chunks:
+            copy_chunk = copy.deepcopy(chunk)
+            if isinstance(random_state, RandomStreams):
+                chunk_random_state = RandomStreams(random_state.seed, random_state.path, random_state.offset + offset,
+                                                   random_state.indices, continued_states)
+            else:
+                chunk_random_state = random_state
+            copy_tree.process(copy_chunk, chunk_random_state)
+            offset += len(chunk)
+            yield copy_chunk
+
+    def generate_error_to_file(self, data, path_to_output, error_params, chunk_length=1024, random_state=None):
+        """Writes the data with the desired errors introduced to a .npy file without loading it all into memory.
+
+        The data is read and errorified chunk_length elements (along the first dimension) at a time
+        and the errorified chunks are written to a memory-mapped .npy file.
+
+        Args:
+            data (str or numpy.ndarray): A path to a .npy file or an array, e.g. a numpy.memmap.
+            path_to_output (str): The path of the .npy file to be written.
+            error_params (dict): A dictionary containing the parameters for error generation.
+            chunk_length (int, optional): The number of elements processed at a time. Defaults to 1024.
+            random_state (int, RandomStreams or mtrand.RandomState, optional): See generate_error.
+                Defaults to None.
+
+        Returns:
+            numpy.memmap: The errorified data as a memory-mapped array.
+        """
+        if not isinstance(data, np.ndarray):
+            data = np.load(data, mmap_mode="r")
+        output = np.lib.format.open_memmap(path_to_output, mode="w+", dtype=data.dtype, shape=data.shape)
+        starts = range(0, data.shape[0], chunk_length)
+        chunks = (data[start:start + chunk_length] for start in starts)
+        for start, err_chunk in zip(starts, self.generate_error_in_chunks(chunks, error_params, random_state)):
+            output[start:start + err_chunk.shape[0]] = err_chunk
+        output.flush()
+        return output
+
     def get_parametrized_tree(self, error_params):
         """Returns an error generation tree with desired parameter values of the filters.
 
+        The tree is copied with copy_structure, so attributes of the filters other than the
+        error parameters are shared with the original tree.
+
         Args:
             error_params (dict): A dictionary containing the parameters for error generation.
 
         Returns:
             Node: A root node of the error generation tree.
         """
-        copy_tree = copy.deepcopy(self)
+        copy_tree = self.copy_structure()
         copy_tree.set_error_params(error_params)
         return copy_tree
 
@@ -111,9 +305,32 @@ class LeafNode(Node):
     def __init__(self):
         super().__init__([])
 
+    def get_active_filters_and_random_states(self, random_state):
+        """Returns the active filters of the node together with the random states they should use.
+
+        With random streams, every filter draws from the stream of its position in the node,
+        so skipping an inactive filter does not change the random numbers of the others.
+        Otherwise all filters share the given random state.
+
+        Args:
+            random_state (RandomStreams or mtrand.RandomState): The random state given to the node.
+
+        Returns:
+            list: A list of (filter, random state) pairs.
+        """
+        return [(f, get_random_state(random_state, i)) for i, f in enumerate(self.filters) if not f.is_identity()]
+
     def apply_filters(self, node_data, random_state, named_dims):
-        for f in self.filters:
-            f.apply(node_data, random_state, named_dims)
+        for f, filter_random_state in self.get_active_filters_and_random_states(random_state):
+            f.apply(node_data, filter_random_state, named_dims)
+
+
+def get_type_names(types):
+    """Returns the name of a type or the names of a tuple of types separated by "or".
+    """
+    if isinstance(types, tuple):
+        return " or ".join(t.__name__ for t in types)
+    return types.__name__
 
 
 def get_node_data(data, index_tuple, make_array=True):
@@ -20,14 +20,27 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import copy
+
+import numpy as np
+
+from .array import Array
 from .node import Node, get_node_data
 from ..pg_utils import first_dimension_length
+from ..rng import RandomStreams, spawn, spawn_index, to_random_state
 
 
 class Series(Node):
     """The Series node represents the leftmost dimension of any unit of data passed to it.
 
     The Series node is given a child node and the data is passed to it after "removing" the leftmost dimension.
+
+    With random streams, every element is processed with the streams of its index (see
+    dpemu.rng.RandomStreams.spawn_index).
+
+    If the data is a list of Numpy arrays (e.g. images of different sizes), the child is an Array
+    node without reshape and no dim_name is given, the arrays are processed in buckets of equally
+    shaped arrays instead of one at a time. See Array.process_in_buckets.
     """
 
     def __init__(self, child, dim_name=None):
@@ -40,13 +53,34 @@ class Series(Node):
         super().__init__([child])
         self.dim_name = dim_name
 
-    def process(self, data, random_state, index_tuple=(), named_dims={}):
-        node_data, _, _, _ = get_node_data(data, index_tuple, make_array=False)
+    def process(self, data, random_state, index_tuple=(), named_dims=None):
+        node_data, is_list, _, _ = get_node_data(data, index_tuple, make_array=False)
+        child = self.children[0]
+        if is_list and not self.dim_name and isinstance(child, Array) and child.can_process_in_buckets(node_data):
+            child.process_in_buckets(node_data, random_state, named_dims or {})
+            return
         data_length = first_dimension_length(node_data)
         for i in range(data_length):
-            if self.dim_name:
-                named_dims[self.dim_name] = i
-            self.children[0].process(data, random_state, (i, *index_tuple), named_dims)
+            self.children[0].process(data, spawn_index(random_state, i), (i, *index_tuple),
+                                     add_named_dim(named_dims, self.dim_name, i))
+
+    def generate_errors(self, data, error_params_list, random_state=None):
+        """Returns the data with the errors of several error parameter combinations introduced.
+
+        See Node.generate_errors. If the child is an Array node, every element of the data is a
+        Numpy array and random streams are used, the filter chains of the combinations are arranged
+        into a prefix tree for every element (see Array.apply_filter_prefixes), so a filter shared by
+        several combinations is applied to each element only once.
+        """
+        random_state = to_random_state(random_state)
+        child = self.children[0]
+        if not isinstance(random_state, RandomStreams) or not can_share_prefixes(child, data):
+            return super().generate_errors(data, error_params_list, random_state)
+        err_data = [copy.deepcopy(data) for _ in error_params_list]
+        filter_lists = [self.get_parametrized_tree(error_params).children[0].filters
+                        for error_params in error_params_list]
+        apply_filter_prefixes_to_elements(child, err_data, filter_lists, random_state, self.dim_name)
+        return err_data
 
 
 class TupleSeries(Node):
@@ -67,11 +101,89 @@ class TupleSeries(Node):
         super().__init__(children)
         self.dim_name = dim_name
 
-    def process(self, data, random_state, index_tuple=(), named_dims={}):
+    def process(self, data, random_state, index_tuple=(), named_dims=None):
         node_data = get_node_data(data, index_tuple, make_array=False)[0]
         data_length = first_dimension_length(node_data[0])
         for i, child in enumerate(self.children):
+            child_random_state = spawn(random_state, i)
             for j in range(data_length):
-                if self.dim_name:
-                    named_dims[self.dim_name] = j
-                child.process(data[i], random_state, (j,), named_dims)
+                child.process(data[i], spawn_index(child_random_state, j), (j,),
+                              add_named_dim(named_dims, self.dim_name, j))
+
+    def generate_errors(self, data, error_params_list, random_state=None):
+        """Returns the data with the errors of several error parameter combinations introduced.
+
+        See Node.generate_errors and Series.generate_errors. The filter chains of every child are
+        arranged into a prefix tree for every element if all children are Array nodes, every element
+        of the data is a Numpy array and random streams are used.
+        """
+        random_state = to_random_state(random_state)
+        if (not isinstance(random_state, RandomStreams) or len(data) != len(self.children)
+                or not all(can_share_prefixes(child, child_data) for child, child_data in zip(self.children, data))):
+            return super().generate_errors(data, error_params_list, random_state)
+        err_data = [copy.deepcopy(data) for _ in error_params_list]
+        trees = [self.get_parametrized_tree(error_params) for error_params in error_params_list]
+        for i, child in enumerate(self.children):
+            apply_filter_prefixes_to_elements(child, [item_data[i] for item_data in err_data],
+                                              [tree.children[i].filters for tree in trees], spawn(random_state, i),
+                                              self.dim_name)
+        return err_data
+
+
+def can_share_prefixes(child, data):
+    """Tells whether the filter chains of a child node can be applied to the elements of the data as prefix trees.
+
+    Args:
+        child (Node): The child node of a Series or a TupleSeries node.
+        data (obj): The data passed to the child element by element.
+
+    Returns:
+        bool: True if the child is an Array node and every element of the data is a Numpy array.
+    """
+    if not isinstance(child, Array):
+        return False
+    if isinstance(data, np.ndarray):
+        return data.ndim >= 2
+    return type(data) is list and all(type(item) is np.ndarray for item in data)
+
+
+def apply_filter_prefixes_to_elements(child, err_data, filter_lists, random_state, dim_name):
+    """Applies the filter chains of several parameter combinations to every element of copies of the data.
+
+    Args:
+        child (Array): The Array node whose parametrized filters are applied.
+        err_data (list): A copy of the data for every combination, modified in place.
+        filter_lists (list): The filters of the child in every parametrized tree.
+        random_state (RandomStreams): The random streams of the elements.
+        dim_name (str): The named dimension of the elements, or None.
+    """
+    indices = list(range(len(err_data)))
+    for i in range(len(err_data[0])):
+        element_shape = err_data[0][i].shape
+        node_data = err_data[0][i].copy()
+        if child.reshape:
+            node_data = node_data.reshape(child.reshape)
+        err_elements = [None] * len(err_data)
+        named_dims = {dim_name: i} if dim_name else {}
+        child.apply_filter_prefixes(node_data, spawn_index(random_state, i), filter_lists, indices, 0, err_elements,
+                                    named_dims)
+        for item_data, err_element in zip(err_data, err_elements):
+            item_data[i][...] = err_element.reshape(element_shape)
+
+
+def add_named_dim(named_dims, dim_name, index):
+    """Returns the named dimensions of an element of a Series or a TupleSeries node.
+
+    A new dictionary is returned, so the named dimensions of the node itself are never modified.
+
+    Args:
+        named_dims (dict or None): The named dimensions of the node.
+        dim_name (str or None): The name of the dimension of the node.
+        index (int): The index of the element.
+
+    Returns:
+        dict: The named dimensions of the element.
+    """
+    if not dim_name:
+        return named_dims
+    return {**(named_dims or {}), dim_name: index}
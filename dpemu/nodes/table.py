@@ -0,0 +1,60 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+from .node import Node, get_node_data
+from ..rng import spawn
+
+
+class Table(Node):
+    """The Table node represents tabular data consisting of named columns.
+
+    The Table node is given a child node for every column that should be modified.
+    Each child node receives the whole column as a Numpy array, so an Array child
+    applies its filters to the column at once, whereas e.g. a Series child processes
+    the column row by row. The modified columns are written back to the table and
+    the other columns are not touched at all. With random streams, every column is
+    processed with the streams of its name.
+
+    Any data object supporting column access by name works as the table, for example
+    a pandas DataFrame, a dict of arrays or lists, or a Numpy structured array.
+    Arrow tables can be processed by converting them to pandas DataFrames first.
+    """
+
+    def __init__(self, columns):
+        """
+        Args:
+            columns (dict): A dict mapping column names to the child nodes processing the columns.
+        """
+        super().__init__(list(columns.values()))
+        self.column_names = list(columns.keys())
+
+    def process(self, data, random_state, index_tuple=(), named_dims=None):
+        node_data = get_node_data(data, index_tuple, make_array=False)[0]
+        for name, child in zip(self.column_names, self.children):
+            original_column = node_data[name]
+            column = np.array(original_column)
+            child.process(column, spawn(random_state, name), (), named_dims)
+            if type(original_column) is list:
+                column = column.tolist()
+            node_data[name] = column
@@ -31,7 +31,9 @@ class Tuple(LeafNode):
     def __init__(self):
         super().__init__()
 
-    def process(self, data, random_state, index_tuple=(), named_dims={}):
+    def process(self, data, random_state, index_tuple=(), named_dims=None):
+        if named_dims is None:
+            named_dims = {}
         node_data, _, _, _ = get_node_data(data, index_tuple)
         self.apply_filters(node_data, random_state, named_dims)
         assign(data, index_tuple, tuple(node_data))
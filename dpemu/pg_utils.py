@@ -20,11 +20,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import hashlib
 import json
+import os
+import pickle
 from random import randint
 
 import numpy as np
 
+from dpemu.corpus import Corpus
+
 
 def load_ocr_error_params(path_to_error_params):
     """Loads error parameters from a JSON-file.
@@ -73,6 +78,141 @@ def normalize_weights(weights):
     return [weight / total for weight in weights]
 
 
+class OCRErrorModel:
+    """A character replacement distribution for OCRError compiled into arrays.
+
+    The characters having replacement options are mapped to dense indices by the sorted array
+    of their code points, and the options of all characters are stored back to back in a Corpus.
+    The distribution of every character is stored as an alias table (Vose's alias method),
+    so that sampling a replacement takes constant time and any number of replacements can be
+    sampled with a few array operations. The model is built once, e.g. from the JSON file
+    loaded with load_ocr_error_params, and it can be pickled and cached on disk
+    (see load_ocr_error_model).
+    """
+
+    def __init__(self, params):
+        """
+        Args:
+            params (dict): A dict mapping characters to pairs of a list of replacement strings and a list
+                of their weights, which do not have to be normalized.
+        """
+        characters = sorted(c for c in params if len(c) == 1)
+        self.keys = np.array([ord(c) for c in characters], dtype=np.uint32)
+        self.option_offsets = np.zeros(len(characters) + 1, dtype=np.int64)
+        option_strings = []
+        acceptance_probabilities = []
+        aliases = []
+        for i, c in enumerate(characters):
+            replacements, weights = params[c]
+            offset = len(option_strings)
+            option_strings.extend(replacements)
+            self.option_offsets[i + 1] = len(option_strings)
+            acceptance, alias = build_alias_table(weights)
+            acceptance_probabilities.extend(acceptance)
+            aliases.extend(alias + offset)
+        self.options = Corpus.from_strings(option_strings)
+        self.acceptance_probabilities = np.array(acceptance_probabilities, dtype=np.float64)
+        self.aliases = np.array(aliases, dtype=np.int64)
+
+    @classmethod
+    def from_json(cls, path_to_error_params):
+        """Builds the model from a JSON file in the format of load_ocr_error_params.
+
+        Args:
+            path_to_error_params (str): The path to the JSON file.
+
+        Returns:
+            OCRErrorModel: The model.
+        """
+        return cls(load_ocr_error_params(path_to_error_params))
+
+    def find_characters(self, codepoints):
+        """Finds the code points which have replacement options.
+
+        Args:
+            codepoints (numpy.ndarray): An array of Unicode code points.
+
+        Returns:
+            numpy.ndarray, numpy.ndarray: The positions of the code points having replacement options
+                and the dense indices of those characters.
+        """
+        if len(self.keys) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        key_indices = np.minimum(np.searchsorted(self.keys, codepoints), len(self.keys) - 1)
+        positions = np.flatnonzero(self.keys[key_indices] == codepoints)
+        return positions, key_indices[positions]
+
+    def sample(self, key_indices, random_state):
+        """Samples a replacement for every given character.
+
+        Args:
+            key_indices (numpy.ndarray): The dense indices of the characters.
+            random_state (mtrand.RandomState): An instance of numpy.random.RandomState.
+
+        Returns:
+            numpy.ndarray: The indices of the sampled replacements in self.options.
+        """
+        n_options = self.option_offsets[key_indices + 1] - self.option_offsets[key_indices]
+        picked = self.option_offsets[key_indices] + np.minimum(
+            (random_state.random_sample(len(key_indices)) * n_options).astype(np.int64), n_options - 1)
+        kept = random_state.random_sample(len(key_indices)) < self.acceptance_probabilities[picked]
+        return np.where(kept, picked, self.aliases[picked])
+
+
+def build_alias_table(weights):
+    """Builds the alias table of a discrete distribution with Vose's alias method.
+
+    Args:
+        weights (list): Non-negative weights of the outcomes.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: The probability of keeping every outcome when it is picked
+            uniformly, and the outcome taken otherwise.
+    """
+    n_outcomes = len(weights)
+    scaled = np.array(weights, dtype=np.float64) * n_outcomes / np.sum(weights)
+    acceptance = np.ones(n_outcomes)
+    alias = np.arange(n_outcomes)
+    small = [i for i in range(n_outcomes) if scaled[i] < 1]
+    large = [i for i in range(n_outcomes) if scaled[i] >= 1]
+    while small and large:
+        i, j = small.pop(), large[-1]
+        acceptance[i] = scaled[i]
+        alias[i] = j
+        scaled[j] -= 1 - scaled[i]
+        if scaled[j] < 1:
+            small.append(large.pop())
+    return acceptance, alias
+
+
+def load_ocr_error_model(path_to_error_params, cache_dir=None):
+    """Loads OCR error parameters from a JSON file and compiles them into an OCRErrorModel.
+
+    If a cache directory is given, the compiled model is pickled there under the hash of the
+    contents of the JSON file, and later calls load the pickled model instead of compiling it again.
+
+    Args:
+        path_to_error_params (str): The path to the JSON file.
+        cache_dir (str, optional): The directory of the cached models. Defaults to None.
+
+    Returns:
+        OCRErrorModel: The model.
+    """
+    if cache_dir is None:
+        return OCRErrorModel.from_json(path_to_error_params)
+    with open(path_to_error_params, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    path_to_model = os.path.join(cache_dir, f"ocr_error_model_{digest}.pkl")
+    if os.path.exists(path_to_model):
+        with open(path_to_model, "rb") as file:
+            return pickle.load(file)
+    model = OCRErrorModel.from_json(path_to_error_params)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path_to_model, "wb") as file:
+        pickle.dump(model, file)
+    return model
+
+
 def to_time_series_x_y(data, x_length):
     """
     Convert time series data to pairs of x, y where x is a vector of x_length
@@ -120,3 +260,30 @@ def generate_random_dict_key(dct, prefix):
     while key in dct:
         key += "ABCDEFGHIJKLMNOPQRSTUVWXYZ"[randint(0, 25)]
     return key
+
+
+def sample_positions(probability, size, random_state):
+    """Samples the positions where an event happens independently with the given probability.
+
+    The gaps between consecutive positions are drawn from the geometric distribution in bulk
+    instead of one at a time.
+
+    Args:
+        probability (float): The probability of the event at every position.
+        size (int): The number of positions.
+        random_state (mtrand.RandomState): An instance of numpy.random.RandomState() random number generator.
+
+    Returns:
+        numpy.ndarray: The sorted positions where the event happens.
+    """
+    if probability == 0 or size == 0:
+        return np.array([], dtype=np.int64)
+    batches = []
+    last = -1
+    while last < size:
+        expected = size * probability
+        batch = last + np.cumsum(random_state.geometric(probability, size=int(expected + 4 * np.sqrt(expected)) + 1))
+        batches.append(batch)
+        last = batch[-1]
+    positions = np.concatenate(batches)
+    return positions[:np.searchsorted(positions, size)]
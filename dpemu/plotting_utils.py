@@ -454,7 +454,7 @@ def visualize_error_generator(root_node, view=True):
         # construct the label of the node
         label = "< " + str(ftr.__class__.__name__)
         for key in vars(ftr):
-            if key[-3:] == "_id" or key == "shape":
+            if key[-3:] == "_id" or key[0] == "_" or key == "shape":
                 continue
             value = ftr.__dict__[key]
             if isinstance(value, Filter):
@@ -22,6 +22,8 @@
 
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 
 class RadiusGenerator(ABC):
     """Radius generators are used by some filters for generating radii for their effects.
@@ -43,6 +45,22 @@ class RadiusGenerator(ABC):
         """
         pass
 
+    def generate_many(self, n, random_state):
+        """Generates the given number of radii at once.
+
+        The default implementation calls generate repeatedly. Subclasses can override it
+        to draw all radii with a single call to the random state.
+
+        Args:
+            n (int): The number of radii.
+            random_state (mtrand.RandomState): A random state object to be used in all things related to randomness
+                to ensure the repeatability.
+
+        Returns:
+            numpy.ndarray: An integer array of the generated radii.
+        """
+        return np.array([self.generate(random_state) for _ in range(n)], dtype=np.int64)
+
 
 class GaussianRadiusGenerator(RadiusGenerator):
     """GaussianRadiusGenerator generates radii from a normal distribution with given parameters.
@@ -60,6 +78,9 @@ class GaussianRadiusGenerator(RadiusGenerator):
     def generate(self, random_state):
         return max(0, self.mean + round(random_state.normal(scale=self.std)))
 
+    def generate_many(self, n, random_state):
+        return np.maximum(0, self.mean + np.round(random_state.normal(scale=self.std, size=n))).astype(np.int64)
+
 
 class ProbabilityArrayRadiusGenerator(RadiusGenerator):
     """ProbabilityArrayRadiusGenerator generates radii based on the probabilities in the array given as a parameter.
@@ -80,3 +101,9 @@ class ProbabilityArrayRadiusGenerator(RadiusGenerator):
                 return radius
             sum_of_probabilities -= self.probability_array[radius]
         return 0  # return 0 if for some reason none of the radii is chosen
+
+    def generate_many(self, n, random_state):
+        # choosing every radius with its own probability in turn is the same as inverting the cumulative distribution
+        radii = np.searchsorted(np.cumsum(self.probability_array), random_state.random_sample(n))
+        radii[radii == len(self.probability_array)] = 0
+        return radii.astype(np.int64)
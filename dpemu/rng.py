@@ -0,0 +1,349 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+_random_states = threading.local()
+
+
+class RandomStreams:
+    """A tree of independent random number streams identified by paths.
+
+    Every stream is a counter-based Philox generator. The nodes of the error generation tree
+    extend the path of the streams: a Table node appends the name of the column, a TupleSeries
+    node the index of the child and so on, and every filter of a leaf node gets the stream of its
+    own position. The key of the generator is derived from the seed and this path, so a stream
+    does not depend on which other streams have been used or in which order.
+
+    The elements of a Series or a TupleSeries node share the key of their path, and the indices of
+    the elements select disjoint blocks of the counter instead (see spawn_index). Hashing the path
+    is thus done once per filter instead of once per element and filter. Consequently the errors
+    of an element are the same whether the data is errorified as a whole, in chunks, in parallel
+    or one element at a time.
+
+    The streams are wrapped in numpy.random.RandomState, so filters can use them like any other
+    random state.
+
+    If the data passed to the root node is a slice of a larger dataset, the offset tells the index
+    of the first element of the slice, so that the elements get the streams they would get in the
+    whole dataset. The streams of filters applied to a slice as a whole, outside any element, can
+    instead continue from one slice to the next when the slices share continued_states.
+    """
+
+    def __init__(self, seed=42, path=(), offset=0, indices=(), continued_states=None):
+        """
+        Args:
+            seed (int, optional): The seed from which all streams are derived. Defaults to 42.
+            path (tuple, optional): The path of the node owning the streams. Defaults to ().
+            offset (int, optional): The index of the first element of the data in the whole dataset.
+                Defaults to 0.
+            indices (tuple, optional): The indices of the elements containing the data of the node,
+                outermost first. Defaults to ().
+            continued_states (dict, optional): If given, the streams outside any element ignore the offset
+                and their random states are kept in this dictionary instead of being reset, so consecutive
+                slices of a dataset sharing the dictionary continue the same streams. Defaults to None.
+        """
+        self.seed = seed
+        self.path = path
+        self.offset = offset
+        self.indices = indices
+        self.continued_states = continued_states
+
+    def spawn(self, *keys):
+        """Returns the streams of a descendant identified by keys, e.g. the name of a column.
+
+        Args:
+            *keys: Integers or strings appended to the path.
+
+        Returns:
+            RandomStreams: The streams of the descendant.
+        """
+        return RandomStreams(self.seed, self.path + tuple(normalize_key(key) for key in keys), self.offset,
+                             self.indices, self.continued_states)
+
+    def spawn_index(self, index):
+        """Returns the streams of an element along the first dimension of the data.
+
+        The path of the element only records that an element was selected, and the index is
+        appended to the indices, which select the block of the counter used by the element.
+
+        Args:
+            index (int): The index of the element in the data, which is shifted by the offset.
+
+        Returns:
+            RandomStreams: The streams of the element.
+        """
+        return RandomStreams(self.seed, self.path + (None,), 0, self.indices + (self.offset + int(index),),
+                             self.continued_states)
+
+    def get_random_state(self, *keys):
+        """Returns a random state drawing from the stream identified by keys.
+
+        To avoid creating a new generator for every element, the random state is shared by all
+        elements of the same stream in the current thread: it is reset to the start of the stream
+        of this element, and a later call for another element of the same stream resets it again.
+        Streams outside any element continue where they were left if continued_states is given.
+
+        Args:
+            *keys: Integers or strings identifying the stream, e.g. the position of a filter.
+
+        Returns:
+            mtrand.RandomState: A random state backed by a Philox generator.
+        """
+        if self.continued_states is not None and not self.indices:
+            key = RandomStreams(self.seed, self.path).get_stream_key_and_counter(*keys)[0]
+            if key not in self.continued_states:
+                self.continued_states[key] = np.random.RandomState(np.random.Philox(key=key))
+            return self.continued_states[key]
+        return get_pooled_random_state(*self.get_stream_key_and_counter(*keys))
+
+    def get_stream_key_and_counter(self, *keys):
+        """Returns the key and the initial counter of the Philox generator of the stream identified by keys.
+
+        The last three indices of the elements occupy the three upper 64-bit words of the counter,
+        the lowest word counting the blocks of random numbers drawn. Outer indices, if any, are
+        included in the key.
+
+        Args:
+            *keys: Integers or strings identifying the stream, e.g. the position of a filter.
+
+        Returns:
+            int, list: The key and the four 64-bit words of the counter, least significant first.
+        """
+        path = self.path + tuple(map(normalize_key, keys))
+        if self.offset:
+            path += ("offset", self.offset)
+        indices = self.indices
+        key = get_stream_key(self.seed, path, indices[:-3])
+        counter = [0, 0, 0, 0]
+        for word, index in enumerate(reversed(indices[-3:]), 1):
+            counter[word] = index
+        return key, counter
+
+
+class BatchRandomState:
+    """The random streams of the items of a batch processed at once.
+
+    The random numbers of a draw are drawn for every item from the stream of the item, continuing
+    where the previous draw of the item stopped, and stacked, so the items get the same random
+    numbers as when they are processed one at a time. The first dimension of the size of every
+    draw must thus be the number of items, which holds for the filters whose apply_batch processes
+    the whole batch with the draws apply makes for a single item. Filters processing the items one
+    at a time use apply_to_items instead.
+    """
+
+    def __init__(self, streams):
+        """
+        Args:
+            streams (list): The (Philox key, counter) pairs of the streams of the items
+                (see RandomStreams.get_stream_key_and_counter).
+        """
+        self.streams = streams
+        self.states = [None] * len(streams)
+
+    def rand(self, *shape):
+        return self.draw_stacked(shape, lambda random_state, item_shape: random_state.rand(*item_shape))
+
+    def randn(self, *shape):
+        return self.draw_stacked(shape, lambda random_state, item_shape: random_state.randn(*item_shape))
+
+    def random_sample(self, size):
+        return self.draw_stacked(size, lambda random_state, item_shape: random_state.random_sample(item_shape))
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return self.draw_stacked(size, lambda random_state, item_shape, item_loc, item_scale: random_state.normal(
+            item_loc, item_scale, item_shape), loc, scale)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return self.draw_stacked(size, lambda random_state, item_shape, item_low, item_high: random_state.uniform(
+            item_low, item_high, item_shape), low, high)
+
+    def draw_stacked(self, size, draw, *params):
+        """Draws random numbers for every item and stacks them.
+
+        Args:
+            size (int or tuple): The shape of the draw, whose first dimension is the number of items.
+            draw (function): A function drawing the random numbers of one item, given its random state,
+                the shape of its random numbers and its values of params.
+            *params: Parameters of the distribution, broadcastable to size.
+
+        Returns:
+            numpy.ndarray: The random numbers.
+        """
+        size = (size,) if np.isscalar(size) else tuple(size) if size is not None else ()
+        if not size or size[0] != len(self.streams):
+            raise TypeError(f"The first dimension of the draw {size} must be the number of items in the batch "
+                            f"({len(self.streams)}).")
+        if any(np.ndim(param) for param in params):
+            item_params = zip(*(np.broadcast_to(param, size) for param in params))
+        else:
+            item_params = [params] * size[0]
+        draws = None
+        for i, item_param in enumerate(item_params):
+            random_state = self.get_item_random_state(i)
+            item_draw = draw(random_state, size[1:], *item_param)
+            self.save_item_random_state(i, random_state)
+            if draws is None:
+                draws = np.empty(size, dtype=np.asarray(item_draw).dtype)
+            draws[i] = item_draw
+        return draws
+
+    def apply_to_items(self, apply, batch_data, named_dims):
+        """Calls apply for every item of the batch with the random state of the item.
+
+        Args:
+            apply (function): The apply method of a filter.
+            batch_data (numpy.ndarray): The stacked data items.
+            named_dims (dict): Named dimensions.
+        """
+        for i, item in enumerate(batch_data):
+            random_state = self.get_item_random_state(i)
+            apply(item, random_state, named_dims)
+            self.save_item_random_state(i, random_state)
+
+    def get_item_random_state(self, i):
+        """Returns the random state of the current thread for the stream of an item, where the item left it.
+
+        The random state is shared with the other items, so it is only valid until the next call.
+        """
+        if self.states[i] is None:
+            return get_pooled_random_state(*self.streams[i])
+        random_state = get_pooled_random_state(self.streams[i][0], None)
+        random_state.set_state(self.states[i])
+        return random_state
+
+    def save_item_random_state(self, i, random_state):
+        self.states[i] = random_state.get_state(legacy=False)
+
+
+@lru_cache(maxsize=4096)
+def get_stream_key(seed, path, outer_indices):
+    """Returns the 128-bit Philox key of the streams with the given seed and path.
+
+    Args:
+        seed (int): The seed.
+        path (tuple): The path of the stream.
+        outer_indices (tuple): Indices of elements which do not fit in the counter.
+
+    Returns:
+        int: The key.
+    """
+    digest = hashlib.blake2b(repr((seed, path, outer_indices)).encode(), digest_size=16).digest()
+    return int.from_bytes(digest, "little")
+
+
+def get_pooled_random_state(key, counter):
+    """Returns the random state of the current thread for the given Philox key, reset to the given counter.
+
+    Args:
+        key (int): The 128-bit key.
+        counter (list): The four 64-bit words of the counter, least significant first, or None
+            to return the random state without resetting it.
+
+    Returns:
+        mtrand.RandomState: The random state.
+    """
+    pool = _random_states.__dict__.setdefault("pool", {})
+    if key not in pool:
+        random_state = np.random.RandomState(np.random.Philox(key=key))
+        pool[key] = random_state, random_state.get_state(legacy=False)
+    random_state, state = pool[key]
+    if counter is None:
+        return random_state
+    state["state"]["counter"][:] = counter
+    state["buffer_pos"] = 4
+    state["has_uint32"] = 0
+    state["has_gauss"] = 0
+    random_state.set_state(state)
+    return random_state
+
+
+def normalize_key(key):
+    """Returns the key as an int if it is an integer and otherwise as a string.
+    """
+    if type(key) is int:
+        return key
+    if isinstance(key, (int, np.integer)):
+        return int(key)
+    return str(key)
+
+
+def to_random_state(random_state):
+    """Returns the random state argument of generate_error and similar methods in a usable form.
+
+    Args:
+        random_state (None, int, RandomStreams or mtrand.RandomState): None for RandomStreams with the seed 42,
+            an int for RandomStreams with that seed, or an existing random state.
+
+    Returns:
+        RandomStreams or mtrand.RandomState: The random state.
+    """
+    if random_state is None:
+        return RandomStreams(42)
+    if isinstance(random_state, (int, np.integer)):
+        return RandomStreams(int(random_state))
+    return random_state
+
+
+def spawn(random_state, *keys):
+    """Returns the streams of a descendant if random_state is a RandomStreams and random_state itself otherwise.
+    """
+    if isinstance(random_state, RandomStreams):
+        return random_state.spawn(*keys)
+    return random_state
+
+
+def spawn_index(random_state, index):
+    """Returns the streams of an element if random_state is a RandomStreams and random_state itself otherwise.
+    """
+    if isinstance(random_state, RandomStreams):
+        return random_state.spawn_index(index)
+    return random_state
+
+
+def get_random_state(random_state, *keys):
+    """Returns the stream identified by keys if random_state is a RandomStreams and random_state itself otherwise.
+    """
+    if isinstance(random_state, RandomStreams):
+        return random_state.get_random_state(*keys)
+    return random_state
+
+
+def get_batch_random_state(random_state, indices, *keys):
+    """Returns the random state of a batch of elements processed at once.
+
+    Args:
+        random_state (RandomStreams or mtrand.RandomState): The random state of the node containing the elements.
+        indices (list): The indices of the elements of the batch.
+        *keys: Integers or strings identifying the stream of every element, e.g. the position of a filter.
+
+    Returns:
+        BatchRandomState or mtrand.RandomState: A BatchRandomState of the streams of the elements if random_state
+            is a RandomStreams and random_state itself otherwise.
+    """
+    if isinstance(random_state, RandomStreams):
+        return BatchRandomState([random_state.spawn_index(i).get_stream_key_and_counter(*keys) for i in indices])
+    return random_state
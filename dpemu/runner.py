@@ -25,9 +25,11 @@ from collections import Counter
 from multiprocessing.pool import Pool
 from pickle import dump, load
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from dpemu.nodes import Array, Series, TupleSeries
 from dpemu.utils import generate_unique_path
 
 
@@ -51,6 +53,9 @@ def unpickle_data(path_to_train_data, path_to_test_data):
 def errorify_data(train_data, test_data, err_root_node, err_params):
     """Applies the error to the data using the error source defined.
 
+    If the error parameters make the error generation tree an identity, the clean data is returned as is
+    and the time used is 0, as in errorify_data_with_shared_prefixes.
+
     Args:
         train_data: The train data.
         test_data: The test data.
@@ -60,6 +65,8 @@ def errorify_data(train_data, test_data, err_root_node, err_params):
     Returns:
         Erroneous data and time used in error generation.
     """
+    if err_root_node.get_parametrized_tree(err_params).is_identity():
+        return train_data, test_data, 0
     time_start = time.time()
     if train_data is not None:
         err_train_data = err_root_node.generate_error(train_data, err_params)
@@ -73,7 +80,7 @@ def errorify_data(train_data, test_data, err_root_node, err_params):
 def preproc_data(train_data, err_train_data, err_test_data, preproc, preproc_params):
     """
     Preprocesses clean train data, errorified train data and errorified test data using the given preprocessor and
-    parameters.
+    parameters. If the errorified train data is the clean train data itself, it is preprocessed only once.
 
     Args:
         train_data: The train data.
@@ -90,8 +97,12 @@ def preproc_data(train_data, err_train_data, err_test_data, preproc, preproc_par
     time_start = time.time()
     preproc_train_data, preproc_err_test_using_train, result_base_using_train = preproc().run(
         train_data, err_test_data, preproc_params)
-    preproc_err_train_data, preproc_err_test_using_err_train, result_base_using_err_train = preproc().run(
-        err_train_data, err_test_data, preproc_params)
+    if err_train_data is train_data:
+        preproc_err_train_data, preproc_err_test_using_err_train, result_base_using_err_train = (
+            preproc_train_data, preproc_err_test_using_train, result_base_using_train)
+    else:
+        preproc_err_train_data, preproc_err_test_using_err_train, result_base_using_err_train = preproc().run(
+            err_train_data, err_test_data, preproc_params)
     time_pre = time.time() - time_start
     return (
         preproc_train_data, preproc_err_test_using_train, result_base_using_train, preproc_err_train_data,
@@ -202,6 +213,94 @@ def worker(inputs):
 
     err_train_data, err_test_data, time_err = errorify_data(train_data, test_data, err_root_node, err_params)
 
+    return get_results_from_err_data(train_data, err_train_data, err_test_data, time_err, preproc, preproc_params,
+                                     err_params, model_params_dict_list, use_interactive_mode)
+
+
+def prefix_worker(inputs):
+    """
+    One of the workers in the multiprocessing pool when error parameter combinations sharing a prefix of the filter
+    chain are run together. The data is errorified with all combinations of the group at once (see
+    Node.generate_errors), after which every errorified dataset is preprocessed and run through the models.
+
+    Args:
+        inputs: Tuple containing the worker inputs.
+
+    Returns:
+        List containing the list of result dicts of every error parameter combination in the group.
+    """
+    (
+        path_to_train_data, path_to_test_data, preproc, preproc_params, err_root_node, err_params_list,
+        model_params_dict_list, use_interactive_mode
+    ) = inputs
+    train_data, test_data = unpickle_data(path_to_train_data, path_to_test_data)
+
+    return [
+        get_results_from_err_data(train_data, err_train_data, err_test_data, time_err, preproc, preproc_params,
+                                  err_params, model_params_dict_list, use_interactive_mode)
+        for err_params, (err_train_data, err_test_data, time_err) in zip(
+            err_params_list, errorify_data_with_shared_prefixes(train_data, test_data, err_root_node, err_params_list))
+    ]
+
+
+def errorify_data_with_shared_prefixes(train_data, test_data, err_root_node, err_params_list):
+    """Applies the errors of several error parameter combinations to the data, computing shared prefixes only once.
+
+    Combinations which make the error generation tree an identity get the clean data as is. The time used is
+    divided evenly between the other combinations.
+
+    Args:
+        train_data: The train data.
+        test_data: The test data.
+        err_root_node: Error root node.
+        err_params_list: List of error parameter combinations.
+
+    Returns:
+        List of tuples containing the erroneous data and time used in error generation for every combination.
+    """
+    time_start = time.time()
+    identity = [err_root_node.get_parametrized_tree(err_params).is_identity() for err_params in err_params_list]
+    errorified_params_list = [err_params for err_params, is_identity in zip(err_params_list, identity)
+                              if not is_identity]
+    err_train_data_list, err_test_data_list, time_err = [], [], 0
+    if errorified_params_list:
+        if train_data is not None:
+            err_train_data_list = err_root_node.generate_errors(train_data, errorified_params_list)
+        else:
+            err_train_data_list = [None] * len(errorified_params_list)
+        err_test_data_list = err_root_node.generate_errors(test_data, errorified_params_list)
+        time_err = (time.time() - time_start) / len(errorified_params_list)
+    err_data_iter = zip(err_train_data_list, err_test_data_list)
+
+    errorified_data = []
+    for is_identity in identity:
+        if is_identity:
+            errorified_data.append((train_data, test_data, 0))
+        else:
+            err_train_data, err_test_data = next(err_data_iter)
+            errorified_data.append((err_train_data, err_test_data, time_err))
+    return errorified_data
+
+
+def get_results_from_err_data(train_data, err_train_data, err_test_data, time_err, preproc, preproc_params,
+                              err_params, model_params_dict_list, use_interactive_mode):
+    """Preprocesses errorified data and runs it through the models.
+
+    Args:
+        train_data: The train data.
+        err_train_data: Errorified train data.
+        err_test_data: Errorified test data.
+        time_err: Time used in the error generation phase.
+        preproc: The preprocessor class.
+        preproc_params: The preprocessor parameters.
+        err_params: Error parameters.
+        model_params_dict_list: List of dicts where each dict includes the class of the model and a list of different
+            hyperparameter combinations.
+        use_interactive_mode: True if interactive mode is used.
+
+    Returns:
+        List of all result dicts from different models.
+    """
     (
         preproc_train_data, preproc_err_test_using_train, result_base_using_train, preproc_err_train_data,
         preproc_err_test_using_err_train, result_base_using_err_train, time_pre
@@ -264,11 +363,193 @@ def get_total_results_from_workers(pool_inputs, n_err_params, n_processes):
     Returns:
         List of all result dicts from different workers.
     """
-    total_results = []
+    return [result for results in get_results_by_worker(pool_inputs, n_err_params, n_processes) for result in results]
+
+
+def get_results_by_worker(pool_inputs, n_err_params, n_processes):
+    """Gathers the results from different workers to a list of lists in the order of the inputs.
+
+    Args:
+        pool_inputs: List of inputs for different workers.
+        n_err_params: Number off error parameter combinations.
+        n_processes: Max number of active subprocesses.
+
+    Returns:
+        List containing the list of result dicts of every worker.
+    """
+    with Pool(n_processes) as pool:
+        return list(tqdm(pool.imap(worker, pool_inputs), total=n_err_params))
+
+
+def get_results_by_prefix_worker(pool_inputs, n_err_params, n_processes):
+    """Gathers the results from workers which run groups of error parameter combinations.
+
+    Args:
+        pool_inputs: List of inputs for different workers.
+        n_err_params: Number off error parameter combinations.
+        n_processes: Max number of active subprocesses.
+
+    Returns:
+        List containing the list of result dicts of every error parameter combination in the order of the inputs.
+    """
+    results_by_err_params = []
     with Pool(n_processes) as pool:
-        for results in tqdm(pool.imap(worker, pool_inputs), total=n_err_params):
-            total_results.extend(results)
-    return total_results
+        with tqdm(total=n_err_params) as progress_bar:
+            for group_results in pool.imap(prefix_worker, pool_inputs):
+                results_by_err_params.extend(group_results)
+                progress_bar.update(len(group_results))
+    return results_by_err_params
+
+
+def group_indices_by_shared_prefix(err_root_node, err_params_list, indices):
+    """Groups error parameter combinations by the parameter values of the first filters of the leaf Array nodes.
+
+    The leaf Array nodes are the root node itself if it is an Array node, or the children of a Series or
+    a TupleSeries root node. Combinations in the same group share at least the first filter of every
+    chain and can be errorified together with Node.generate_errors. Combinations of other trees are
+    not grouped.
+
+    Args:
+        err_root_node: Error root node.
+        err_params_list: List of all error parameter combinations.
+        indices: The indices of the combinations to be grouped.
+
+    Returns:
+        List of lists of indices.
+    """
+    if not any(leaf.filters for leaf in get_prefix_leaves(err_root_node)):
+        return [[i] for i in indices]
+    groups = {}
+    for i in indices:
+        leaves = get_prefix_leaves(err_root_node.get_parametrized_tree(err_params_list[i]))
+        key = tuple(leaf.filters[0].get_param_key() for leaf in leaves if leaf.filters)
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+
+def get_prefix_leaves(err_root_node):
+    """Returns the Array nodes whose filter chains Node.generate_errors arranges into prefix trees.
+
+    Args:
+        err_root_node: Error root node.
+
+    Returns:
+        List of Array nodes, empty if the tree does not share prefixes.
+    """
+    if isinstance(err_root_node, Array):
+        return [err_root_node]
+    if isinstance(err_root_node, (Series, TupleSeries)) and all(
+            isinstance(child, Array) for child in err_root_node.children):
+        return err_root_node.children
+    return []
+
+
+def get_identity_err_params_indices(err_root_node, err_params_list):
+    """Returns the indices of the error parameter combinations which leave the data unchanged.
+
+    Args:
+        err_root_node: Error root node.
+        err_params_list: List of all error parameter combinations.
+
+    Returns:
+        List of indices.
+    """
+    return [
+        i for i, err_params in enumerate(err_params_list)
+        if err_root_node.get_parametrized_tree(err_params).is_identity()
+    ]
+
+
+def copy_results_for_err_params(results, original_err_params, err_params):
+    """Copies result dicts of one error parameter combination for another combination.
+
+    Args:
+        results: List of result dicts.
+        original_err_params: The error parameters the results were computed with.
+        err_params: The error parameters of the copies.
+
+    Returns:
+        List of result dicts.
+    """
+    copied_results = []
+    for result in results:
+        copied_result = {k: v for k, v in result.items() if k not in original_err_params}
+        copied_result.update({k: v for k, v in err_params.items()})
+        copied_results.append(copied_result)
+    return copied_results
+
+
+def get_data_sample(data, err_root_node, n_elements=2):
+    """Returns the first elements of the data for a dry run of the error generation tree.
+
+    Args:
+        data: The data.
+        err_root_node: Error root node. If it is a TupleSeries node, the data is a tuple.
+        n_elements: The number of elements in the sample.
+
+    Returns:
+        The sample, or None if the data cannot be sliced for the root node, i.e. the root node is
+            neither a Series, a TupleSeries nor an Array node without reshape, or the data is a scalar.
+    """
+    if isinstance(err_root_node, TupleSeries):
+        return tuple(element_data[:n_elements] for element_data in data)
+    if isinstance(err_root_node, Series):
+        return data[:n_elements]
+    if isinstance(err_root_node, Array) and not err_root_node.reshape:
+        if isinstance(data, (list, tuple)) or getattr(data, "ndim", 0) >= 1:
+            return data[:n_elements]
+    return None
+
+
+def get_preflight_errors(data, err_root_node, err_params_list):
+    """Checks that every error parameter combination can be used with the error generation tree.
+
+    Every combination is bound to the tree and the bound values are checked against the param_types
+    declarations of the filters. The tree is also run on a sample of the first elements (along the first
+    dimension) of the data with every combination, if the root node is a Series or a TupleSeries node or
+    an Array node without reshape. The reshape of an Array root node is checked against the size of the data.
+
+    Args:
+        data: The test data.
+        err_root_node: Error root node.
+        err_params_list: List of all error parameter combinations.
+
+    Returns:
+        A list of error messages.
+    """
+    errors = []
+    if isinstance(err_root_node, Array) and err_root_node.reshape and hasattr(data, "size"):
+        if np.prod(err_root_node.reshape) != data.size:
+            errors.append(f"Cannot reshape data of size {data.size} into shape {tuple(err_root_node.reshape)}")
+    sample = get_data_sample(data, err_root_node)
+    for i, err_params in enumerate(err_params_list):
+        try:
+            tree = err_root_node.get_parametrized_tree(err_params)
+        except Exception as e:
+            errors.append(f"err_params_list[{i}]: {e}")
+            continue
+        type_errors = tree.get_param_type_errors()
+        errors.extend(f"err_params_list[{i}]: {error}" for error in type_errors)
+        if sample is None or type_errors:
+            continue
+        try:
+            err_root_node.generate_error(sample, err_params)
+        except Exception as e:
+            errors.append(f"err_params_list[{i}]: dry run failed with {type(e).__name__}: {e}")
+    return errors
+
+
+def run_preflight(data, err_root_node, err_params_list):
+    """Raises an exception listing all problems found by get_preflight_errors.
+
+    Args:
+        data: The test data.
+        err_root_node: Error root node.
+        err_params_list: List of all error parameter combinations.
+    """
+    errors = get_preflight_errors(data, err_root_node, err_params_list)
+    if errors:
+        raise Exception("Preflight validation failed:\n" + "\n".join(errors))
 
 
 def get_df_columns_base(err_params_list, model_params_dict_list):
@@ -310,11 +591,23 @@ def order_df_columns(df, err_params_list, model_params_dict_list):
 
 
 def run(train_data, test_data, preproc, preproc_params, err_root_node, err_params_list, model_params_dict_list,
-        n_processes=None, use_interactive_mode=False):
+        n_processes=None, use_interactive_mode=False, share_error_prefixes=False, preflight=True):
     """
     The runner system is called with the run function. It creates a Pandas Dataframe from all of the results it gets
     from different workers.
 
+    Error parameter combinations which leave the data unchanged (see Node.is_identity) are run only once
+    using the clean data, and the results are copied for the other such combinations.
+
+    If share_error_prefixes is True, error parameter combinations whose first filters have equal parameter values
+    are run in the same worker, and the shared part of their filter chains is computed only once (see
+    Node.generate_errors). Only trees whose root is an Array node, or a Series or a TupleSeries node with Array
+    children, share prefixes. This trades parallelism for less error generation, so it pays off when error
+    generation is expensive compared to the models.
+
+    If preflight is True, the error parameter combinations are validated before any worker is started (see
+    get_preflight_errors), and all problems found are reported at once.
+
     Args:
         train_data: The train data.
         test_data: The test data.
@@ -326,22 +619,51 @@ def run(train_data, test_data, preproc, preproc_params, err_root_node, err_param
             hyperparameter combinations.
         n_processes: Max number of active subprocesses.
         use_interactive_mode: True if interactive mode is used. The resulting Dataframe contains the errorified data.
+        share_error_prefixes: True if shared prefixes of the filter chains are computed only once.
+        preflight: True if the error parameter combinations are validated before running the workers.
 
     Returns:
         A Dataframe containing the results.
     """
+    if preflight:
+        run_preflight(test_data, err_root_node, err_params_list)
+
+    identity_indices = get_identity_err_params_indices(err_root_node, err_params_list)
+    duplicate_indices = set(identity_indices[1:])
+    computed_indices = [i for i in range(len(err_params_list)) if i not in duplicate_indices]
+
     path_to_train_data, path_to_test_data = pickle_data(train_data, test_data)
-    pool_inputs = [(
-        path_to_train_data,
-        path_to_test_data,
-        preproc,
-        preproc_params,
-        err_root_node,
-        err_params,
-        model_params_dict_list,
-        use_interactive_mode
-    ) for err_params in err_params_list]
-
-    total_results = get_total_results_from_workers(pool_inputs, len(err_params_list), n_processes)
+    if share_error_prefixes:
+        groups = group_indices_by_shared_prefix(err_root_node, err_params_list, computed_indices)
+        pool_inputs = [(
+            path_to_train_data,
+            path_to_test_data,
+            preproc,
+            preproc_params,
+            err_root_node,
+            [err_params_list[i] for i in group],
+            model_params_dict_list,
+            use_interactive_mode
+        ) for group in groups]
+        results_by_index = dict(zip([i for group in groups for i in group],
+                                    get_results_by_prefix_worker(pool_inputs, len(computed_indices), n_processes)))
+    else:
+        pool_inputs = [(
+            path_to_train_data,
+            path_to_test_data,
+            preproc,
+            preproc_params,
+            err_root_node,
+            err_params_list[i],
+            model_params_dict_list,
+            use_interactive_mode
+        ) for i in computed_indices]
+        results_by_index = dict(zip(computed_indices,
+                                    get_results_by_worker(pool_inputs, len(computed_indices), n_processes)))
+    for i in duplicate_indices:
+        results_by_index[i] = copy_results_for_err_params(results_by_index[identity_indices[0]],
+                                                          err_params_list[identity_indices[0]], err_params_list[i])
+
+    total_results = [result for i in range(len(err_params_list)) for result in results_by_index[i]]
     df = pd.DataFrame(total_results)
     return order_df_columns(df, err_params_list, model_params_dict_list)
@@ -0,0 +1,242 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import json
+from importlib import import_module
+
+import numpy as np
+
+from dpemu.filters import Filter
+from dpemu.nodes import Node
+
+
+def tree_to_dict(root_node):
+    """Returns a canonical dict describing an error generation tree.
+
+    The dict contains the class of every node and filter, the error parameter identifiers
+    (attributes ending with _id), the nested filters, the children of the nodes and other
+    plain attributes such as reshape and dim_name. Values bound to the parameter slots of
+    the filters are not included, so the dict is the same before and after calling
+    set_error_params.
+
+    Args:
+        root_node (Node): The root node of the error generation tree.
+
+    Returns:
+        dict: A dict consisting only of JSON-serializable values.
+    """
+    return {
+        "class": get_class_path(root_node),
+        "attributes": encode_attributes(root_node, {"filters", "children"}),
+        "filters": [filter_to_dict(filter_) for filter_ in root_node.filters],
+        "children": [tree_to_dict(child) for child in root_node.children],
+    }
+
+
+def filter_to_dict(filter_):
+    """Returns a canonical dict describing a filter and its nested filters.
+
+    Args:
+        filter_ (Filter): The filter.
+
+    Returns:
+        dict: A dict consisting only of JSON-serializable values.
+    """
+    bound_slots = {slot for slot, _ in filter_.get_param_slots()}
+    return {
+        "class": get_class_path(filter_),
+        "attributes": encode_attributes(filter_, bound_slots),
+    }
+
+
+def tree_from_dict(tree_dict):
+    """Builds an error generation tree from a dict returned by tree_to_dict.
+
+    The constructors of the nodes and filters are not called.
+
+    Args:
+        tree_dict (dict): A dict describing the tree.
+
+    Returns:
+        Node: The root node of the error generation tree.
+    """
+    node = new_instance(tree_dict["class"], Node)
+    node.__dict__.update(decode_value(tree_dict["attributes"]))
+    node.filters = [filter_from_dict(filter_dict) for filter_dict in tree_dict["filters"]]
+    node.children = [tree_from_dict(child_dict) for child_dict in tree_dict["children"]]
+    return node
+
+
+def filter_from_dict(filter_dict):
+    """Builds a filter from a dict returned by filter_to_dict.
+
+    The constructors of the filters are not called.
+
+    Args:
+        filter_dict (dict): A dict describing the filter.
+
+    Returns:
+        Filter: The filter.
+    """
+    filter_ = new_instance(filter_dict["class"], Filter)
+    filter_.__dict__.update(decode_value(filter_dict["attributes"]))
+    return filter_
+
+
+def tree_to_json(root_node):
+    """Returns the canonical JSON representation of an error generation tree.
+
+    Args:
+        root_node (Node): The root node of the error generation tree.
+
+    Returns:
+        str: The tree as a JSON string with sorted keys.
+    """
+    return json.dumps(tree_to_dict(root_node), sort_keys=True, separators=(",", ":"))
+
+
+def tree_from_json(tree_json):
+    """Builds an error generation tree from a JSON string returned by tree_to_json.
+
+    Args:
+        tree_json (str): The tree as a JSON string.
+
+    Returns:
+        Node: The root node of the error generation tree.
+    """
+    return tree_from_dict(json.loads(tree_json))
+
+
+def tree_hash(root_node):
+    """Returns a stable content hash of an error generation tree.
+
+    Equivalent trees have the same hash in every process and Python session,
+    so the hash can be used e.g. as a cache key.
+
+    Args:
+        root_node (Node): The root node of the error generation tree.
+
+    Returns:
+        str: The SHA-256 hash of the canonical JSON representation as a hexadecimal string.
+    """
+    return hashlib.sha256(tree_to_json(root_node).encode("utf-8")).hexdigest()
+
+
+def get_class_path(obj):
+    """Returns the full import path of the class of an object.
+
+    Args:
+        obj (object): An object.
+
+    Returns:
+        str: The module and the name of the class separated by a dot.
+    """
+    return f"{type(obj).__module__}.{type(obj).__qualname__}"
+
+
+def new_instance(class_path, base_class):
+    """Creates an instance of a class without calling its constructor.
+
+    Args:
+        class_path (str): The full import path of the class.
+        base_class (type): The class must be a subclass of this class.
+
+    Returns:
+        object: The new instance.
+    """
+    module_name, class_name = class_path.rsplit(".", 1)
+    cls = getattr(import_module(module_name), class_name)
+    if not isinstance(cls, type) or not issubclass(cls, base_class):
+        raise TypeError(f"{class_path} is not a subclass of {base_class.__name__}.")
+    return cls.__new__(cls)
+
+
+def encode_attributes(obj, excluded):
+    """Encodes the public attributes of a node or a filter.
+
+    Args:
+        obj (object): A node or a filter.
+        excluded (set): Names of attributes which are left out.
+
+    Returns:
+        dict: The encoded attributes.
+    """
+    attributes = {}
+    for name, value in obj.__dict__.items():
+        if name[0] == "_" or name in excluded:
+            continue
+        try:
+            attributes[name] = encode_value(value)
+        except TypeError as e:
+            raise TypeError(f"Cannot serialize the attribute '{name}' of {obj}.") from e
+    return {"dict": attributes}
+
+
+def encode_value(value):
+    """Encodes a value so that it only consists of JSON-serializable values.
+
+    Tuples, dicts and filters are wrapped in a dict with a single key
+    telling the type of the value, so that they can be decoded unambiguously.
+
+    Args:
+        value (object): The value.
+
+    Returns:
+        object: The encoded value.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if isinstance(value, tuple):
+        return {"tuple": [encode_value(v) for v in value]}
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {"dict": {k: encode_value(v) for k, v in value.items()}}
+    if isinstance(value, Filter):
+        return {"filter": filter_to_dict(value)}
+    raise TypeError(f"Values of type {type(value).__name__} cannot be serialized.")
+
+
+def decode_value(value):
+    """Decodes a value encoded with encode_value.
+
+    Args:
+        value (object): The encoded value.
+
+    Returns:
+        object: The decoded value.
+    """
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if isinstance(value, dict):
+        (kind, content), = value.items()
+        if kind == "tuple":
+            return tuple(decode_value(v) for v in content)
+        if kind == "dict":
+            return {k: decode_value(v) for k, v in content.items()}
+        if kind == "filter":
+            return filter_from_dict(content)
+        raise ValueError(f"Unknown encoded value of kind '{kind}'.")
+    return value
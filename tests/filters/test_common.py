@@ -21,6 +21,8 @@
 # SOFTWARE.
 
 import numpy as np
+import pytest
+from scipy import sparse
 from dpemu.nodes import Array, Series
 from dpemu.filters import Identity
 from dpemu.filters.common import Missing, GaussianNoise, StrangeBehaviour, GaussianNoiseTimeDependent, Clip
@@ -94,6 +96,33 @@ def test_seed_determines_result_for_time_dependent_gaussian_noise():
     assert np.allclose(out1, out2)
 
 
+def test_time_dependent_gaussian_noise_over_time_axis_matches_series():
+    a = np.zeros((50, 4, 3))
+    params = {"mean": 2., "std": 3., "mean_inc": 1., "std_inc": 4.}
+    series_node = Series(Array(), dim_name="time")
+    series_node.children[0].addfilter(GaussianNoiseTimeDependent("mean", "std", "mean_inc", "std_inc"))
+    x_node = Array()
+    x_node.addfilter(GaussianNoiseTimeDependent("mean", "std", "mean_inc", "std_inc"))
+    out = x_node.generate_error(a, params, np.random.RandomState(seed=42))
+    assert np.array_equal(out, series_node.generate_error(a, params, np.random.RandomState(seed=42)))
+    y_node = Array()
+    y_node.addfilter(GaussianNoiseTimeDependent("mean", "std", "mean_inc", "std_inc", time_axis=1))
+    out = y_node.generate_error(np.zeros((2000, 3)), params)
+    assert np.allclose(out.mean(axis=0), [2, 3, 4], atol=.5)
+
+
+def test_named_dims_do_not_leak_between_runs():
+    params = {"mean": 0., "std": 0., "mean_inc": 1., "std_inc": 0.}
+    time_node = Series(Array(), dim_name="time")
+    time_node.children[0].addfilter(GaussianNoiseTimeDependent("mean", "std", "mean_inc", "std_inc"))
+    out = time_node.generate_error(np.zeros((10, 4)), params)
+    assert np.array_equal(out, np.repeat(np.arange(10.)[:, np.newaxis], 4, axis=1))
+    series_node = Series(Array())
+    series_node.children[0].addfilter(GaussianNoiseTimeDependent("mean", "std", "mean_inc", "std_inc"))
+    out = series_node.generate_error(np.zeros((3, 4)), params)
+    assert np.array_equal(out, np.tile(np.arange(4.), (3, 1)))
+
+
 def test_strange_behaviour():
     def strange(x, _):
         if 15 <= x <= 20:
@@ -111,6 +140,22 @@ def test_strange_behaviour():
         assert y[i] == -300
 
 
+def test_vectorized_strange_behaviour_matches_scalar_version():
+    def strange(x, _):
+        return -300 if 15 <= x <= 20 else x
+
+    def vectorized_strange(data, _):
+        return np.where((15 <= data) & (data <= 20), -300, data)
+
+    y = np.arange(0, 30)
+    outputs = []
+    for ftr, f in [(StrangeBehaviour("f"), strange), (StrangeBehaviour("f", vectorized=True), vectorized_strange)]:
+        x_node = Series(Array())
+        x_node.children[0].addfilter(ftr)
+        outputs.append(x_node.generate_error(y.reshape((3, 10)), {"f": f}))
+    assert np.array_equal(outputs[0], outputs[1])
+
+
 def test_clip():
     a = np.arange(5)
     params = {}
@@ -130,3 +175,48 @@ def test_modify_as_datatype():
     x_node.addfilter(ModifyAsDataType('dtype', Identity()))
     out = x_node.generate_error(a, params)
     assert np.array_equal(out, np.array([42]))
+
+
+def test_elementwise_filters_work_with_sparse_matrices():
+    matrix = sparse.random(100, 1000, density=.01, format="csr", random_state=0)
+    x_node = Array()
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    x_node.addfilter(Clip("min", "max"))
+    x_node.addfilter(Missing("prob", "m_val"))
+    out = x_node.generate_error(matrix, {"mean": 1., "std": .1, "min": 0., "max": 1.5, "prob": .5, "m_val": np.nan})
+    assert sparse.isspmatrix_csr(out) and out.nnz == matrix.nnz
+    assert np.array_equal(out.indices, matrix.indices)
+    assert 0 < np.isnan(out.data).sum() < out.nnz
+    assert np.nanmin(out.data) >= 0. and np.nanmax(out.data) <= 1.5 and np.nanmean(out.data) > .9
+
+
+def test_missing_zeros_are_removed_from_sparse_matrices():
+    matrix = sparse.random(10, 10, density=.5, format="csc", random_state=0)
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    out = x_node.generate_error(matrix, {"prob": 1., "m_val": 0})
+    assert out.nnz == 0 and matrix.nnz == 50
+
+
+def test_series_applies_errors_to_sparse_rows():
+    matrix = sparse.random(20, 30, density=.3, format="csr", random_state=0)
+    series_node = Series(Array())
+    series_node.children[0].addfilter(GaussianNoise("mean", "std"))
+    out = series_node.generate_error(matrix, {"mean": 1., "std": .1})
+    assert sparse.isspmatrix_csr(out) and np.array_equal(out.indices, matrix.indices)
+    assert np.all(np.abs(out.data - matrix.data - 1.) < .5)
+    series_node.children[0].addfilter(Missing("prob", "m_val"))
+    out = series_node.generate_error(matrix.tocsc(), {"mean": 0., "std": 0., "prob": 1., "m_val": 0})
+    assert out.count_nonzero() == 0
+
+
+def test_unsupported_sparse_input_raises_type_error():
+    matrix = sparse.random(10, 10, density=.5, format="coo", random_state=0)
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    with pytest.raises(TypeError):
+        x_node.generate_error(matrix, {"prob": 1., "m_val": 0})
+    x_node = Array()
+    x_node.addfilter(StrangeBehaviour("f"))
+    with pytest.raises(TypeError):
+        x_node.generate_error(matrix.tocsr(), {"f": lambda x, _: x})
@@ -21,9 +21,11 @@
 # SOFTWARE.
 
 import numpy as np
-from dpemu.nodes import Array
+from dpemu.nodes import Array, Series
 from dpemu.filters import Constant, Addition, Subtraction, Multiplication, Division, IntegerDivision, Identity
-from dpemu.filters import Min, Max, Difference, Modulo, And, Or, Xor
+from dpemu.filters import Min, Max, Difference, Modulo, And, Or, Xor, BinaryFilter
+from dpemu.filters.filter import max_cached_scratch_buffer_bytes
+from dpemu.filters.common import GaussianNoise
 
 
 def test_constant():
@@ -163,3 +165,73 @@ def test_max():
     x_node.addfilter(Max(Identity(), Constant('c')))
     out = x_node.generate_error(a, params, np.random.RandomState(seed=42))
     assert np.array_equal(out, np.full((5, 5), 5))
+
+
+def test_binary_filters_match_elementwise_operation():
+    data = np.random.RandomState(0).randint(1, 100, size=(6, 7))
+    params = {"mean": 0, "std": 10, "c": 7}
+    for filter_class in [Addition, Subtraction, Multiplication, Division, IntegerDivision, Modulo, And, Or, Xor,
+                         Min, Max]:
+        x_node = Array()
+        x_node.addfilter(filter_class(GaussianNoise("mean", "std"), Constant("c")))
+        out = x_node.generate_error(data, params, np.random.RandomState(seed=1))
+        noise_node = Array()
+        noise_node.addfilter(GaussianNoise("mean", "std"))
+        data_a = noise_node.generate_error(data, params, np.random.RandomState(seed=1))
+        expected = np.array([filter_class.operation(None, a, 7) for a in data_a.flat]).astype(data.dtype)
+        assert out.dtype == data.dtype
+        assert np.array_equal(out, expected.reshape(data.shape))
+
+
+def test_binary_filter_without_ufunc_uses_operation():
+    class Hypot(BinaryFilter):
+        def operation(self, element_a, element_b):
+            return (element_a ** 2 + element_b ** 2) ** .5
+
+    x_node = Array()
+    x_node.addfilter(Hypot(Constant("a"), Constant("b")))
+    out = x_node.generate_error(np.zeros((3, 3)), {"a": 3., "b": 4.})
+    assert np.array_equal(out, np.full((3, 3), 5.))
+
+
+def test_overridden_operation_is_not_replaced_by_inherited_ufunc():
+    class SquaredAddition(Addition):
+        def operation(self, element_a, element_b):
+            return (element_a + element_b) ** 2
+
+    class FastAddition(Addition):
+        pass
+
+    x_node = Array()
+    x_node.addfilter(SquaredAddition(Constant("a"), Constant("b")))
+    out = x_node.generate_error(np.zeros((3, 3)), {"a": 1., "b": 2.})
+    assert np.array_equal(out, np.full((3, 3), 9.))
+    assert FastAddition.get_ufunc() is np.add and SquaredAddition.get_ufunc() is None
+
+
+def test_difference_matches_subtraction_from_identity():
+    data = np.random.RandomState(0).randint(0, 100, size=(8, 8))
+    params = {"mean": 2, "std": 5}
+    outputs = []
+    for ftr in [Difference(GaussianNoise("mean", "std")), Subtraction(GaussianNoise("mean", "std"), Identity())]:
+        x_node = Series(Array())
+        x_node.children[0].addfilter(ftr)
+        outputs.append(x_node.generate_error(data, params, np.random.RandomState(seed=3)))
+    assert np.array_equal(outputs[0], outputs[1])
+
+
+def test_scratch_buffers_are_reused():
+    ftr = Identity()
+    buffer = ftr.get_scratch_buffer("a", (3, 4), np.float64)
+    assert ftr.get_scratch_buffer("a", (3, 4), np.float64) is buffer
+    assert ftr.get_scratch_buffer("a", (3, 4), np.int64) is not buffer
+    assert Identity().get_scratch_buffer("a", (3, 4), np.int64) is not ftr.get_scratch_buffer("a", (3, 4), np.int64)
+
+
+def test_large_scratch_buffers_are_not_kept():
+    ftr = Identity()
+    ftr.get_scratch_buffer("a", (3, 4), np.float64)
+    shape = (max_cached_scratch_buffer_bytes // 8 + 1,)
+    buffer = ftr.get_scratch_buffer("a", shape, np.float64)
+    assert ftr.get_scratch_buffer("a", shape, np.float64) is not buffer
+    assert ftr.get_scratch_buffer("a", (3, 4), np.float64) is ftr.get_scratch_buffer("a", (3, 4), np.float64)
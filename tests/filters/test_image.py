@@ -24,7 +24,7 @@ import numpy as np
 from dpemu.nodes import Array
 from dpemu import radius_generators
 from dpemu.filters.image import Rain, Snow, StainArea, Blur, JPEG_Compression, BlurGaussian, Resolution, Rotation
-from dpemu.filters.image import Brightness, Saturation
+from dpemu.filters.image import Brightness, Saturation, Tiled, LensFlare, sample_positions
 
 
 def test_seed_determines_result_for_fastrain_filter():
@@ -47,6 +47,17 @@ def test_seed_determines_result_for_fastrain_filter_two():
     assert np.array_equal(out1, out2)
 
 
+def test_rain_changes_only_pixels_near_raindrops():
+    a = np.full((200, 50, 3), 100)
+    x_node = Array()
+    x_node.addfilter(Rain("probability", "range"))
+    out = x_node.generate_error(a, {"probability": 0.001, "range": 255}, np.random.RandomState(seed=42))
+    changed = np.any(out != a, axis=-1)
+    assert changed.any()
+    assert not changed.all()
+    assert out[..., 2][changed].mean() > out[..., 0][changed].mean()
+
+
 def test_seed_determines_result_for_snow_filter():
     a = np.zeros((10, 10, 3), dtype=int)
     x_node = Array()
@@ -57,6 +68,27 @@ def test_seed_determines_result_for_snow_filter():
     assert np.array_equal(out1, out2)
 
 
+def test_snow_only_brightens_image():
+    a = np.random.RandomState(seed=42).randint(0, 200, size=(40, 50, 3))
+    x_node = Array()
+    x_node.addfilter(Snow("snowflake_probability", "snowflake_alpha", "snowstorm_alpha"))
+    params = {"snowflake_probability": 0.01, "snowflake_alpha": 1, "snowstorm_alpha": 0.5}
+    out = x_node.generate_error(a, params, np.random.RandomState(seed=42))
+    assert np.all(out >= a)
+    assert np.all(out <= 255)
+    assert np.any(out == 255)
+
+
+def test_sample_positions_hits_every_position_with_given_probability():
+    random_state = np.random.RandomState(seed=42)
+    positions = sample_positions(0.2, 100000, random_state)
+    assert np.all(np.diff(positions) > 0)
+    assert positions[0] >= 0 and positions[-1] < 100000
+    assert abs(len(positions) - 20000) < 500
+    assert len(sample_positions(0, 100, random_state)) == 0
+    assert np.array_equal(sample_positions(1, 100, random_state), np.arange(100))
+
+
 def test_seed_determines_result_for_stain_filter():
     def f(data, random_state):
         return data * random_state.randint(2, 4)
@@ -72,6 +104,19 @@ def test_seed_determines_result_for_stain_filter():
     assert np.array_equal(out1, out2)
 
 
+def test_seed_determines_result_for_lens_flare_filter():
+    a = np.full((90, 130, 3), 20, dtype=np.uint8)
+    a[5:25, 5:25] = 250
+    x_node = Array()
+    x_node.addfilter(LensFlare())
+    out1 = x_node.generate_error(a, {}, np.random.RandomState(seed=2))
+    out2 = x_node.generate_error(a, {}, np.random.RandomState(seed=2))
+    assert np.array_equal(out1, out2)
+    changed = np.any(out1 != a, axis=-1)
+    assert changed.any()
+    assert np.all(out1[20:, 30:, 0] >= a[20:, 30:, 0])
+
+
 def test_blur_iterates_correctly():
     rs = np.random.RandomState(seed=42)
     dat1 = rs.randint(low=0, high=255, size=(10, 10, 3))
@@ -186,3 +231,41 @@ def test_saturation_saturates_image():
     diff -= np.minimum(np.minimum(data[:, :, 0], data[:, :, 1]), data[:, :, 2])
 
     assert np.sum(diff.astype(int) - original_diff.astype(int)) > 0 and np.min(diff - original_diff) >= 0
+
+
+def test_brightness_and_saturation_batches_match_single_images():
+    rs = np.random.RandomState(seed=42)
+    batch = rs.randint(low=0, high=255, size=(3, 20, 10, 3)).astype(np.uint8)
+    for ftr in [Brightness("tar", "rat", "range"), Saturation("tar", "rat", "range")]:
+        ftr.set_params({"tar": .7, "rat": 0.5, "range": 255})
+        expected = batch.copy()
+        for image in expected:
+            ftr.apply(image, rs, named_dims={})
+        batch_data = batch.copy()
+        ftr.apply_batch(batch_data, rs, named_dims={})
+        assert np.array_equal(batch_data, expected)
+
+
+def test_tiled_filter_has_no_seams():
+    rs = np.random.RandomState(seed=42)
+    data = rs.randint(low=0, high=255, size=(53, 71, 3)).astype(float)
+    for ftr, halo in [(Blur("repeats"), 2), (BlurGaussian("std"), 8)]:
+        params = {"repeats": 2, "std": 2}
+        ftr.set_params(params)
+        expected = data.copy()
+        ftr.apply(expected, rs, named_dims={})
+        for tile_size, n_workers in [(16, 1), (5, 3)]:
+            tiled = Tiled(ftr, tile_size, halo, n_workers)
+            tiled_data = data.copy()
+            tiled.apply(tiled_data, rs, named_dims={})
+            assert np.allclose(tiled_data, expected)
+
+
+def test_seed_determines_result_for_tiled_filter():
+    a = np.zeros((30, 30, 3), dtype=int)
+    x_node = Array()
+    x_node.addfilter(Tiled(Rain("probability", "range"), 8, n_workers=4))
+    params = {"probability": 0.03, "range": 255}
+    out1 = x_node.generate_error(a, params, np.random.RandomState(seed=42))
+    out2 = x_node.generate_error(a, params, np.random.RandomState(seed=42))
+    assert np.array_equal(out1, out2) and out1.any()
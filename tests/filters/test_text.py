@@ -22,7 +22,7 @@
 
 import numpy as np
 from dpemu.nodes import Array
-from dpemu import radius_generators
+from dpemu import pg_utils, radius_generators
 from dpemu.filters.text import Uppercase, OCRError, MissingArea
 
 
@@ -68,3 +68,59 @@ def test_seed_determines_result_for_missing_area_filter_with_probability_array_r
     out1 = x_node.generate_error(a, params, np.random.RandomState(seed=42))
     out2 = x_node.generate_error(a, params, np.random.RandomState(seed=42))
     assert np.array_equal(out1, out2)
+
+
+def test_text_filters_work_with_lists_of_strings():
+    data = ["hello world", "lorem ipsum\ndolor sit amet", ""]
+    x_node = Array()
+    x_node.addfilter(Uppercase("prob"))
+    out = x_node.generate_error(data, {"prob": 1.})
+    assert out == ["HELLO WORLD", "LOREM IPSUM\nDOLOR SIT AMET", ""]
+    assert data[0] == "hello world"
+
+
+def test_ocr_error_samples_replacements_from_distribution():
+    data = ["e" * 20000 + "xg"]
+    x_node = Array()
+    x_node.addfilter(OCRError("probs", "p"))
+    params = {"probs": {"e": (["E", "", "rn"], [.5, .2, .3]), "g": (["q"], [1])}, "p": .5}
+    out = x_node.generate_error(data, params)[0]
+    assert out.endswith("x") or out.endswith("xq")
+    body = out[:out.rindex("x")]
+    assert abs(body.count("e") / 20000 - .5) < .02
+    assert abs(body.count("E") / 20000 - .25) < .02
+    assert abs(body.count("rn") / 20000 - .15) < .02
+
+
+def test_uppercase_handles_characters_with_longer_uppercase_forms():
+    x_node = Array()
+    x_node.addfilter(Uppercase("prob"))
+    assert x_node.generate_error(["straße ǆ"], {"prob": 1.}) == ["STRASSE Ǆ"]
+
+
+def test_missing_area_uses_missing_value():
+    x_node = Array()
+    x_node.addfilter(MissingArea("probability", "radius_generator", "missing_value"))
+    params = {"probability": .2, "radius_generator": radius_generators.GaussianRadiusGenerator(1, 1),
+              "missing_value": "#"}
+    out = x_node.generate_error(["hello world\n" * 5], params)[0]
+    assert "#" in out and out.count("\n") == 5 and len(out) == len("hello world\n" * 5)
+
+
+def test_missing_area_covers_the_rows_of_every_document():
+    x_node = Array()
+    x_node.addfilter(MissingArea("probability", "radius_generator", "missing_value"))
+    params = {"probability": 1., "radius_generator": radius_generators.ProbabilityArrayRadiusGenerator([1.]),
+              "missing_value": "#"}
+    out = x_node.generate_error(["ab\ncd\n", "", "\n\nxyz\n", "a\nbc\n"], params)
+    assert out == ["##\n##\n", "", "\n\n###\n", "#\n##\n"]
+
+
+def test_ocr_error_accepts_compiled_model():
+    params = {"a": [["o"], [1]]}
+    data = np.array(["banana"])
+    root = Array()
+    root.addfilter(OCRError("params", "p"))
+    from_dict = root.generate_error(data, {"params": params, "p": 1})
+    from_model = root.generate_error(data, {"params": pg_utils.OCRErrorModel(params), "p": 1})
+    assert from_dict[0] == from_model[0] == "bonono"
@@ -69,3 +69,37 @@ def test_two_gap():
 
     for _, val in enumerate(y):
         assert np.isnan(val)
+
+
+def test_gap_carries_state_between_calls():
+    gap = Gap("prob_break", "prob_recover", "missing")
+    gap.set_params({"prob_break": .5, "prob_recover": 0., "missing": np.nan})
+    gap.apply(np.zeros(100), np.random.RandomState(0), named_dims={})
+    assert not gap.working
+    y = np.zeros(100)
+    gap.apply(y, np.random.RandomState(0), named_dims={})
+    assert np.isnan(y).all()
+
+
+def test_gap_matches_stationary_distribution_of_markov_chain():
+    gap = Gap("prob_break", "prob_recover", "missing")
+    gap.set_params({"prob_break": .1, "prob_recover": .3, "missing": np.nan})
+    y = np.zeros(200000)
+    gap.apply(y, np.random.RandomState(0), named_dims={})
+    broken = np.isnan(y)
+    assert abs(broken.mean() - .25) < .01
+    run_starts = np.flatnonzero(np.diff(broken.astype(int)) == 1) + 1
+    run_ends = np.flatnonzero(np.diff(broken.astype(int)) == -1) + 1
+    run_lengths = run_ends[run_ends > run_starts[0]][:len(run_starts) - 1] - run_starts[:-1]
+    assert abs(run_lengths.mean() - 1 / .3) < .1
+
+
+def test_gap_processes_independent_channels():
+    gap = Gap("prob_break", "prob_recover", "missing", channel_axis=1)
+    gap.set_params({"prob_break": .05, "prob_recover": 0., "missing": -1})
+    y = np.zeros((100, 20))
+    gap.apply(y, np.random.RandomState(0), named_dims={})
+    assert gap.working.shape == (20,) and not gap.working.any()
+    first_gaps = np.argmax(y == -1, axis=0)
+    assert len(set(first_gaps)) > 1
+    assert all((y[first_gap:, i] == -1).all() for i, first_gap in enumerate(first_gaps))
@@ -21,10 +21,14 @@
 # SOFTWARE.
 
 import numpy as np
+import pandas as pd
 
-from dpemu.nodes import Array, Series, TupleSeries, Tuple
-from dpemu.filters.common import Missing
-from dpemu.filters.time_series import SensorDrift
+from dpemu.nodes import Array, Series, Table, TupleSeries, Tuple
+from dpemu.filters import Addition, Constant, Filter, Identity, Multiplication
+from dpemu.filters.common import Clip, GaussianNoise, Missing
+from dpemu.filters.image import Blur, BlurGaussian, Rain, Resolution, StainArea
+from dpemu.filters.time_series import Gap, SensorDrift
+from dpemu.radius_generators import GaussianRadiusGenerator
 
 
 def test_array_works_with_regular_arrays():
@@ -84,3 +88,281 @@ def test_exception_raised_when_param_missing():
         x_node.generate_error(data, {"probb": .5, "m_val": np.nan})
     except Exception as e:
         assert "prob" in str(e)
+
+
+def test_generate_error_in_chunks_matches_generate_error():
+    data = np.random.RandomState(0).rand(100, 5)
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    params = {"prob": .3, "m_val": np.nan}
+    chunks = [data[i:i + 7] for i in range(0, 100, 7)]
+    out_chunks = x_node.generate_error_in_chunks(chunks, params, np.random.RandomState(seed=42))
+    out = x_node.generate_error(data, params, np.random.RandomState(seed=42))
+    assert np.allclose(np.concatenate(list(out_chunks)), out, equal_nan=True)
+    assert not np.isnan(data).any()
+
+
+def test_array_root_continues_its_streams_across_chunks(tmp_path):
+    data = np.random.RandomState(0).rand(100, 5)
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    params = {"prob": .3, "m_val": np.nan, "mean": 0., "std": 1.}
+    out = x_node.generate_error(data, params)
+    for chunk_length in [7, 30]:
+        chunks = [data[i:i + chunk_length] for i in range(0, 100, chunk_length)]
+        assert np.array_equal(np.concatenate(list(x_node.generate_error_in_chunks(chunks, params))), out,
+                              equal_nan=True)
+    path_to_output = str(tmp_path / "output.npy")
+    assert np.array_equal(x_node.generate_error_to_file(data, path_to_output, params, chunk_length=8), out,
+                          equal_nan=True)
+
+
+def test_generate_error_in_chunks_carries_filter_state():
+    data = np.arange(1000.)
+    x_node = Array()
+    x_node.addfilter(Gap("prob_break", "prob_recover", "m_val"))
+    params = {"prob_break": .05, "prob_recover": 0., "m_val": np.nan}
+    chunks = [data[i:i + 64] for i in range(0, 1000, 64)]
+    out = np.concatenate(list(x_node.generate_error_in_chunks(chunks, params, np.random.RandomState(seed=42))))
+    first_gap = np.argmax(np.isnan(out))
+    assert 0 < first_gap < 64 and np.isnan(out[first_gap:]).all()
+
+
+def test_gap_gives_same_gaps_in_chunks_and_whole():
+    data = np.zeros((1000, 3))
+    for channel_axis in [None, 1]:
+        x_node = Array()
+        x_node.addfilter(Gap("prob_break", "prob_recover", "m_val", channel_axis=channel_axis))
+        params = {"prob_break": .05, "prob_recover": .05, "m_val": np.nan}
+        for chunk_length in [1, 64, 700]:
+            chunks = [data[i:i + chunk_length] for i in range(0, 1000, chunk_length)]
+            for make_random_state in [lambda: None, lambda: np.random.RandomState(seed=42)]:
+                out_chunks = x_node.generate_error_in_chunks(chunks, params, make_random_state())
+                out = x_node.generate_error(data, params, make_random_state())
+                assert np.isnan(out).any() and not np.isnan(out).all()
+                assert np.array_equal(np.concatenate(list(out_chunks)), out, equal_nan=True)
+
+
+def test_generate_error_to_file(tmp_path):
+    data = np.random.RandomState(0).rand(50, 4, 3)
+    path_to_data = str(tmp_path / "data.npy")
+    path_to_output = str(tmp_path / "output.npy")
+    np.save(path_to_data, data)
+    x_node = Series(Array())
+    x_node.children[0].addfilter(Missing("prob", "m_val"))
+    params = {"prob": .3, "m_val": np.nan}
+    x_node.generate_error_to_file(path_to_data, path_to_output, params, chunk_length=8,
+                                  random_state=np.random.RandomState(seed=42))
+    out = x_node.generate_error(data, params, np.random.RandomState(seed=42))
+    assert np.allclose(np.load(path_to_output), out, equal_nan=True)
+
+
+def test_parametrized_tree_shares_large_attributes():
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    x_node.filters[0].table = np.zeros(1000)
+    tree = Series(x_node).get_parametrized_tree({"prob": .5, "m_val": np.nan})
+    copy_filter = tree.children[0].filters[0]
+    assert copy_filter is not x_node.filters[0]
+    assert copy_filter.table is x_node.filters[0].table
+    assert copy_filter.probability == .5 and not hasattr(x_node.filters[0], "probability")
+
+
+def test_param_bindings_include_nested_filters():
+    x_node = Array()
+    x_node.addfilter(Addition(Constant("a"), Multiplication(Constant("b"), Identity())))
+    bindings = Series(x_node).get_param_bindings()
+    assert sorted((slot, key) for _, slot, key in bindings) == [("value", "a"), ("value", "b")]
+    out = Series(x_node).generate_error(np.ones((2, 2)), {"a": 1, "b": 3})
+    assert np.array_equal(out, np.full((2, 2), 4))
+
+
+class Wrap(Filter):
+    def __init__(self, ftr_id):
+        super().__init__()
+        self.ftr_id = ftr_id
+
+    def apply(self, node_data, random_state, named_dims):
+        self.ftr.apply(node_data, random_state, named_dims)
+
+
+def test_filters_given_as_error_params_get_their_params_bound():
+    x_node = Array()
+    x_node.addfilter(Wrap("f"))
+    assert np.array_equal(x_node.generate_error(np.zeros(3), {"f": Constant("c"), "c": 5}), np.full(3, 5))
+    assert np.array_equal(x_node.generate_error(np.zeros(3), {"f": Constant("d"), "d": 7}), np.full(3, 7))
+    inner = Constant("c")
+    wrap = Wrap("f")
+    wrap.set_params({"f": inner, "c": 1})
+    key = wrap.get_param_key()
+    wrap.set_params({"f": inner, "c": 2})
+    assert wrap.get_param_key() != key
+
+
+def test_param_slots_follow_attributes_set_later():
+    ftr = Constant("a")
+    assert ftr.get_param_slots() == [("value", "a")]
+    ftr.value_id = "b"
+    ftr.extra_id = "c"
+    assert sorted(ftr.get_param_slots()) == [("extra", "c"), ("value", "b")]
+    ftr.set_params({"b": 1, "c": 2})
+    assert ftr.value == 1 and ftr.extra == 2
+
+
+def test_series_processes_ragged_lists_in_buckets():
+    rs = np.random.RandomState(0)
+    images = [rs.randint(0, 255, size=shape).astype(float) for shape in [(7, 5, 3), (4, 6, 3), (7, 5, 3), (4, 6, 3)]]
+    x_node = Array()
+    x_node.addfilter(Resolution("k"))
+    x_node.addfilter(BlurGaussian("std"))
+    x_node.addfilter(Blur("repeats"))
+    out = Series(x_node).generate_error(images, {"k": 2, "std": 1, "repeats": 1})
+
+    assert x_node.can_process_in_buckets(images)
+    for image, out_image in zip(images, out):
+        expected = x_node.generate_error(image, {"k": 2, "std": 1, "repeats": 1})
+        assert out_image.shape == image.shape and np.allclose(out_image, expected)
+
+
+def test_series_processes_ragged_lists_in_buckets_with_random_filters():
+    images = [np.zeros((3, 2)), np.zeros((2, 2)), np.zeros((3, 2))]
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    out = Series(x_node).generate_error(images, {"prob": 1., "m_val": np.nan})
+    assert all(np.isnan(image).all() for image in out)
+    assert not any(np.isnan(image).any() for image in images)
+
+
+def test_buckets_draw_from_the_streams_of_their_items():
+    rs = np.random.RandomState(0)
+    images = [rs.rand(*shape) for shape in [(3, 2), (2, 4), (3, 2), (3, 2), (2, 4)]]
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    x_node.addfilter(Blur("repeats"))
+    x_node.addfilter(Addition(GaussianNoise("mean", "std"), Missing("prob", "m_val")))
+    params = {"prob": .3, "m_val": 0, "mean": 0, "std": 1, "repeats": 1}
+    out = Series(x_node).generate_error(images, params)
+    expected = Series(x_node, dim_name="i").generate_error(images, params)
+
+    assert x_node.can_process_in_buckets(images)
+    assert all(np.array_equal(a, b) for a, b in zip(out, expected))
+    assert not np.array_equal(out[0], out[2])
+
+
+def test_table_node_works_with_data_frames():
+    df = pd.DataFrame({"a": np.zeros(5), "b": np.arange(5), "c": list("abcde")}, index=[4, 3, 2, 1, 0])
+    a_node = Array()
+    a_node.addfilter(Missing("prob", "m_val"))
+    b_node = Array()
+    b_node.addfilter(SensorDrift("magnitude"))
+    root_node = Table({"a": a_node, "b": b_node})
+    out = root_node.generate_error(df, {"prob": 1., "m_val": np.nan, "magnitude": 1})
+    assert list(out.dtypes) == list(df.dtypes)
+    assert out["a"].isna().all() and list(out["b"]) == [1, 3, 5, 7, 9] and list(out["c"]) == list("abcde")
+    assert list(out.index) == [4, 3, 2, 1, 0] and not df["a"].isna().any()
+
+
+def test_table_node_works_with_dicts_and_structured_arrays():
+    b_node = Array()
+    b_node.addfilter(SensorDrift("magnitude"))
+    root_node = Table({"b": b_node})
+    out = root_node.generate_error({"a": [0, 0], "b": [1, 1]}, {"magnitude": 1})
+    assert out == {"a": [0, 0], "b": [2, 3]}
+    data = np.array([(0, 1.), (0, 1.)], dtype=[("a", int), ("b", float)])
+    out = root_node.generate_error(data, {"magnitude": 1})
+    assert out.dtype == data.dtype and list(out["b"]) == [2., 3.]
+
+
+def test_identity_filters_are_skipped():
+    data = np.zeros((5, 5, 3))
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    x_node.addfilter(StainArea("stain_prob", "radius_generator", "transparency"))
+    root_node = Series(x_node)
+    params = {"prob": 0., "m_val": np.nan, "stain_prob": 0., "radius_generator": GaussianRadiusGenerator(1, 1),
+              "transparency": .5}
+    assert root_node.get_parametrized_tree(params).is_identity()
+    assert np.array_equal(root_node.generate_error(data, params), data)
+    params["prob"] = .5
+    tree = root_node.get_parametrized_tree(params)
+    assert not tree.is_identity() and tree.children[0].get_active_filters() == tree.children[0].filters[:1]
+
+
+def test_rain_clips_the_data_without_raindrops():
+    x_node = Array()
+    x_node.addfilter(Rain("rain_prob", "range"))
+    params = {"rain_prob": 0., "range": 1}
+    assert not x_node.get_parametrized_tree(params).is_identity()
+    assert np.array_equal(x_node.generate_error(np.full((4, 4, 3), 2.), params), np.ones((4, 4, 3)))
+
+
+def test_error_sweep_uses_common_random_numbers():
+    data = np.ones((50, 20))
+    x_node = Array()
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    x_node.addfilter(Missing("prob", "m_val"))
+    params_list = [{"mean": 0., "std": std, "prob": prob, "m_val": np.nan}
+                   for std, prob in [(.5, .1), (1., .3), (2., .6)]]
+    sweep = x_node.generate_error_sweep(data, params_list)
+    assert sweep.shape == (3, 50, 20)
+    missing = np.isnan(sweep)
+    assert np.all(missing[0] <= missing[1]) and np.all(missing[1] <= missing[2])
+    both = ~missing[1]
+    assert np.allclose((sweep[1] - data)[both], 2 * (sweep[0] - data)[both])
+
+
+def test_error_sweep_falls_back_to_identically_seeded_levels():
+    data = np.ones((10, 100))
+    x_node = Array()
+    x_node.addfilter(Gap("prob_break", "prob_recover", "value"))
+    root_node = Series(x_node)
+    params_list = [{"prob_break": prob, "prob_recover": .5, "value": 0} for prob in [.1, .2]]
+    sweep = root_node.generate_error_sweep(data, params_list, np.random.RandomState(3))
+    seed = np.random.RandomState(3).randint(2 ** 31)
+    for err_data, params in zip(sweep, params_list):
+        assert np.array_equal(err_data, root_node.generate_error(data, params, np.random.RandomState(seed)))
+
+
+def test_generate_errors_with_shared_prefixes_matches_generate_error():
+    data = np.arange(60.).reshape((3, 20))
+    x_node = Array(reshape=(6, 10))
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    x_node.addfilter(Gap("prob_break", "prob_recover", "value"))
+    x_node.addfilter(Clip("min", "max"))
+    params_list = [{"mean": 0., "std": std, "prob_break": prob, "prob_recover": .5, "value": 0., "min": 5, "max": m}
+                   for std in [1., 2.] for prob in [0., .2] for m in [30, 50]]
+    err_data = x_node.generate_errors(data, params_list, np.random.RandomState(7))
+    assert len(err_data) == len(params_list)
+    for item_data, params in zip(err_data, params_list):
+        assert np.array_equal(item_data, x_node.generate_error(data, params, np.random.RandomState(7)))
+    x_node.reshape = None
+    root_node = Series(x_node)
+    assert np.array_equal(root_node.generate_errors(data, params_list, np.random.RandomState(7))[3],
+                          root_node.generate_error(data, params_list[3], np.random.RandomState(7)))
+
+
+class CountingNoise(GaussianNoise):
+    n_applied = 0
+
+    def apply(self, node_data, random_state, named_dims):
+        CountingNoise.n_applied += 1
+        super().apply(node_data, random_state, named_dims)
+
+
+def test_series_generate_errors_shares_prefixes_for_every_element():
+    rs = np.random.RandomState(0)
+    images = [rs.rand(4, 6), rs.rand(5, 3), rs.rand(4, 6)]
+    x_node = Array()
+    x_node.addfilter(CountingNoise("mean", "std"))
+    x_node.addfilter(Missing("prob", "m_val"))
+    params_list = [{"mean": 0., "std": 1., "prob": prob, "m_val": 0.} for prob in [.1, .5, .9]]
+    for root_node, data in [(Series(x_node), images), (Series(x_node, dim_name="time"), rs.rand(3, 4, 6)),
+                            (TupleSeries([x_node, Array()]), (rs.rand(3, 4), rs.rand(3, 2)))]:
+        CountingNoise.n_applied = 0
+        err_data = root_node.generate_errors(data, params_list)
+        assert CountingNoise.n_applied == 3
+        for item_data, params in zip(err_data, params_list):
+            expected = root_node.generate_error(data, params)
+            assert all(np.array_equal(a, b) for a, b in zip(item_data, expected))
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 import json
+import os
 import tempfile
 
 import numpy as np
@@ -68,3 +69,31 @@ def test_normalize_probs():
 def test_to_time_series_x_y():
     x, y = pg_utils.to_time_series_x_y(np.array([0, 1, 2, 3, 4, 5]), 3)
     assert np.array_equal(x, np.array([[0, 1, 2], [1, 2, 3], [2, 3, 4]])) and np.array_equal(y, np.array([3, 4, 5]))
+
+
+def test_ocr_error_model_samples_from_weights():
+    model = pg_utils.OCRErrorModel({"a": [["a", "o", "ä"], [1, 2, 5]], "b": [["b"], [1]]})
+    key_indices = np.zeros(80000, dtype=np.int64)
+    options = model.sample(key_indices, np.random.RandomState(42))
+    assert np.bincount(options, minlength=4)[:3] / len(options) == approx([1 / 8, 2 / 8, 5 / 8], abs=0.01)
+    assert np.all(model.sample(np.ones(10, dtype=np.int64), np.random.RandomState(42)) == 3)
+
+
+def test_ocr_error_model_finds_characters():
+    model = pg_utils.OCRErrorModel({"a": [["o"], [1]], "c": [["e"], [1]]})
+    positions, key_indices = model.find_characters(np.array([ord(c) for c in "abcda"], dtype=np.uint32))
+    assert list(positions) == [0, 2, 4]
+    assert list(key_indices) == [0, 1, 0]
+
+
+def test_load_ocr_error_model_caches_compiled_model():
+    temp = tempfile.NamedTemporaryFile(suffix=".json")
+    temp.write(bytes(json.dumps({"a": [["a", "o"], [20, 5]]}), encoding='UTF-8'))
+    temp.seek(0)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        model = pg_utils.load_ocr_error_model(temp.name, cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+        cached = pg_utils.load_ocr_error_model(temp.name, cache_dir)
+    assert list(cached.keys) == list(model.keys)
+    assert np.array_equal(cached.acceptance_probabilities, model.acceptance_probabilities)
+    assert np.array_equal(cached.aliases, model.aliases)
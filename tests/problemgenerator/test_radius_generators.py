@@ -46,3 +46,19 @@ def test_gaussian_radius_generator_returns_distinct_values():
     for _ in range(0, 50):
         s.add(r.generate(rs))
     assert len(s) != 1
+
+
+def test_probability_array_radius_generator_generates_many_with_given_probabilities():
+    r = radius_generators.ProbabilityArrayRadiusGenerator([.3, .4, .2])
+    radii = r.generate_many(100000, np.random.RandomState(seed=42))
+    assert np.all(np.abs(np.bincount(radii) / len(radii) - [.4, .4, .2]) < .01)
+    no_radius = radius_generators.ProbabilityArrayRadiusGenerator([0, 0, 0])
+    assert np.all(no_radius.generate_many(10, np.random.RandomState(seed=42)) == 0)
+
+
+def test_gaussian_radius_generator_generates_many_non_negative_radii():
+    r = radius_generators.GaussianRadiusGenerator(2, 3)
+    radii = r.generate_many(100000, np.random.RandomState(seed=42))
+    assert radii.dtype.kind == "i"
+    assert np.all(radii >= 0)
+    assert abs(radii.mean() - np.mean([r.generate(np.random.RandomState(seed=i)) for i in range(2000)])) < .2
@@ -0,0 +1,46 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+from dpemu.corpus import Corpus
+
+
+def test_corpus_survives_round_trip():
+    strings = ["hello world", "", "äöå\n€", "\U0001F600 emoji", "\ud800 lone surrogate"]
+    corpus = Corpus.from_strings(strings)
+    assert len(corpus) == 5
+    assert corpus.to_strings() == strings
+    assert [corpus[i] for i in range(5)] == strings
+    assert np.array_equal(corpus.lengths(), [len(s) for s in strings])
+
+
+def test_corpus_is_not_padded():
+    corpus = Corpus.from_strings(["a" * 1000, "b", "c"])
+    assert corpus.codepoints.shape == (1002,)
+    assert np.array_equal(corpus.document_indices()[-3:], [0, 1, 2])
+
+
+def test_corpus_code_points_can_be_modified():
+    corpus = Corpus.from_strings(["abc", "de"])
+    corpus.codepoints[corpus.document_indices() == 1] = ord("x")
+    assert corpus.to_strings() == ["abc", "xx"]
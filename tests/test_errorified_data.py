@@ -0,0 +1,125 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+from dpemu.errorified_data import ErrorifiedBatchLoader, ErrorifiedDataset
+from dpemu.filters.common import GaussianNoise, Missing
+from dpemu.nodes import Array, Series, TupleSeries
+
+
+def get_series_root_node():
+    x_node = Array()
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    return Series(x_node)
+
+
+def test_errorified_dataset_has_same_length_as_data():
+    data = np.zeros((10, 3))
+    dataset = ErrorifiedDataset(data, get_series_root_node(), {"mean": 0, "std": 1})
+    assert len(dataset) == 10
+
+
+def test_errorified_dataset_items_do_not_depend_on_access_order_or_cache():
+    data = np.zeros((10, 3))
+    params = {"mean": 0, "std": 1}
+    dataset1 = ErrorifiedDataset(data, get_series_root_node(), params, seed=1, cache_size=2)
+    dataset2 = ErrorifiedDataset(data, get_series_root_node(), params, seed=1, cache_size=2)
+    items1 = [dataset1[i] for i in range(10)]
+    items2 = [dataset2[i] for i in reversed(range(10))][::-1]
+    assert all(np.array_equal(a, b) for a, b in zip(items1, items2))
+    assert np.array_equal(dataset1[0], items1[0])
+    assert not np.array_equal(items1[0], items1[1])
+    assert np.array_equal(data, np.zeros((10, 3)))
+
+
+def test_errorified_dataset_items_match_generate_error():
+    data = np.zeros((10, 3))
+    params = {"mean": 0, "std": 1}
+    dataset = ErrorifiedDataset(data, get_series_root_node(), params, seed=5)
+    assert np.array_equal(np.array([dataset[i] for i in range(10)]),
+                          get_series_root_node().generate_error(data, params, 5))
+
+
+def test_errorified_dataset_depends_on_seed():
+    data = np.zeros((10, 3))
+    params = {"mean": 0, "std": 1}
+    dataset1 = ErrorifiedDataset(data, get_series_root_node(), params, seed=1)
+    dataset2 = ErrorifiedDataset(data, get_series_root_node(), params, seed=2)
+    assert not np.array_equal(dataset1[3], dataset2[3])
+
+
+def test_errorified_dataset_cache_is_bounded():
+    dataset = ErrorifiedDataset(np.zeros((10, 3)), get_series_root_node(), {"mean": 0, "std": 1}, cache_size=3)
+    for i in range(10):
+        dataset[i]
+    assert len(dataset._cache) == 3
+
+
+def test_modifying_errorified_dataset_items_does_not_change_later_items():
+    dataset = ErrorifiedDataset(np.zeros((10, 3)), get_series_root_node(), {"mean": 0, "std": 1})
+    item = dataset[4]
+    expected = item.copy()
+    item[:] = 100
+    dataset[4][:] = 100
+    assert np.array_equal(dataset[4], expected)
+
+
+def test_errorified_dataset_works_with_lists_and_tuple_series():
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    root_node = TupleSeries([x_node, Array()])
+    data = ([0., 1., 2.], np.array([3., 4., 5.]))
+    dataset = ErrorifiedDataset(data, root_node, {"prob": 1, "m_val": np.nan})
+    x, y = dataset[-1]
+    assert len(dataset) == 3 and np.isnan(x) and y == 5.
+
+
+def test_errorified_batch_loader_yields_all_elements_with_labels():
+    data = np.arange(23.).reshape((23, 1))
+    labels = np.arange(23)
+    loader = ErrorifiedBatchLoader(data, get_series_root_node(), {"mean": 0, "std": 0}, batch_size=5, labels=labels,
+                                   shuffle=True)
+    batches = list(loader)
+    assert len(loader) == len(batches) == 5
+    assert [len(y) for _, y in batches] == [5, 5, 5, 5, 3]
+    for x, y in batches:
+        assert np.array_equal(x[:, 0], y)
+    assert sorted(np.concatenate([y for _, y in batches])) == list(range(23))
+
+
+def test_errorified_batch_loader_does_not_depend_on_number_of_workers():
+    data = np.zeros((20, 3))
+    params = {"mean": 0, "std": 1}
+    batches1 = list(ErrorifiedBatchLoader(data, get_series_root_node(), params, batch_size=4, shuffle=True))
+    batches2 = list(ErrorifiedBatchLoader(data, get_series_root_node(), params, batch_size=4, shuffle=True,
+                                          n_workers=3, prefetch=1))
+    assert all(np.array_equal(a, b) for a, b in zip(batches1, batches2))
+
+
+def test_errorified_batch_loader_shuffles_differently_every_epoch():
+    data = np.arange(50)
+    loader = ErrorifiedBatchLoader(data, Array(), {}, batch_size=50, shuffle=True)
+    epoch1 = next(iter(loader))
+    epoch2 = next(iter(loader))
+    assert not np.array_equal(epoch1, epoch2)
+    assert np.array_equal(np.sort(epoch1), data)
@@ -0,0 +1,111 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import numpy as np
+
+from dpemu.filters.common import GaussianNoise, Missing
+from dpemu.nodes import Array, Series, Table, TupleSeries
+from dpemu.rng import RandomStreams
+
+
+def get_root_node():
+    x_node = Array()
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    x_node.addfilter(Missing("prob", "m_val"))
+    return Series(x_node)
+
+
+def test_streams_depend_only_on_seed_and_path():
+    streams = RandomStreams(1)
+    a = streams.spawn("x").spawn_index(3).get_random_state(0).rand(5)
+    streams.get_random_state(0).rand(100)
+    assert np.array_equal(a, RandomStreams(1, ("x", None), indices=(3,)).get_random_state(0).rand(5))
+    assert not np.array_equal(a, RandomStreams(1, ("x", None), indices=(4,)).get_random_state(0).rand(5))
+    assert not np.array_equal(a, RandomStreams(2, ("x", None), indices=(3,)).get_random_state(0).rand(5))
+    assert np.array_equal(RandomStreams(1, ("x",), offset=2).spawn_index(1).get_random_state(0).rand(5), a)
+
+
+def test_elements_share_key_but_not_random_numbers():
+    streams = RandomStreams(1).spawn("x")
+    keys_and_counters = [streams.spawn_index(i).get_stream_key_and_counter(0) for i in range(3)]
+    assert len({key for key, _ in keys_and_counters}) == 1
+    first = streams.spawn_index(0).get_random_state(0).normal(size=5)
+    streams.spawn_index(1).get_random_state(0).normal(size=3)
+    assert np.array_equal(streams.spawn_index(0).get_random_state(0).normal(size=5), first)
+    assert not np.array_equal(streams.spawn_index(1).get_random_state(0).normal(size=5), first)
+    deep = streams
+    for i in range(5):
+        deep = deep.spawn_index(i)
+    other = streams
+    for i in [1, 0, 2, 3, 4]:
+        other = other.spawn_index(i)
+    assert not np.array_equal(deep.get_random_state(0).rand(5), other.get_random_state(0).rand(5))
+
+
+def test_generate_error_does_not_depend_on_call_history():
+    data = np.zeros((20, 4))
+    params = {"mean": 0, "std": 1, "prob": .2, "m_val": np.nan}
+    out = get_root_node().generate_error(data, params)
+    get_root_node().generate_error(data, params)
+    np.random.rand(10)
+    assert np.array_equal(get_root_node().generate_error(data, params), out, equal_nan=True)
+    assert not np.array_equal(get_root_node().generate_error(data, params, 43), out, equal_nan=True)
+
+
+def test_filters_do_not_reseed_global_random_state():
+    np.random.seed(0)
+    expected = np.random.RandomState(0).rand(3)
+    GaussianNoise("mean", "std")
+    assert np.array_equal(np.random.rand(3), expected)
+
+
+def test_skipped_filters_do_not_change_streams_of_other_filters():
+    data = np.zeros((20, 4))
+    out1 = get_root_node().generate_error(data, {"mean": 0, "std": 1, "prob": 0, "m_val": np.nan})
+    out2 = get_root_node().generate_error(data, {"mean": 0, "std": 1, "prob": .5, "m_val": np.nan})
+    assert np.array_equal(out1[~np.isnan(out2)], out2[~np.isnan(out2)])
+
+
+def test_elements_get_same_errors_in_chunks_and_alone():
+    data = np.zeros((30, 4))
+    params = {"mean": 0, "std": 1, "prob": .2, "m_val": np.nan}
+    root_node = get_root_node()
+    out = root_node.generate_error(data, params)
+    chunks = [data[i:i + 7] for i in range(0, 30, 7)]
+    assert np.array_equal(np.concatenate(list(root_node.generate_error_in_chunks(chunks, params))), out,
+                          equal_nan=True)
+    assert np.array_equal(root_node.generate_error(data[12:13], params, RandomStreams(42, offset=12))[0], out[12],
+                          equal_nan=True)
+
+
+def test_tuple_series_and_table_use_streams():
+    x_node = Array()
+    x_node.addfilter(GaussianNoise("mean", "std"))
+    params = {"mean": 0, "std": 1}
+    data = (np.zeros((5, 2)), np.zeros((5, 2)))
+    out = TupleSeries([x_node, x_node]).generate_error(data, params)
+    assert not np.array_equal(out[0], out[1])
+    table = {"a": np.zeros(5), "b": np.zeros(5)}
+    out = Table({"a": x_node, "b": x_node}).generate_error(table, params)
+    assert not np.array_equal(out["a"], out["b"])
+    assert np.array_equal(Table({"b": x_node}).generate_error(table, params)["b"], out["b"])
@@ -0,0 +1,122 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import numpy as np
+import pytest
+
+from dpemu.filters.common import Missing
+from dpemu.filters.image import Blur, Resolution
+from dpemu.nodes import Array, Series
+from dpemu.runner import get_preflight_errors, group_indices_by_shared_prefix, run, run_preflight
+
+
+class IdentityPreprocessor:
+    def run(self, train_data, test_data, params):
+        return train_data, test_data, {}
+
+
+class MeanModel:
+    def run(self, train_data, test_data, params):
+        return {"train_mean": float(np.mean(train_data)), "test_mean": float(np.mean(test_data))}
+
+
+def get_image_root_node():
+    x_node = Array(reshape=(4, 4))
+    x_node.addfilter(Resolution("k"))
+    x_node.addfilter(Missing("prob", "m_val"))
+    return Series(x_node)
+
+
+def test_preflight_reports_all_errors():
+    data = np.zeros((5, 16))
+    err_params_list = [
+        {"k": 2, "prob": .1, "m_val": 0},
+        {"k": 2, "m_val": 0},
+        {"k": 1.5, "prob": .1, "m_val": 0},
+        {"k": 2, "prob": "high", "m_val": 0},
+    ]
+    errors = get_preflight_errors(data, get_image_root_node(), err_params_list)
+    assert len(errors) == 3
+    assert "err_params_list[1]" in errors[0] and "prob" in errors[0]
+    assert "err_params_list[2]" in errors[1] and "Integral" in errors[1]
+    assert "err_params_list[3]" in errors[2] and "str" in errors[2]
+    with pytest.raises(Exception, match="Preflight validation failed"):
+        run_preflight(data, get_image_root_node(), err_params_list)
+
+
+def test_preflight_dry_runs_tree_on_sample():
+    err_params_list = [{"k": 2, "prob": .1, "m_val": 0}]
+    assert not get_preflight_errors(np.zeros((5, 16)), get_image_root_node(), err_params_list)
+    errors = get_preflight_errors(np.zeros((5, 15)), get_image_root_node(), err_params_list)
+    assert len(errors) == 1 and "dry run failed with ValueError" in errors[0]
+    x_node = Array(reshape=(4, 4))
+    assert get_preflight_errors(np.zeros(15), x_node, [{}])[0].startswith("Cannot reshape")
+
+
+def test_preflight_accepts_integral_floats_and_dry_runs_array_roots():
+    x_node = Array()
+    x_node.addfilter(Blur("repeats"))
+    x_node.addfilter(Missing("prob", "m_val"))
+    err_params_list = [{"repeats": repeats, "prob": .1, "m_val": 0} for repeats in np.linspace(1, 3, 3)]
+    assert not get_preflight_errors(np.zeros((5, 16)), x_node, err_params_list)
+    errors = get_preflight_errors(np.zeros((5, 16)), x_node, [{"repeats": 1.5, "prob": .1, "m_val": 0},
+                                                              {"repeats": 1, "prob": .1, "m_val": "none"}])
+    assert len(errors) == 2 and "Integral" in errors[0]
+    assert "err_params_list[1]: dry run failed with ValueError" in errors[1]
+
+
+@pytest.mark.parametrize("share_error_prefixes", [False, True])
+@pytest.mark.parametrize("is_series", [False, True])
+def test_run_copies_results_of_identity_combinations_and_keeps_order(share_error_prefixes, is_series):
+    train_data = np.arange(40.).reshape((10, 4))
+    test_data = np.arange(20.).reshape((5, 4))
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    root_node = Series(x_node) if is_series else x_node
+    err_params_list = [
+        {"prob": 0., "m_val": 0.},
+        {"prob": .5, "m_val": -100.},
+        {"prob": 0., "m_val": 1.},
+        {"prob": 1., "m_val": 0.},
+    ]
+    model_params_dict_list = [{"model": MeanModel, "params_list": [{"k": 1}, {"k": 2}]}]
+    df = run(train_data, test_data, IdentityPreprocessor, {}, root_node, err_params_list, model_params_dict_list,
+             n_processes=2, share_error_prefixes=share_error_prefixes)
+
+    assert len(df) == 8
+    assert list(df["prob"]) == [0., 0., .5, .5, 0., 0., 1., 1.]
+    assert list(df["m_val"]) == [0., 0., -100., -100., 1., 1., 0., 0.]
+    assert list(df["k"]) == [1, 2] * 4
+    clean = df[df["prob"] == 0]
+    assert (clean["test_mean"] == test_data.mean()).all() and (clean["time_err"] == 0).all()
+    assert df["test_mean"][2] == np.mean(root_node.generate_error(test_data, err_params_list[1]))
+    assert df["train_mean"][6] == 0 and df["test_mean"][6] == 0
+
+
+def test_prefix_groups_follow_leaf_array_of_series():
+    x_node = Array()
+    x_node.addfilter(Missing("prob", "m_val"))
+    x_node.addfilter(Resolution("k"))
+    err_params_list = [{"prob": prob, "m_val": 0, "k": k} for prob in [.1, .2] for k in [1, 2]]
+    assert group_indices_by_shared_prefix(Series(x_node), err_params_list, [0, 1, 2, 3]) == [[0, 1], [2, 3]]
+    assert group_indices_by_shared_prefix(Series(Series(x_node)), err_params_list, [0, 1]) == [[0], [1]]
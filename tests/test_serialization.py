@@ -0,0 +1,97 @@
+# MIT License
+#
+# Copyright (c) 2019 Tuomas Halvari, Juha Harviainen, Juha Mylläri, Antti Röyskö, Juuso Silvennoinen
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+
+import numpy as np
+import pytest
+
+from dpemu.filters import Addition, Constant, Identity
+from dpemu.filters.common import ApplyToTuple, Missing
+from dpemu.filters.time_series import Gap
+from dpemu.nodes import Array, Series
+from dpemu.serialization import tree_from_dict, tree_from_json, tree_hash, tree_to_dict, tree_to_json
+
+
+def get_root_node(prob_id="prob"):
+    x_node = Array(reshape=(2, 3))
+    x_node.addfilter(Missing(prob_id, "m_val"))
+    x_node.addfilter(Addition(Constant("c"), Identity()))
+    x_node.addfilter(Gap("prob_break", "prob_recover", "m_val"))
+    return Series(x_node, dim_name="time")
+
+
+def test_tree_survives_round_trip():
+    root_node = get_root_node()
+    loaded = tree_from_json(tree_to_json(root_node))
+    x_node = loaded.children[0]
+    assert isinstance(loaded, Series) and loaded.dim_name == "time"
+    assert x_node.reshape == (2, 3)
+    assert [type(f) for f in x_node.filters] == [Missing, Addition, Gap]
+    assert isinstance(x_node.filters[1].filter_a, Constant)
+
+    data = np.random.RandomState(0).rand(4, 6)
+    params = {"prob": .3, "m_val": np.nan, "c": 1., "prob_break": .2, "prob_recover": .5}
+    out1 = root_node.generate_error(data, params, np.random.RandomState(42))
+    out2 = loaded.generate_error(data, params, np.random.RandomState(42))
+    assert np.allclose(out1, out2, equal_nan=True)
+
+
+def test_tree_dict_is_json_serializable_and_ignores_bound_values():
+    root_node = get_root_node()
+    tree_dict = tree_to_dict(root_node)
+    root_node.set_error_params({"prob": .3, "m_val": np.nan, "c": 1., "prob_break": .2, "prob_recover": .5})
+    assert json.loads(json.dumps(tree_dict)) == tree_to_dict(root_node)
+    assert tree_to_dict(tree_from_dict(tree_dict)) == tree_dict
+
+
+def test_tree_hash_is_stable_and_content_based():
+    assert tree_hash(get_root_node()) == tree_hash(get_root_node())
+    assert tree_hash(get_root_node()) != tree_hash(get_root_node("other_prob"))
+
+
+def test_tuples_are_preserved():
+    x_node = Array()
+    x_node.addfilter(ApplyToTuple(Identity(), 1))
+    x_node.filters[0].shape = (1, 2)
+    loaded = tree_from_dict(tree_to_dict(x_node))
+    assert loaded.filters[0].shape == (1, 2) and loaded.filters[0].tuple_index == 1
+
+
+def test_unserializable_attribute_raises_type_error():
+    x_node = Array()
+    x_node.addfilter(Identity())
+    x_node.filters[0].table = object()
+    with pytest.raises(TypeError):
+        tree_to_dict(x_node)
+
+
+def test_runtime_state_of_filters_is_not_serialized():
+    x_node = Array()
+    x_node.addfilter(Gap("prob_break", "prob_recover", "m_val", channel_axis=1))
+    hash_before = tree_hash(x_node)
+    x_node.set_error_params({"prob_break": 1., "prob_recover": 0., "m_val": -1})
+    x_node.process(np.zeros((10, 3)), np.random.RandomState(0))
+    assert not x_node.filters[0].working.any()
+    assert tree_hash(x_node) == hash_before
+    loaded = tree_from_json(tree_to_json(x_node))
+    assert loaded.filters[0].working